@@ -1,6 +1,8 @@
 # backend/app/api/v1/chat.py
 
-from typing import List
+import json
+import logging
+from typing import Any, Dict, List, Optional
 
 from fastapi import (
     APIRouter,
@@ -8,59 +10,368 @@ from fastapi import (
     WebSocketDisconnect,
     Depends,
     HTTPException,
+    Query,
+    Response,
     status,
 )
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 
-from app.core.security import decode_access_token
-from app.core.connection_manager import ConnectionManager
-from app.db.session import get_db
+from app.core.auth_cache import authenticate_token, user_exists
+from app.core.broker import create_broker
+from app.core.connection_manager import PONG, ConnectionManager
+from app.core.message_bodies import ContentTooLarge, stream_body
+from app.core.message_ingest import DuplicateMessage, MessageIngest
+from app.core.message_search import decode_cursor, encode_cursor, search_messages
+from app.core.metrics import REGISTRY
+from app.core.presence import PresenceHub
+from app.core.profiling import profile_queries
+from app.core.rate_limit import RateLimited, limiter
+from app.core.rooms import RoomHub
+from app.core.wire import FrameTooLarge
+from app.core.config import (
+    CONVERSATION_PAGE_SIZE,
+    CONVERSATION_MAX_PAGE_SIZE,
+    HISTORY_PAGE_SIZE,
+    HISTORY_MAX_PAGE_SIZE,
+    MESSAGE_SEARCH_PAGE_SIZE,
+    MESSAGE_SEARCH_MAX_PAGE_SIZE,
+    SYNC_BATCH_LIMIT,
+)
+from app.core.conversations import list_all_conversations, recount_unread, update_conversations
+from app.core.history import conversation_history, find_message, stream_conversation
+from app.core.inbox import (
+    advance_delivered,
+    fetch_inbox,
+    get_delivered_ids,
+    get_receipts,
+    mark_read,
+)
+from app.db.base import MAX_ID
+from app.db.session import note_write, session_scope
+from app.db.shards import conversation_session
 from app.models.user import User
-from app.models.message import ChatMessage
+from app.models.message import CLIENT_MSG_ID_MAX_LENGTH, ChatMessage
+from app.schemas.conversation import ConversationRead
 from app.schemas.message import MessageRead
-from app.api.v1.users import get_current_user  # REST auth dependency
+from app.api.v1.users import get_current_user, get_read_db  # REST auth dependencies
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["chat"])
-manager = ConnectionManager()
+manager = ConnectionManager(create_broker())
+ingest = MessageIngest(hooks=[update_conversations])
+presence = PresenceHub(manager)
+rooms = RoomHub(manager)
+
+REGISTRY.gauge_callback(
+    "nextext_ws_connected_users",
+    "Users with at least one WebSocket on this worker",
+    lambda: {(): len(manager.active_connections)},
+)
+REGISTRY.gauge_callback(
+    "nextext_ws_connections",
+    "WebSocket connections on this worker",
+    lambda: {(): len(manager.connections)},
+)
+
+
+def _send_queue_depth():
+    depths = manager.queue_depths()
+    return {("total",): sum(depths), ("max",): max(depths, default=0)}
+
+
+REGISTRY.gauge_callback(
+    "nextext_ws_send_queue_depth",
+    "Frames waiting in this worker's send queues: total and largest queue",
+    _send_queue_depth,
+    ("stat",),
+)
 
 
-async def get_current_user_ws(
-    token: str,
-    db: AsyncSession,
-) -> User:
+def message_payload(msg: ChatMessage) -> Dict[str, Any]:
+    """
+    Serialize a ChatMessage into the dict pushed over WebSockets and NDJSON exports.
     """
-    Decode JWT from WebSocket query param & fetch the User.
+    return {
+        "id": msg.id,
+        "sender_id": msg.sender_id,
+        "recipient_id": msg.recipient_id,
+        "content": msg.content,
+        "timestamp": msg.timestamp.isoformat(),
+        "body_length": msg.body_length,
+        "seq": msg.seq,
+        "client_msg_id": msg.client_msg_id,
+    }
+
+
+async def get_current_user_ws(token: str) -> User:
+    """
+    Decode JWT from WebSocket query param & fetch the User (via the auth cache).
     """
     try:
-        payload = decode_access_token(token)
-        username: str = payload.get("sub")
-        if not username:
-            raise ValueError("Missing subject in token")
-    except Exception:
+        return await authenticate_token(token)
+    except ValueError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
         )
 
-    result = await db.execute(select(User).filter_by(username=username))
-    user = result.scalars().first()
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found",
+
+async def handle_message_frame(websocket: WebSocket, user: User, data: dict):
+    """
+    {"to": <user id>, "content": <text>, "client_msg_id": <text, optional>}:
+    persist and deliver a message. Messages to unknown users, content over
+    the size limit or over the user's message rate, and messages that could
+    not be stored are answered with an error frame; large content is
+    delivered as a preview with body_length set.
+    A retry with an already used client_msg_id stores and delivers nothing:
+    the original message is sent back to this socket as its acknowledgement.
+    """
+    to_user_id = data.get("to")
+    content = data.get("content")
+    if to_user_id is None or content is None:
+        return
+    to_user_id = int(to_user_id)
+    if not await user_exists(to_user_id):
+        manager.send_to_socket(websocket, {
+            "type": "error",
+            "reason": "unknown_recipient",
+            "detail": f"User {to_user_id} does not exist",
+        })
+        return
+    client_msg_id = data.get("client_msg_id")
+    if client_msg_id is not None:
+        client_msg_id = str(client_msg_id)
+        if not 0 < len(client_msg_id) <= CLIENT_MSG_ID_MAX_LENGTH:
+            manager.send_to_socket(websocket, {
+                "type": "error",
+                "reason": "invalid_client_msg_id",
+                "detail": f"client_msg_id must be 1 to {CLIENT_MSG_ID_MAX_LENGTH} characters",
+            })
+            return
+
+    try:
+        await limiter.hit("ws_messages", user.id)
+    except RateLimited as e:
+        manager.send_to_socket(websocket, {
+            "type": "error",
+            "reason": "rate_limited",
+            "retry_after": round(e.retry_after, 3),
+        })
+        return
+
+    # Persist the message (batched with other connections' messages)
+    try:
+        msg = await ingest.submit(
+            sender_id=user.id,
+            recipient_id=to_user_id,
+            content=str(content),
+            client_msg_id=client_msg_id,
         )
-    return user
+    except ContentTooLarge as e:
+        manager.send_to_socket(websocket, {
+            "type": "error",
+            "reason": "content_too_large",
+            "detail": str(e),
+        })
+        return
+    except DuplicateMessage as e:
+        manager.send_to_socket(websocket, message_payload(e.message))
+        return
+    except Exception:
+        # The batch logged the cause; the client may retry with its client_msg_id
+        manager.send_to_socket(websocket, {
+            "type": "error",
+            "reason": "not_stored",
+            "detail": "The message could not be stored",
+            "client_msg_id": client_msg_id,
+        })
+        return
+
+    payload = message_payload(msg)
+    await note_write(user.id)
+    presence.message_sent(msg.sender_id, msg.recipient_id)
+
+    # Send to recipient and echo back to sender
+    await manager.send_personal_message(payload, msg.recipient_id)
+    await manager.send_personal_message(payload, user.id)
+
+
+async def handle_sync_frame(websocket: WebSocket, user: User, data: dict):
+    """
+    {"type": "sync", "since": {<peer id>: <id>, ...} (optional)}: push the
+    messages addressed to the user past their delivery watermarks (or past
+    `since`, where it is further ahead) in one batched frame. "cursor" maps
+    each sender to the last id pushed so far; clients repeat with
+    since=cursor while "more" is true.
+    """
+    cursor = {
+        int(peer_id): int(since) for peer_id, since in dict(data.get("since") or {}).items()
+    }
+    async with session_scope() as db:
+        delivered = await get_delivered_ids(db, user.id)
+    for peer_id, since in cursor.items():
+        delivered[peer_id] = max(delivered.get(peer_id, 0), since)
+    messages, more = await fetch_inbox(user.id, delivered, SYNC_BATCH_LIMIT)
+    for msg in messages:
+        cursor[msg.sender_id] = msg.id
+
+    manager.send_to_socket(websocket, {
+        "type": "sync",
+        "messages": [message_payload(msg) for msg in messages],
+        "cursor": cursor,
+        "more": more,
+    })
+
+
+async def handle_ack_frame(websocket: WebSocket, user: User, data: dict):
+    """
+    {"type": "ack", "up_to": {<peer id>: <id>, ...}}: advance the delivery
+    watermark of each conversation and send a delivery receipt to every
+    peer whose watermark moved.
+    """
+    up_to = {}
+    for peer_id, delivered_id in dict(data["up_to"]).items():
+        peer_id, delivered_id = int(peer_id), int(delivered_id)
+        if not 0 < delivered_id <= MAX_ID:
+            raise ValueError(f"Invalid message id {delivered_id}")
+        if await user_exists(peer_id):
+            up_to[peer_id] = delivered_id
+    async with session_scope() as db:
+        moved = await advance_delivered(db, user.id, up_to)
+
+    for peer_id, delivered_id in moved.items():
+        await manager.send_personal_message(
+            {"type": "receipt", "status": "delivered", "user_id": user.id, "up_to": delivered_id},
+            peer_id,
+        )
+
+
+async def handle_read_frame(websocket: WebSocket, user: User, data: dict):
+    """
+    {"type": "read", "peer": <user id>, "up_to": <id>}: advance the read
+    watermark for messages from `peer`, refresh the user's unread counter
+    for that conversation and notify the peer and the user's other sessions
+    of the resulting watermark. An unknown peer is answered with an error
+    frame.
+    """
+    peer_id = int(data["peer"])
+    up_to = int(data["up_to"])
+    if not 0 < up_to <= MAX_ID:
+        raise ValueError(f"Invalid message id {up_to}")
+    if not await user_exists(peer_id):
+        manager.send_to_socket(websocket, {
+            "type": "error",
+            "reason": "unknown_peer",
+            "detail": f"User {peer_id} does not exist",
+        })
+        return
+    async with session_scope() as db:
+        read_id = await mark_read(db, user.id, peer_id, up_to)
+    async with conversation_session(user.id, peer_id) as db:
+        await recount_unread(db, user.id, peer_id, read_id)
+    await note_write(user.id)
+
+    receipt = {
+        "type": "receipt",
+        "status": "read",
+        "user_id": user.id,
+        "peer_id": peer_id,
+        "up_to": read_id,
+    }
+    await manager.send_personal_message(receipt, peer_id)
+    await manager.send_personal_message(receipt, user.id)
+
+
+async def handle_typing_frame(websocket: WebSocket, user: User, data: dict):
+    """
+    {"type": "typing", "to": <user id>, "active": <bool>}: show or clear a
+    typing indicator for `to`. Never touches the database.
+    """
+    await presence.typing(user.id, int(data["to"]), bool(data.get("active", True)))
+
+
+async def handle_presence_frame(websocket: WebSocket, user: User, data: dict):
+    """
+    {"type": "presence", "status": "online" | "away"}: set the user's status
+    as seen by their contacts. Never touches the database.
+    """
+    await presence.set_status(user.id, data["status"])
+
+
+async def handle_ping_frame(websocket: WebSocket, user: User, data: dict):
+    """
+    {"type": "ping"}: client-side liveness check, answered with a pong.
+    """
+    manager.send_to_socket(websocket, {"type": PONG})
+
+
+async def handle_pong_frame(websocket: WebSocket, user: User, data: dict):
+    """
+    {"type": "pong"}: answer to a heartbeat ping. Nothing to do: every
+    received frame already counts as a sign of life.
+    """
+
+
+async def handle_room_message_frame(websocket: WebSocket, user: User, data: dict):
+    """
+    {"type": "room_message", "room": <room id>, "content": <text>}: persist
+    a room message and deliver it to the room's online members. Checked
+    against the in-memory membership index, so it costs one insert however
+    large the room is.
+    """
+    room_id = int(data["room"])
+    content = str(data["content"])
+    if not rooms.is_member(user.id, room_id):
+        manager.send_to_socket(websocket, {"type": "error", "reason": "not_a_member", "room_id": room_id})
+        return
+
+    try:
+        await limiter.hit("ws_messages", user.id)
+        await rooms.send(room_id, user.id, content)
+        await note_write(user.id)
+    except RateLimited as e:
+        manager.send_to_socket(websocket, {
+            "type": "error",
+            "reason": "rate_limited",
+            "retry_after": round(e.retry_after, 3),
+        })
+    except ContentTooLarge as e:
+        manager.send_to_socket(websocket, {
+            "type": "error",
+            "reason": "content_too_large",
+            "detail": str(e),
+        })
+
+
+# WebSocket frame "type" -> handler; frames without a type are messages.
+FRAME_HANDLERS = {
+    "message": handle_message_frame,
+    "sync": handle_sync_frame,
+    "ack": handle_ack_frame,
+    "read": handle_read_frame,
+    "typing": handle_typing_frame,
+    "presence": handle_presence_frame,
+    "room_message": handle_room_message_frame,
+    "ping": handle_ping_frame,
+    "pong": handle_pong_frame,
+}
 
 
 @router.websocket("/ws")
-async def websocket_chat(
-    websocket: WebSocket,
-    db: AsyncSession = Depends(get_db),
-):
+async def websocket_chat(websocket: WebSocket):
     """
     WebSocket endpoint for real-time chat.
-    Connect to: ws://<host>/api/v1/chat/ws?token=<JWT>
+    Connect to: ws://<host>/api/v1/chat/ws?token=<JWT>[&batch=1]
+    Frames are JSON text, or MessagePack when the client offers the
+    "nextext.msgpack" subprotocol (see app.core.wire).
+    Incoming frames are dispatched on their "type" (see FRAME_HANDLERS).
+    Clients must answer {"type": "ping"} frames with {"type": "pong"}:
+    connections silent for WS_IDLE_TIMEOUT are closed (1001).
+    The socket holds no database session: authentication is served by the
+    auth cache, message writes go through the ingest pipeline and presence
+    and typing events stay in memory (see app.core.presence).
     """
     token = websocket.query_params.get("token")
     if not token:
@@ -69,45 +380,54 @@ async def websocket_chat(
 
     # Authenticate connection
     try:
-        user = await get_current_user_ws(token, db)
+        user = await get_current_user_ws(token)
     except HTTPException:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    await manager.connect(user.id, websocket)
+    try:
+        await limiter.hit("ws_connect", websocket.client.host if websocket.client else "unknown")
+    except RateLimited:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+
+    batch = websocket.query_params.get("batch", "").lower() in ("1", "true", "yes")
+    connection = await manager.connect(user.id, websocket, batch=batch)
 
     try:
+        manager.send_to_socket(websocket, await presence.connected(user.id))
+        await rooms.connected(user.id)
         while True:
-            data = await websocket.receive_json()
-            to_user_id = data.get("to")
-            content = data.get("content")
-            if to_user_id is None or content is None:
+            data = await connection.codec.receive(websocket)
+            connection.touch()
+            # Frame flood from this connection: close it as a policy violation
+            await limiter.hit("ws_frames", id(websocket), shared=False)
+            if not isinstance(data, dict):
                 continue
-
-            # Persist the message
-            msg = ChatMessage(
-                sender_id=user.id,
-                recipient_id=to_user_id,
-                content=content,
-            )
-            db.add(msg)
-            await db.commit()
-            await db.refresh(msg)
-
-            payload = {
-                "id": msg.id,
-                "sender_id": msg.sender_id,
-                "recipient_id": msg.recipient_id,
-                "content": msg.content,
-                "timestamp": msg.timestamp.isoformat(),
-            }
-
-            # Send to recipient and echo back to sender
-            await manager.send_personal_message(payload, to_user_id)
-            await manager.send_personal_message(payload, user.id)
+            frame_type = data.get("type", "message")
+            handler = FRAME_HANDLERS.get(frame_type)
+            if handler is None:
+                continue
+            try:
+                with profile_queries(f"ws {frame_type}"):
+                    await handler(websocket, user, data)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.debug(f"Ignoring malformed {frame_type} frame: {e}")
 
     except WebSocketDisconnect:
-        manager.disconnect(user.id, websocket)
+        pass
+    except FrameTooLarge as e:
+        logger.info(f"Closing WebSocket of user {user.id}: {e}")
+        await websocket.close(code=status.WS_1009_MESSAGE_TOO_BIG)
+    except RateLimited as e:
+        logger.info(f"Closing WebSocket of user {user.id}: {e}")
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+    finally:
+        limiter.forget("ws_frames", id(websocket))
+        # Also reached when the writer closed a slow consumer or the
+        # receive loop failed; disconnect is idempotent.
+        await manager.disconnect(user.id, websocket)
+        await presence.disconnected(user.id)
 
 
 @router.get(
@@ -117,33 +437,186 @@ async def websocket_chat(
 )
 async def get_chat_history(
     other_user_id: int,
-    db: AsyncSession = Depends(get_db),
+    before_id: Optional[int] = Query(None, ge=1, description="Return messages older than this id"),
+    after_id: Optional[int] = Query(None, ge=0, description="Return messages newer than this id"),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Return one page of messages between the authenticated user and other_user_id,
+    ordered by id ascending.
+    - Without a cursor, the most recent `limit` messages are returned.
+    - `before_id` pages backwards to older messages.
+    - `after_id` pages forwards to newer messages.
+    Pages continue into archived partitions transparently (see app.core.history).
+    """
+    if before_id is not None and after_id is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either before_id or after_id, not both",
+        )
+
+    async with conversation_session(
+        current_user.id, other_user_id, read_only=True, user_id=current_user.id
+    ) as db:
+        return await conversation_history(
+            db,
+            current_user.id,
+            other_user_id,
+            before_id=before_id,
+            after_id=after_id,
+            limit=limit,
+        )
+
+
+@router.get(
+    "/search",
+    response_model=List[MessageRead],
+    summary="Search messages",
+)
+async def search_chat_messages(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200, description="Words to search for"),
+    with_user: Optional[int] = Query(None, ge=1, description="Only messages exchanged with this user"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    limit: int = Query(MESSAGE_SEARCH_PAGE_SIZE, ge=1, le=MESSAGE_SEARCH_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Full-text search over the authenticated user's messages (sent and
+    received), ranked by relevance then newest first. Every word must
+    match; the last one also matches as a prefix. When more results exist
+    the `X-Next-Cursor` response header holds the cursor for the next page.
+    """
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+    messages, next_key = await search_messages(current_user.id, q, limit, with_user, after)
+    if next_key is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(next_key)
+    return messages
+
+
+@router.get(
+    "/history/{other_user_id}/export",
+    summary="Export full chat history as NDJSON",
+)
+async def export_chat_history(
+    other_user_id: int,
     current_user: User = Depends(get_current_user),
 ):
     """
-    Return all messages between the authenticated user and other_user_id,
-    ordered by timestamp ascending.
+    Stream every message between the authenticated user and other_user_id
+    as newline-delimited JSON, oldest first.
+    Rows are read through server-side cursors in chunks, archive partitions
+    first, so memory stays constant regardless of conversation length.
     """
     user_id = current_user.id
-    stmt = (
-        select(ChatMessage)
-        .filter(
-            ((ChatMessage.sender_id == user_id) & (ChatMessage.recipient_id == other_user_id))
-            | ((ChatMessage.sender_id == other_user_id) & (ChatMessage.recipient_id == user_id))
+
+    async def ndjson_lines():
+        # The request-scoped session is closed before the body is streamed,
+        # so the export holds its own session for the duration of the response.
+        async with conversation_session(
+            user_id, other_user_id, read_only=True, user_id=user_id
+        ) as session:
+            async for chunk in stream_conversation(session, user_id, other_user_id):
+                yield "".join(json.dumps(message_payload(msg)) + "\n" for msg in chunk)
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@router.get(
+    "/messages/{message_id}/content",
+    summary="Get the full content of a message",
+)
+async def get_message_content(
+    message_id: int,
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Return the full text of a message the authenticated user sent or
+    received. Offloaded bodies (body_length set) are streamed chunk by chunk.
+    """
+    msg = await find_message(message_id, current_user.id)
+    if msg is None or current_user.id not in (msg.sender_id, msg.recipient_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
+    if msg.body_length is None:
+        return PlainTextResponse(msg.content)
+
+    async def chunks():
+        # As with exports, the request-scoped session is closed before the body is streamed
+        async with conversation_session(
+            msg.sender_id, msg.recipient_id, read_only=True, user_id=current_user.id
+        ) as session:
+            async for chunk in stream_body(session, message_id):
+                yield chunk
+
+    return StreamingResponse(chunks(), media_type="text/plain; charset=utf-8")
+
+
+@router.get(
+    "/conversations",
+    response_model=List[ConversationRead],
+    summary="List conversations",
+)
+async def get_conversations(
+    before: Optional[int] = Query(
+        None, ge=1, description="Return conversations whose last message id is lower"
+    ),
+    limit: int = Query(CONVERSATION_PAGE_SIZE, ge=1, le=CONVERSATION_MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Return one page of the authenticated user's conversations, most recent
+    activity first, each with its last message and unread count.
+    Pass the last entry's last_message_id as `before` to get the next page.
+    """
+    conversations = await list_all_conversations(current_user.id, before, limit)
+    return [
+        ConversationRead(
+            peer_id=conversation.peer_of(current_user.id),
+            last_message_id=conversation.last_message_id,
+            last_sender_id=conversation.last_sender_id,
+            last_preview=conversation.last_preview,
+            last_timestamp=conversation.last_timestamp,
+            last_seq=conversation.last_seq,
+            unread_count=conversation.unread_for(current_user.id),
         )
-        .order_by(ChatMessage.timestamp)
-    )
-    result = await db.execute(stmt)
-    return result.scalars().all()
+        for conversation in conversations
+    ]
+
+
+@router.get(
+    "/receipts/{other_user_id}",
+    summary="Get delivery/read watermarks for a conversation",
+)
+async def get_conversation_receipts(
+    other_user_id: int,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Return how far other_user_id has received (delivered_up_to) and read
+    (read_up_to) the authenticated user's messages, as message ids.
+    """
+    return await get_receipts(db, current_user.id, other_user_id)
 
 
 @router.get(
     "/online",
     response_model=List[int],
     summary="Get online user IDs",
+    deprecated=True,
 )
 async def get_online_users():
     """
-    List user IDs currently connected via WebSocket.
+    List user IDs currently connected via WebSocket on any worker.
+    Clients should rely on the presence events pushed over the WebSocket
+    (a presence_snapshot on connect, then presence updates) instead of
+    polling this endpoint.
     """
-    return manager.get_online_users()
+    return await manager.get_online_users()
@@ -0,0 +1,176 @@
+# backend/app/api/v1/rooms.py
+
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.api.v1.chat import rooms as room_hub
+from app.api.v1.users import get_current_user, get_read_db
+from app.core.config import HISTORY_MAX_PAGE_SIZE, HISTORY_PAGE_SIZE
+from app.core.rooms import RoomFull, add_members, is_member, remove_member, room_page
+from app.db.session import get_db, note_write
+from app.models.room import Room, RoomMember
+from app.models.user import User
+from app.schemas.room import RoomCreate, RoomMembersAdd, RoomMessageRead, RoomRead
+
+router = APIRouter(prefix="/api/v1/rooms", tags=["rooms"])
+
+
+async def get_room_for_member(room_id: int, db: AsyncSession, user: User) -> Room:
+    """
+    Return the room if the user belongs to it; 404 otherwise, so room ids
+    are not disclosed to non-members.
+    """
+    room = await db.get(Room, room_id)
+    if room is None or not await is_member(db, room_id, user.id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
+    return room
+
+
+def room_full(e: RoomFull) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+@router.post(
+    "/",
+    response_model=RoomRead,
+    status_code=status.HTTP_201_CREATED,
+    summary="Create a room",
+)
+async def create_room(
+    room_in: RoomCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Create a group conversation with the authenticated user and the given
+    initial members. Members are told over the WebSocket (room_joined).
+    """
+    room = Room(name=room_in.name, created_by=current_user.id)
+    db.add(room)
+    await db.flush()
+    try:
+        added = await add_members(db, room.id, [current_user.id, *room_in.member_ids])
+    except RoomFull as e:
+        raise room_full(e)
+    await db.refresh(room)
+    await note_write(current_user.id)
+    await room_hub.members_added(room, added)
+    return room
+
+
+@router.get(
+    "/",
+    response_model=List[RoomRead],
+    summary="List my rooms",
+)
+async def list_rooms(
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Return the rooms the authenticated user belongs to, newest first.
+    """
+    result = await db.execute(
+        select(Room)
+        .join(RoomMember, RoomMember.room_id == Room.id)
+        .filter(RoomMember.user_id == current_user.id)
+        .order_by(Room.id.desc())
+    )
+    return result.scalars().all()
+
+
+@router.get(
+    "/{room_id}/members",
+    response_model=List[int],
+    summary="List room members",
+)
+async def list_members(
+    room_id: int,
+    after_id: Optional[int] = Query(None, ge=0, description="Return members with a greater user id"),
+    limit: int = Query(500, ge=1, le=5000),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Return one page of member user ids, ascending.
+    """
+    await get_room_for_member(room_id, db, current_user)
+    stmt = select(RoomMember.user_id).filter(RoomMember.room_id == room_id)
+    if after_id is not None:
+        stmt = stmt.filter(RoomMember.user_id > after_id)
+    result = await db.execute(stmt.order_by(RoomMember.user_id).limit(limit))
+    return result.scalars().all()
+
+
+@router.post(
+    "/{room_id}/members",
+    summary="Add room members",
+)
+async def add_room_members(
+    room_id: int,
+    members_in: RoomMembersAdd,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+) -> Dict[str, List[int]]:
+    """
+    Add users to a room the authenticated user belongs to. Returns the ids
+    actually added (unknown users and existing members are skipped).
+    """
+    room = await get_room_for_member(room_id, db, current_user)
+    try:
+        added = await add_members(db, room_id, members_in.user_ids)
+    except RoomFull as e:
+        raise room_full(e)
+    await note_write(current_user.id)
+    await room_hub.members_added(room, added)
+    return {"added": added}
+
+
+@router.delete(
+    "/{room_id}/members/{user_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="Leave a room or remove a member",
+)
+async def remove_room_member(
+    room_id: int,
+    user_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Members may remove themselves; the room's creator may remove anyone.
+    """
+    room = await get_room_for_member(room_id, db, current_user)
+    if user_id != current_user.id and room.created_by != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the room's creator can remove other members",
+        )
+    if not await remove_member(db, room_id, user_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not a member")
+    await note_write(current_user.id)
+    await room_hub.member_removed(room_id, user_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.get(
+    "/{room_id}/messages",
+    response_model=List[RoomMessageRead],
+    summary="Get room history",
+)
+async def get_room_messages(
+    room_id: int,
+    before_id: Optional[int] = Query(None, ge=1, description="Return messages older than this id"),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Return one page of a room's messages, ordered by id ascending: the most
+    recent `limit`, or those older than `before_id`.
+    """
+    await get_room_for_member(room_id, db, current_user)
+    return await room_page(db, room_id, before_id=before_id, limit=limit)
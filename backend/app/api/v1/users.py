@@ -1,23 +1,27 @@
 # backend/app/api/v1/users.py
 
 from datetime import timedelta
-from typing import List, Optional
+from typing import AsyncGenerator, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import or_
 
-from app.db.session import get_db
+from app.db.session import read_session_scope, session_scope
 from app.models.user import User
 from app.schemas.user import UserCreate, UserRead, Token
 from app.core.security import (
-    verify_password,
-    get_password_hash,
+    PasswordHasherBusy,
     create_access_token,
-    decode_access_token,
+    get_password_hash_async,
+    verify_and_update_password_async,
 )
+from app.core.auth_cache import authenticate_token, invalidate_user
+from app.core.rate_limit import RateLimited, limiter, rate_limit, too_many_requests
+from app.core.user_search import decode_cursor, encode_cursor, search_users
 from app.core.config import ACCESS_TOKEN_EXPIRE_MINUTES
 
 router = APIRouter(prefix="/api/v1/users", tags=["users"])
@@ -25,31 +29,42 @@ router = APIRouter(prefix="/api/v1/users", tags=["users"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/users/login")
 
 
+def _hasher_busy_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many authentication requests, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: AsyncSession = Depends(get_db),
 ) -> User:
     """
     Decode JWT token, validate, and return the User instance.
+    Served from the auth cache; the database is only queried on a miss.
+    The returned User is detached and must be treated as read-only.
     """
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
     try:
-        payload = decode_access_token(token)
-        username: str = payload.get("sub")
-        if not username:
-            raise credentials_exception
-    except Exception:
-        raise credentials_exception
+        return await authenticate_token(token)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
-    result = await db.execute(select(User).filter_by(username=username))
-    user = result.scalars().first()
-    if not user:
-        raise credentials_exception
-    return user
+
+async def get_read_db(
+    current_user: User = Depends(get_current_user),
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    FastAPI dependency for read-only endpoints: yields a session on a read
+    replica, or on the primary while the authenticated user's own writes
+    may not have replicated yet (see read_session_scope).
+    """
+    async with read_session_scope(current_user.id) as session:
+        yield session
 
 
 @router.post(
@@ -57,34 +72,47 @@ async def get_current_user(
     response_model=UserRead,
     status_code=status.HTTP_201_CREATED,
     summary="Register a new user",
+    dependencies=[Depends(rate_limit("register"))],
 )
-async def register_user(
-    user_in: UserCreate,
-    db: AsyncSession = Depends(get_db),
-):
+async def register_user(user_in: UserCreate):
     """
     Create a new user with a hashed password.
+    No database connection is held while the password is hashed: the
+    duplicate check and the insert each use their own short session.
     """
-    # Check for existing username or email
-    result = await db.execute(
-        select(User).filter(
-            (User.username == user_in.username) | (User.email == user_in.email)
-        )
+    already_registered = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Username or email already registered",
     )
-    if result.scalars().first():
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username or email already registered",
+    async with session_scope() as db:
+        result = await db.execute(
+            select(User.id).filter(
+                (User.username == user_in.username) | (User.email == user_in.email)
+            )
         )
+        taken = result.first() is not None
+    if taken:
+        raise already_registered
+
+    try:
+        hashed_password = await get_password_hash_async(user_in.password)
+    except PasswordHasherBusy:
+        raise _hasher_busy_exception()
 
     user = User(
         username=user_in.username,
         email=user_in.email,
-        hashed_password=get_password_hash(user_in.password),
+        hashed_password=hashed_password,
     )
-    db.add(user)
-    await db.commit()
-    await db.refresh(user)
+    async with session_scope() as db:
+        db.add(user)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Registered concurrently while the password was being hashed
+            raise already_registered
+        await db.refresh(user)
+    await invalidate_user(user.username)
     return user
 
 
@@ -92,22 +120,56 @@ async def register_user(
     "/login",
     response_model=Token,
     summary="Obtain JWT access token",
+    dependencies=[Depends(rate_limit("login"))],
 )
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: AsyncSession = Depends(get_db),
 ):
     """
     Authenticate user and return a JWT access token.
+    Password hashes made with an outdated cost factor are upgraded on login.
+    Attempts are rate-limited per client IP before the password is checked;
+    failed attempts are also charged per username, so a correct password is
+    never refused because someone else guessed wrong, and guesses past the
+    username's limit are answered with 429.
+    No database connection is held while the password is verified.
     """
-    result = await db.execute(select(User).filter_by(username=form_data.username))
-    user = result.scalars().first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect username or password",
-            headers={"WWW-Authenticate": "Bearer"},
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Incorrect username or password",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    async with session_scope() as db:
+        result = await db.execute(
+            select(User.id, User.username, User.hashed_password)
+            .filter_by(username=form_data.username)
         )
+        user = result.first()
+    valid = new_hash = None
+    if user:
+        try:
+            valid, new_hash = await verify_and_update_password_async(
+                form_data.password, user.hashed_password
+            )
+        except PasswordHasherBusy:
+            raise _hasher_busy_exception()
+    if not valid:
+        try:
+            await limiter.hit("login_user", form_data.username)
+        except RateLimited as e:
+            raise too_many_requests(e)
+        raise credentials_exception
+
+    if new_hash:
+        async with session_scope() as db:
+            # Unless the password was changed meanwhile
+            await db.execute(
+                update(User)
+                .where(User.id == user.id, User.hashed_password == user.hashed_password)
+                .values(hashed_password=new_hash)
+            )
+            await db.commit()
+        await invalidate_user(user.username)
 
     expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -136,26 +198,41 @@ async def read_current_user(
     summary="List or search users",
 )
 async def list_users(
-    q: Optional[str] = Query(None, description="Filter by username or email"),
-    skip: int = Query(0, ge=0),
+    response: Response,
+    q: Optional[str] = Query(None, description="Search by username or email"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous search page"),
+    after_id: Optional[int] = Query(None, ge=0, description="List users with a greater id"),
+    skip: int = Query(0, ge=0, description="Offset for plain listing; prefer after_id"),
     limit: int = Query(10, ge=1, le=100),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_user),
 ):
     """
     Return a paginated list of users.
-    If `q` is provided, filter by username or email substring.
+    If `q` is provided, return users ranked by relevance (exact username,
+    username prefix, email prefix, then substring); when more results exist
+    the `X-Next-Cursor` response header holds the cursor for the next page.
+    Without `q`, users are listed by id; page with `after_id`.
     """
-    stmt = select(User)
     if q:
-        pattern = f"%{q}%"
-        stmt = stmt.filter(
-            or_(
-                User.username.ilike(pattern),
-                User.email.ilike(pattern),
+        try:
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor",
             )
-        )
-    stmt = stmt.offset(skip).limit(limit)
+        users, next_key = await search_users(db, q, limit, after)
+        if next_key is not None:
+            response.headers["X-Next-Cursor"] = encode_cursor(next_key)
+        return users
+
+    stmt = select(User).order_by(User.id)
+    if after_id is not None:
+        stmt = stmt.filter(User.id > after_id)
+    else:
+        stmt = stmt.offset(skip)
+    stmt = stmt.limit(limit)
 
     result = await db.execute(stmt)
     return result.scalars().all()
@@ -0,0 +1,430 @@
+# backend/app/cli.py
+
+"""
+Bulk import/export of users and chat messages.
+
+Usage (from the backend directory):
+    python -m app.cli export users --format ndjson -o users.ndjson
+    python -m app.cli export messages --format csv --since-id 1000 -o messages.csv
+    python -m app.cli import users users.ndjson --default-password secret123
+    python -m app.cli import messages messages.csv --chunk-size 5000
+    python -m app.cli compact --hot-days 90
+    python -m app.cli move-slots --slots 3,17 --to 2
+    python -m app.cli rebalance
+
+Rows are streamed in both directions, so memory stays constant:
+- export reads through a server-side cursor (yield_per); messages include
+  the archive partitions, oldest first, and the full text of offloaded
+  bodies;
+- import inserts fixed-size chunks with executemany, or COPY on PostgreSQL
+  with asyncpg, offloading large message bodies like the ingest pipeline.
+Files use one JSON object per line (ndjson) or CSV with a header row; the
+fields are the table's column names. "-" means stdin/stdout.
+
+User rows need either hashed_password, password (hashed on import), or
+--default-password, which is hashed once and shared by every row without
+one (intended for load-test seeding). Importing messages rebuilds the
+conversation summaries and numbers the messages in each conversation
+(seq) afterwards, since bulk inserts bypass the ingest pipeline that
+maintains them.
+
+compact moves messages older than the hot horizon into the monthly archive
+partitions now (see app.core.retention), instead of waiting for the
+background job.
+
+With several message shards (DATABASE_SHARD_URLS), messages are exported
+shard by shard (ids ascend within each shard) and imported rows are routed
+to their conversation's shard, with ids from the shared counter when the
+rows have none. move-slots and rebalance move conversations between shards
+while the application keeps running (see app.core.resharding).
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import sys
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, TextIO
+
+from sqlalchemy import Table, func, insert, text, update
+from sqlalchemy.future import select
+
+from app.db.base import Base
+from app.db.migrate import upgrade_schema
+from app.db.session import engine, session_scope, shard_engines, shard_session
+from app.db.shards import allocate_message_ids, shard_count, shard_map
+from app.db.upsert import greatest
+from app.models.message import ChatMessage
+from app.models.shard import MessageIdCounter
+from app.models.user import User
+from app.core.conversations import load_read_ids, rebuild_conversations
+from app.core.config import RETENTION_BATCH_PAUSE_MS, RETENTION_HOT_DAYS
+from app.core.history import stream_messages
+from app.core.message_bodies import load_bodies, offload, store_bodies
+from app.core.resharding import move_slots, rebalance, setup_shards
+from app.core.retention import RetentionJob
+from app.core.security import get_password_hash
+
+MODELS = {"users": User, "messages": ChatMessage}
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def _open(path: str, mode: str) -> TextIO:
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    return open(path, mode, newline="", encoding="utf-8")
+
+
+def _read_rows(stream: TextIO, fmt: str) -> Iterator[Dict[str, Any]]:
+    if fmt == "csv":
+        for row in csv.DictReader(stream):
+            yield {k: v for k, v in row.items() if v != ""}
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _coerce(table: Table, row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Keep only the table's columns and convert CSV strings to column types.
+    """
+    values = {}
+    for column in table.columns:
+        if column.name not in row or row[column.name] is None:
+            continue
+        value = row[column.name]
+        if isinstance(value, str):
+            python_type = column.type.python_type
+            if python_type is int:
+                value = int(value)
+            elif python_type is bool:
+                value = value.lower() in ("1", "true", "yes")
+            elif python_type is datetime:
+                value = datetime.fromisoformat(value)
+        values[column.name] = value
+    return values
+
+
+def _jsonable(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+async def _chunks(rows: Iterator[Dict[str, Any]], size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    chunk: List[Dict[str, Any]] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+            await asyncio.sleep(0)
+    if chunk:
+        yield chunk
+
+
+async def _insert_chunk(session, table: Table, chunk: List[Dict[str, Any]]):
+    """
+    Insert one chunk: COPY on PostgreSQL/asyncpg, executemany elsewhere.
+    """
+    dialect = session.bind.dialect
+    if dialect.name == "postgresql" and dialect.driver == "asyncpg":
+        columns = list(chunk[0].keys())
+        if all(row.keys() == chunk[0].keys() for row in chunk):
+            connection = await session.connection()
+            raw = await connection.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                table.name,
+                records=[tuple(row[c] for c in columns) for row in chunk],
+                columns=columns,
+            )
+            return
+    await session.execute(insert(table), chunk)
+
+
+async def _insert_messages(session, table: Table, rows: List[Dict[str, Any]]):
+    """
+    Insert message rows the way the ingest pipeline stores them: content
+    over MESSAGE_INLINE_MAX_BYTES is offloaded to chat_message_bodies.
+    """
+    bodies = []
+    for index, row in enumerate(rows):
+        rows[index], body = offload(row)
+        bodies.append(body)
+    if not any(bodies):
+        await _insert_chunk(session, table, rows)
+        return
+    if all("id" in row for row in rows):
+        await _insert_chunk(session, table, rows)
+        ids = [row["id"] for row in rows]
+    else:
+        result = await session.execute(
+            insert(table).returning(table.c.id, sort_by_parameter_order=True), rows
+        )
+        ids = list(result.scalars())
+    await store_bodies(session, [(msg_id, body) for msg_id, body in zip(ids, bodies) if body is not None])
+
+
+async def _route_messages(chunk: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Group message rows by shard, giving rows without an id one from the
+    shared counter when there are several shards.
+    """
+    if shard_count() > 1:
+        missing = [row for row in chunk if "id" not in row]
+        if missing:
+            first_id = await allocate_message_ids(len(missing))
+            for offset, row in enumerate(missing):
+                row["id"] = first_id + offset
+    by_shard: Dict[int, List[Dict[str, Any]]] = {}
+    for row in chunk:
+        shard = await shard_map.shard_of(row["sender_id"], row["recipient_id"])
+        by_shard.setdefault(shard, []).append(row)
+    return by_shard
+
+
+async def _advance_id_sequences(table: Table, shards: List[int]):
+    """
+    Move id generation past explicitly imported ids: the shared counter
+    with several shards, the table's sequence on PostgreSQL otherwise.
+    """
+    if table.name == ChatMessage.__tablename__ and shard_count() > 1:
+        max_ids = []
+        for shard in shards:
+            async with shard_session(shard) as session:
+                result = await session.execute(select(func.max(table.c.id)))
+                max_ids.append(result.scalar() or 0)
+        async with session_scope() as session:
+            await session.execute(
+                update(MessageIdCounter)
+                .where(MessageIdCounter.name == table.name)
+                .values(next_id=greatest(MessageIdCounter.next_id, max(max_ids) + 1))
+            )
+            await session.commit()
+        return
+    if engine.dialect.name == "postgresql":
+        async with session_scope() as session:
+            await session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM {table.name}))"
+            ))
+            await session.commit()
+
+
+async def import_rows(
+    kind: str,
+    path: str,
+    fmt: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    default_password: Optional[str] = None,
+) -> int:
+    """
+    Stream rows from a file into the database. Returns the number of rows.
+    """
+    table = MODELS[kind].__table__
+    default_hash = get_password_hash(default_password) if default_password else None
+
+    def prepared(stream: TextIO) -> Iterator[Dict[str, Any]]:
+        for row in _read_rows(stream, fmt):
+            if kind == "users" and "hashed_password" not in row:
+                if "password" in row:
+                    row["hashed_password"] = get_password_hash(row["password"])
+                elif default_hash:
+                    row["hashed_password"] = default_hash
+                else:
+                    raise ValueError(f"User row has no password: {row.get('username')!r}")
+            yield _coerce(table, row)
+
+    total = 0
+    explicit_ids = False
+    shards = set()
+    stream = _open(path, "r")
+    try:
+        async for chunk in _chunks(prepared(stream), chunk_size):
+            explicit_ids = explicit_ids or "id" in chunk[0]
+            by_shard = await _route_messages(chunk) if kind == "messages" else {0: chunk}
+            for shard, rows in by_shard.items():
+                async with shard_session(shard) as session:
+                    if kind == "messages":
+                        await _insert_messages(session, table, rows)
+                    else:
+                        await _insert_chunk(session, table, rows)
+                    await session.commit()
+                shards.add(shard)
+            total += len(chunk)
+            print(f"{kind}: imported {total} rows", file=sys.stderr)
+
+        if explicit_ids:
+            await _advance_id_sequences(table, sorted(shards))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return total
+
+
+async def _stream_table(
+    session, table: Table, since_id: int, chunk_size: int
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Chunks of the table's rows past since_id in id order; messages include
+    the archive partitions.
+    """
+    if table.name == ChatMessage.__tablename__:
+        async for chunk in stream_messages(session, since_id, chunk_size):
+            yield chunk
+        return
+    result = await session.stream(
+        select(table)
+        .filter(table.c.id > since_id)
+        .order_by(table.c.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    async for chunk in result.mappings().partitions():
+        yield chunk
+
+
+async def export_rows(
+    kind: str,
+    path: str,
+    fmt: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    since_id: int = 0,
+) -> int:
+    """
+    Stream rows from the database into a file. Returns the number of rows.
+    """
+    table = MODELS[kind].__table__
+    columns = [c.name for c in table.columns]
+
+    total = 0
+    stream = _open(path, "w")
+    try:
+        writer = csv.DictWriter(stream, fieldnames=columns) if fmt == "csv" else None
+        if writer:
+            writer.writeheader()
+        for shard in range(shard_count() if kind == "messages" else 1):
+            async with shard_session(shard) as session:
+                async for partition in _stream_table(session, table, since_id, chunk_size):
+                    offloaded = [row["id"] for row in partition if row.get("body_length") is not None]
+                    bodies = await load_bodies(session, offloaded) if offloaded else {}
+                    for row in partition:
+                        values = {c: _jsonable(row[c]) for c in columns}
+                        if row["id"] in bodies:
+                            # Export the full text; import offloads it again
+                            values.update(content=bodies[row["id"]], body_length=None)
+                        if writer:
+                            writer.writerow(values)
+                        else:
+                            stream.write(json.dumps(values) + "\n")
+                    total += len(partition)
+                    print(f"{kind}: exported {total} rows", file=sys.stderr)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+        else:
+            stream.flush()
+    return total
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = commands.add_parser("export", help="Export rows as NDJSON or CSV")
+    export_cmd.add_argument("kind", choices=sorted(MODELS))
+    export_cmd.add_argument("-o", "--output", default="-", help="Output file (default: stdout)")
+    export_cmd.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    export_cmd.add_argument("--since-id", type=int, default=0, help="Only rows with a greater id")
+    export_cmd.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+
+    import_cmd = commands.add_parser("import", help="Import rows from NDJSON or CSV")
+    import_cmd.add_argument("kind", choices=sorted(MODELS))
+    import_cmd.add_argument("input", help="Input file ('-' for stdin)")
+    import_cmd.add_argument("--format", choices=("ndjson", "csv"), default=None,
+                            help="Default: inferred from the file extension")
+    import_cmd.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    import_cmd.add_argument("--default-password",
+                            help="Password for user rows without one (hashed once)")
+
+    compact_cmd = commands.add_parser("compact", help="Archive messages past the hot horizon")
+    compact_cmd.add_argument("--hot-days", type=float, default=RETENTION_HOT_DAYS)
+    compact_cmd.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    compact_cmd.add_argument("--pause-ms", type=float, default=RETENTION_BATCH_PAUSE_MS,
+                             help="Pause between batches")
+
+    move_cmd = commands.add_parser("move-slots", help="Move conversation slots to another shard")
+    move_cmd.add_argument("--slots", required=True, type=_slot_list,
+                          help="Comma-separated slots, or ranges like 0-63")
+    move_cmd.add_argument("--to", required=True, type=int, dest="target", help="Target shard")
+    move_cmd.add_argument("--grace-seconds", type=float, default=None,
+                          help="Wait before deleting the source copies "
+                               "(default: twice SHARD_MAP_REFRESH_SECONDS)")
+
+    rebalance_cmd = commands.add_parser("rebalance", help="Spread slots evenly over the shards")
+    rebalance_cmd.add_argument("--grace-seconds", type=float, default=None)
+    return parser
+
+
+def _slot_list(value: str) -> List[int]:
+    slots = []
+    for part in value.split(","):
+        start, _, end = part.partition("-")
+        slots.extend(range(int(start), int(end or start) + 1))
+    return slots
+
+
+async def run(args: argparse.Namespace) -> int:
+    # Statement echo would dominate the run time of bulk jobs
+    engine.echo = False
+    for shard_engine in shard_engines:
+        shard_engine.echo = False
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+    await setup_shards()
+    try:
+        if args.command == "move-slots":
+            return await move_slots(set(args.slots), args.target, args.grace_seconds)
+        if args.command == "rebalance":
+            return await rebalance(args.grace_seconds)
+        if args.command == "compact":
+            job = RetentionJob(
+                hot_days=args.hot_days, batch_size=args.chunk_size, batch_pause_ms=args.pause_ms
+            )
+            return await job.run_once()
+        if args.command == "export":
+            return await export_rows(
+                args.kind, args.output, args.format, args.chunk_size, args.since_id
+            )
+        fmt = args.format or ("csv" if args.input.endswith(".csv") else "ndjson")
+        total = await import_rows(
+            args.kind, args.input, fmt, args.chunk_size, args.default_password
+        )
+        if args.kind == "messages":
+            async with session_scope() as session:
+                read_ids = await load_read_ids(session)
+            conversations = 0
+            for shard in range(shard_count()):
+                async with shard_session(shard) as session:
+                    conversations += await rebuild_conversations(session, read_ids, args.chunk_size)
+            print(f"conversations: rebuilt {conversations} summaries", file=sys.stderr)
+        return total
+    finally:
+        for shard_engine in shard_engines:
+            await shard_engine.dispose()
+
+
+def main(argv: Optional[List[str]] = None):
+    args = build_parser().parse_args(argv)
+    total = asyncio.run(run(args))
+    if args.command in ("move-slots", "rebalance"):
+        kind = "moved messages"
+    elif args.command == "compact":
+        kind = "archived messages"
+    else:
+        kind = f"{args.kind} rows"
+    print(f"Done: {total} {kind}.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
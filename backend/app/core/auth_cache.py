@@ -0,0 +1,255 @@
+# backend/app/core/auth_cache.py
+
+"""
+Caches that take authentication off the database hot path.
+
+- Decoded JWT payloads are cached by a SHA-256 digest of the whole token
+  until the token (or the cache TTL) expires, so repeated requests with the same token skip
+  signature verification.
+- User principals are cached by token subject (username) in a TTL+LRU
+  in-process cache, optionally backed by a shared Redis tier
+  (AUTH_CACHE_BACKEND=redis) so a cold worker does not hit the database.
+  Misses are read from a replica when one is configured, and from the
+  primary only when the replica does not have the user yet.
+- Ids of existing users (e.g. message recipients) are cached the same way
+  by user_exists; unknown ids are not cached.
+
+Call invalidate_user() whenever a user row changes. The Redis tier is
+invalidated immediately; other workers' in-process entries expire after
+AUTH_CACHE_TTL seconds.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+from sqlalchemy.future import select
+
+from app.core.config import (
+    AUTH_CACHE_BACKEND,
+    AUTH_CACHE_SIZE,
+    AUTH_CACHE_TTL,
+    AUTH_TOKEN_CACHE_SIZE,
+)
+from app.core.metrics import REGISTRY
+from app.core.redis import get_redis
+from app.core.security import decode_access_token
+from app.db.base import MAX_ID
+from app.db.session import read_session_scope, replica_engines, session_scope
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+V = TypeVar("V")
+
+# Columns shared through the Redis tier; the password hash never leaves the database
+_USER_FIELDS = ("id", "username", "email", "is_active", "created_at")
+
+
+class TTLCache(Generic[V]):
+    """
+    Small LRU cache whose entries also expire after a per-entry TTL.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[V]:
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+_token_cache: TTLCache[Dict[str, Any]] = TTLCache(AUTH_TOKEN_CACHE_SIZE, AUTH_CACHE_TTL)
+_user_cache: TTLCache[User] = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+_user_id_cache: TTLCache[bool] = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+def _redis_key(username: str) -> str:
+    return f"nextext:auth:user:{username}"
+
+
+def _user_to_json(user: User) -> str:
+    fields = {name: getattr(user, name) for name in _USER_FIELDS}
+    fields["created_at"] = fields["created_at"].isoformat() if fields["created_at"] else None
+    return json.dumps(fields)
+
+
+def _user_from_json(raw: str) -> User:
+    fields = json.loads(raw)
+    if fields.get("created_at"):
+        fields["created_at"] = datetime.fromisoformat(fields["created_at"])
+    return User(**fields)
+
+
+def decode_token_cached(token: str) -> Dict[str, Any]:
+    """
+    decode_access_token with a cache keyed by a digest of the whole token
+    (header, payload and signature), so only the exact token that was
+    verified is served from the cache.
+    Raises ValueError on invalid or expired tokens.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    payload = _token_cache.get(key)
+    if payload is not None:
+        exp = payload.get("exp")
+        if exp is None or exp > time.time():
+            return payload
+        _token_cache.delete(key)
+        raise ValueError("Token has expired")
+
+    payload = decode_access_token(token)
+    ttl = AUTH_CACHE_TTL
+    if payload.get("exp") is not None:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        _token_cache.set(key, payload, ttl)
+    return payload
+
+
+async def _load_user(scope, username: str) -> Optional[User]:
+    async with scope() as db:
+        result = await db.execute(select(User).filter_by(username=username))
+        user = result.scalars().first()
+        if user is not None:
+            db.expunge(user)
+        return user
+
+
+async def get_user_by_username(username: str) -> Optional[User]:
+    """
+    Return the (detached, read-only) User for a username, checking the
+    in-process cache, then the Redis tier, then the database.
+    """
+    user = _user_cache.get(username)
+    if user is not None:
+        return user
+
+    if AUTH_CACHE_BACKEND == "redis":
+        try:
+            raw = await get_redis().get(_redis_key(username))
+        except Exception as e:
+            logger.warning(f"Auth cache Redis lookup failed: {e}")
+            raw = None
+        if raw:
+            user = _user_from_json(raw)
+            _user_cache.set(username, user)
+            return user
+
+    user = await _load_user(read_session_scope, username)
+    if user is None and replica_engines:
+        # Just registered: the replica may not have the row yet
+        user = await _load_user(session_scope, username)
+    if user is None:
+        return None
+
+    _user_cache.set(username, user)
+    if AUTH_CACHE_BACKEND == "redis":
+        try:
+            await get_redis().set(_redis_key(username), _user_to_json(user), ex=AUTH_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Auth cache Redis store failed: {e}")
+    return user
+
+
+async def authenticate_token(token: str) -> User:
+    """
+    Resolve a bearer token to its User.
+    Raises ValueError if the token is invalid or the user does not exist.
+    """
+    payload = decode_token_cached(token)
+    username = payload.get("sub")
+    if not username:
+        raise ValueError("Missing subject in token")
+    user = await get_user_by_username(username)
+    if user is None:
+        raise ValueError("User not found")
+    return user
+
+
+async def _has_user(scope, user_id: int) -> bool:
+    async with scope() as db:
+        result = await db.execute(select(User.id).filter_by(id=user_id))
+        return result.scalar() is not None
+
+
+async def user_exists(user_id: int) -> bool:
+    """
+    Return True if a user with this id exists.
+    """
+    if not 0 < user_id <= MAX_ID:
+        # Outside the users.id column, so not even worth a query
+        return False
+    if _user_id_cache.get(user_id):
+        return True
+    exists = await _has_user(read_session_scope, user_id)
+    if not exists and replica_engines:
+        # Just registered: the replica may not have the row yet
+        exists = await _has_user(session_scope, user_id)
+    if exists:
+        _user_id_cache.set(user_id, True)
+    return exists
+
+
+async def invalidate_user(username: str):
+    """
+    Drop a user's cached principal after the user row changed.
+    """
+    _user_cache.delete(username)
+    if AUTH_CACHE_BACKEND == "redis":
+        try:
+            await get_redis().delete(_redis_key(username))
+        except Exception as e:
+            logger.warning(f"Auth cache Redis invalidation failed: {e}")
+
+
+def cache_stats() -> Dict[str, int]:
+    """
+    Hit/miss counters and sizes of the in-process auth caches.
+    """
+    return {
+        "user_cache_size": len(_user_cache),
+        "user_cache_hits": _user_cache.hits,
+        "user_cache_misses": _user_cache.misses,
+        "token_cache_size": len(_token_cache),
+        "token_cache_hits": _token_cache.hits,
+        "token_cache_misses": _token_cache.misses,
+    }
+
+
+REGISTRY.gauge_callback(
+    "nextext_auth_cache",
+    "Auth cache sizes and hit/miss counters (see cache_stats)",
+    lambda: {(name,): value for name, value in cache_stats().items()},
+    ("stat",),
+)
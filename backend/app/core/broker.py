@@ -0,0 +1,392 @@
+# backend/app/core/broker.py
+
+"""
+Message brokers used by ConnectionManager to fan out messages across workers.
+
+A broker moves a message published on any worker to every worker that holds
+a socket for the target user, and tracks which users are online anywhere in
+the cluster and the presence status they set.
+
+Room messages are published once per room, not once per member, to the
+workers with a local member of the room online.
+
+- InMemoryBroker: single-process delivery (default).
+- RedisBroker: Redis pub/sub with one channel per online user and per room
+  with online members plus a broadcast channel, and node-scoped presence
+  hashes that expire if a worker dies without cleaning up.
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from app.core.config import BROKER_BACKEND, PRESENCE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Called by the broker for every message that must be delivered locally:
+# deliver(user_id, message, exclude_user_id, coalesce_key, room_id); user_id
+# is None for broadcasts and room messages (room_id set).
+DeliverHandler = Callable[
+    [Optional[int], dict, Optional[int], Optional[str], Optional[int]], Awaitable[None]
+]
+
+
+class Broker:
+    """
+    Interface shared by all broker backends.
+    """
+
+    async def start(self, deliver: DeliverHandler) -> None:
+        raise NotImplementedError
+
+    async def stop(self) -> None:
+        raise NotImplementedError
+
+    async def subscribe(self, user_id: int) -> None:
+        """
+        Start receiving messages for a user who connected to this worker.
+        """
+        raise NotImplementedError
+
+    async def unsubscribe(self, user_id: int) -> None:
+        """
+        Stop receiving messages for a user whose last local socket closed.
+        """
+        raise NotImplementedError
+
+    async def subscribe_room(self, room_id: int) -> None:
+        """
+        Start receiving a room's messages once a member is connected here.
+        """
+        raise NotImplementedError
+
+    async def unsubscribe_room(self, room_id: int) -> None:
+        """
+        Stop receiving a room's messages when no member is connected here.
+        """
+        raise NotImplementedError
+
+    async def publish(
+        self, user_id: int, message: dict, coalesce_key: Optional[str] = None
+    ) -> None:
+        raise NotImplementedError
+
+    async def publish_room(
+        self, room_id: int, message: dict, exclude_user_id: Optional[int] = None
+    ) -> None:
+        raise NotImplementedError
+
+    async def broadcast(
+        self,
+        message: dict,
+        exclude_user_id: Optional[int] = None,
+        coalesce_key: Optional[str] = None,
+    ) -> None:
+        raise NotImplementedError
+
+    async def online_users(self) -> List[int]:
+        raise NotImplementedError
+
+    async def presence(self, user_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        """
+        The users among user_ids online on any worker, with the status
+        shared through set_status (None when unset).
+        """
+        raise NotImplementedError
+
+    async def set_status(self, user_id: int, status: Optional[str]) -> None:
+        """
+        Share a user's presence status with every worker; None clears it.
+        """
+        raise NotImplementedError
+
+
+class InMemoryBroker(Broker):
+    """
+    Delivers messages within the current process only.
+    """
+
+    def __init__(self):
+        self._deliver: Optional[DeliverHandler] = None
+        self._presence: Counter = Counter()
+        self._status: Dict[int, str] = {}
+
+    async def start(self, deliver: DeliverHandler) -> None:
+        self._deliver = deliver
+
+    async def stop(self) -> None:
+        self._presence.clear()
+        self._status.clear()
+
+    async def subscribe(self, user_id: int) -> None:
+        self._presence[user_id] += 1
+
+    async def unsubscribe(self, user_id: int) -> None:
+        self._presence[user_id] -= 1
+        if self._presence[user_id] <= 0:
+            del self._presence[user_id]
+
+    async def subscribe_room(self, room_id: int) -> None:
+        pass
+
+    async def unsubscribe_room(self, room_id: int) -> None:
+        pass
+
+    async def publish(
+        self, user_id: int, message: dict, coalesce_key: Optional[str] = None
+    ) -> None:
+        if self._deliver is not None:
+            await self._deliver(user_id, message, None, coalesce_key, None)
+
+    async def publish_room(
+        self, room_id: int, message: dict, exclude_user_id: Optional[int] = None
+    ) -> None:
+        if self._deliver is not None:
+            await self._deliver(None, message, exclude_user_id, None, room_id)
+
+    async def broadcast(
+        self,
+        message: dict,
+        exclude_user_id: Optional[int] = None,
+        coalesce_key: Optional[str] = None,
+    ) -> None:
+        if self._deliver is not None:
+            await self._deliver(None, message, exclude_user_id, coalesce_key, None)
+
+    async def online_users(self) -> List[int]:
+        return list(self._presence.keys())
+
+    async def presence(self, user_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        return {
+            user_id: self._status.get(user_id)
+            for user_id in user_ids
+            if user_id in self._presence
+        }
+
+    async def set_status(self, user_id: int, status: Optional[str]) -> None:
+        if status is None:
+            self._status.pop(user_id, None)
+        else:
+            self._status[user_id] = status
+
+
+class RedisBroker(Broker):
+    """
+    Redis pub/sub broker for multi-worker / multi-node deployments.
+
+    Each worker subscribes to `<prefix>:user:<id>` for the users connected to
+    it, so a publish only reaches workers that can deliver it. Presence is
+    kept per node in `<prefix>:presence:<node_id>` with a TTL refreshed by a
+    keepalive task; `online_users` unions the hashes of live nodes, and
+    `presence` reads only the requested users' fields of each hash in one
+    round trip. Statuses set by users live in the `<prefix>:status` hash.
+
+    `client` may be any object exposing the redis-py asyncio API, which lets
+    tests run against a local stand-in such as fakeredis.
+    """
+
+    def __init__(
+        self,
+        client: Any = None,
+        prefix: str = "nextext",
+        presence_ttl: int = PRESENCE_TTL_SECONDS,
+    ):
+        if client is None:
+            from app.core.redis import get_redis
+
+            client = get_redis()
+        self.client = client
+        self.prefix = prefix
+        self.presence_ttl = presence_ttl
+        self.node_id = uuid.uuid4().hex
+        self._deliver: Optional[DeliverHandler] = None
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+        self._keepalive: Optional[asyncio.Task] = None
+
+    @property
+    def _broadcast_channel(self) -> str:
+        return f"{self.prefix}:broadcast"
+
+    @property
+    def _nodes_key(self) -> str:
+        return f"{self.prefix}:nodes"
+
+    @property
+    def _presence_key(self) -> str:
+        return f"{self.prefix}:presence:{self.node_id}"
+
+    @property
+    def _status_key(self) -> str:
+        return f"{self.prefix}:status"
+
+    def _user_channel(self, user_id: int) -> str:
+        return f"{self.prefix}:user:{user_id}"
+
+    def _room_channel(self, room_id: int) -> str:
+        return f"{self.prefix}:room:{room_id}"
+
+    async def start(self, deliver: DeliverHandler) -> None:
+        self._deliver = deliver
+        self._pubsub = self.client.pubsub()
+        await self._pubsub.subscribe(self._broadcast_channel)
+        await self.client.sadd(self._nodes_key, self.node_id)
+        self._reader = asyncio.create_task(self._read_loop())
+        self._keepalive = asyncio.create_task(self._keepalive_loop())
+        logger.info(f"Redis broker started (node {self.node_id}).")
+
+    async def stop(self) -> None:
+        for task in (self._reader, self._keepalive):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(
+            *(t for t in (self._reader, self._keepalive) if t is not None),
+            return_exceptions=True,
+        )
+        self._reader = self._keepalive = None
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe()
+            await self._pubsub.close()
+            self._pubsub = None
+        await self.client.delete(self._presence_key)
+        await self.client.srem(self._nodes_key, self.node_id)
+        logger.info(f"Redis broker stopped (node {self.node_id}).")
+
+    async def subscribe(self, user_id: int) -> None:
+        await self._pubsub.subscribe(self._user_channel(user_id))
+        await self.client.hincrby(self._presence_key, str(user_id), 1)
+        await self.client.expire(self._presence_key, self.presence_ttl)
+
+    async def unsubscribe(self, user_id: int) -> None:
+        await self._pubsub.unsubscribe(self._user_channel(user_id))
+        remaining = await self.client.hincrby(self._presence_key, str(user_id), -1)
+        if int(remaining) <= 0:
+            await self.client.hdel(self._presence_key, str(user_id))
+
+    async def subscribe_room(self, room_id: int) -> None:
+        await self._pubsub.subscribe(self._room_channel(room_id))
+
+    async def unsubscribe_room(self, room_id: int) -> None:
+        await self._pubsub.unsubscribe(self._room_channel(room_id))
+
+    async def publish(
+        self, user_id: int, message: dict, coalesce_key: Optional[str] = None
+    ) -> None:
+        envelope = {"message": message, "coalesce": coalesce_key}
+        await self.client.publish(self._user_channel(user_id), json.dumps(envelope))
+
+    async def publish_room(
+        self, room_id: int, message: dict, exclude_user_id: Optional[int] = None
+    ) -> None:
+        envelope = {"message": message, "exclude": exclude_user_id}
+        await self.client.publish(self._room_channel(room_id), json.dumps(envelope))
+
+    async def broadcast(
+        self,
+        message: dict,
+        exclude_user_id: Optional[int] = None,
+        coalesce_key: Optional[str] = None,
+    ) -> None:
+        envelope = {"message": message, "exclude": exclude_user_id, "coalesce": coalesce_key}
+        await self.client.publish(self._broadcast_channel, json.dumps(envelope))
+
+    async def online_users(self) -> List[int]:
+        online = set()
+        for node_id in await self.client.smembers(self._nodes_key):
+            counts = await self.client.hgetall(f"{self.prefix}:presence:{node_id}")
+            if not counts:
+                if node_id != self.node_id:
+                    # Expired or empty presence: an idle node re-registers on
+                    # its next keepalive, a dead one drops out for good.
+                    await self.client.srem(self._nodes_key, node_id)
+                continue
+            online.update(int(uid) for uid, count in counts.items() if int(count) > 0)
+        return list(online)
+
+    async def presence(self, user_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        fields = [str(user_id) for user_id in user_ids]
+        if not fields:
+            return {}
+        nodes = await self.client.smembers(self._nodes_key)
+        async with self.client.pipeline(transaction=False) as pipe:
+            for node_id in nodes:
+                pipe.hmget(f"{self.prefix}:presence:{node_id}", fields)
+            pipe.hmget(self._status_key, fields)
+            *node_counts, statuses = await pipe.execute()
+        online = set()
+        for counts in node_counts:
+            online.update(
+                int(field) for field, count in zip(fields, counts)
+                if count is not None and int(count) > 0
+            )
+        return {
+            int(field): status
+            for field, status in zip(fields, statuses)
+            if int(field) in online
+        }
+
+    async def set_status(self, user_id: int, status: Optional[str]) -> None:
+        if status is None:
+            await self.client.hdel(self._status_key, str(user_id))
+        else:
+            await self.client.hset(self._status_key, str(user_id), status)
+
+    async def _read_loop(self) -> None:
+        """
+        Dispatch pub/sub messages to the local delivery handler.
+        """
+        user_prefix = f"{self.prefix}:user:"
+        room_prefix = f"{self.prefix}:room:"
+        while True:
+            try:
+                async for item in self._pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    channel = item["channel"]
+                    data = json.loads(item["data"])
+                    user_id = room_id = None
+                    if channel.startswith(user_prefix):
+                        user_id = int(channel[len(user_prefix):])
+                    elif channel.startswith(room_prefix):
+                        room_id = int(channel[len(room_prefix):])
+                    elif channel != self._broadcast_channel:
+                        continue
+                    await self._deliver(
+                        user_id,
+                        data["message"],
+                        data.get("exclude"),
+                        data.get("coalesce"),
+                        room_id,
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Redis broker read loop error: {e}")
+                await asyncio.sleep(1)
+
+    async def _keepalive_loop(self) -> None:
+        """
+        Keep this node registered and its presence hash alive.
+        """
+        while True:
+            await asyncio.sleep(max(self.presence_ttl / 3, 1))
+            try:
+                await self.client.sadd(self._nodes_key, self.node_id)
+                await self.client.expire(self._presence_key, self.presence_ttl)
+            except Exception as e:
+                logger.warning(f"Redis broker keepalive failed: {e}")
+
+
+def create_broker() -> Broker:
+    """
+    Build the broker selected by BROKER_BACKEND ("memory" or "redis").
+    """
+    if BROKER_BACKEND == "redis":
+        return RedisBroker()
+    if BROKER_BACKEND != "memory":
+        raise ValueError(f"Unknown BROKER_BACKEND: {BROKER_BACKEND!r}")
+    return InMemoryBroker()
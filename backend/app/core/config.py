@@ -8,11 +8,172 @@ load_dotenv(dotenv_path=os.path.join(BASE_DIR, ".env"))
 # Database
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Read replicas: comma-separated URLs (empty: every read goes to the
+# primary), seconds a user's reads stay on the primary after they wrote
+# (read-your-writes) and where that is recorded ("memory" for this worker
+# only, "redis" to share it between workers), and seconds an unreachable
+# replica is skipped
+_raw_replica_urls = os.getenv("DATABASE_REPLICA_URLS", "")
+DATABASE_REPLICA_URLS = [url.strip() for url in _raw_replica_urls.split(",") if url.strip()]
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+REPLICA_STICKY_BACKEND = os.getenv("REPLICA_STICKY_BACKEND", "memory").lower()
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+
+# Message shards: comma-separated URLs of the databases added to the
+# primary (shard 0) to hold conversations, and seconds between reloads of
+# the slot -> shard map in each worker
+_raw_shard_urls = os.getenv("DATABASE_SHARD_URLS", "")
+DATABASE_SHARD_URLS = [url.strip() for url in _raw_shard_urls.split(",") if url.strip()]
+SHARD_MAP_REFRESH_SECONDS = float(os.getenv("SHARD_MAP_REFRESH_SECONDS", "5"))
+
+# Connection pool: persistent connections, extra burst connections, seconds
+# to wait for a free connection, connection max age in seconds, and whether
+# to test connections on checkout
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# SQL echo logging (every statement; for local debugging only)
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+
+# Profiling: statement counts/timings per request and WebSocket frame
+# (Server-Timing header, N+1 warnings when one statement runs at least
+# PROFILE_N_PLUS_ONE_THRESHOLD times), and per-request cProfile/pyinstrument
+# capture for requests sending "X-Profile: <PROFILE_TOKEN>" (disabled while
+# the token is empty)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_N_PLUS_ONE_THRESHOLD = int(os.getenv("PROFILE_N_PLUS_ONE_THRESHOLD", "10"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+
+# Slow-query log: statements slower than SLOW_QUERY_MS (0 disables) are
+# logged with parameters redacted, sampled at SLOW_QUERY_SAMPLE_RATE (0-1)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "1.0"))
+
+# Chat history pagination
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "500"))
+HISTORY_EXPORT_CHUNK = int(os.getenv("HISTORY_EXPORT_CHUNK", "1000"))
+
+# Retention: messages older than RETENTION_HOT_DAYS are moved from
+# chat_messages into monthly archive partitions by a background job (when
+# enabled; run it on one worker only) in batches of RETENTION_BATCH_SIZE
+# rows, pausing RETENTION_BATCH_PAUSE_MS between batches, every
+# RETENTION_INTERVAL_SECONDS
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "false").lower() in ("1", "true", "yes")
+RETENTION_HOT_DAYS = float(os.getenv("RETENTION_HOT_DAYS", "90"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_BATCH_PAUSE_MS = float(os.getenv("RETENTION_BATCH_PAUSE_MS", "200"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+
+# Message search pagination
+MESSAGE_SEARCH_PAGE_SIZE = int(os.getenv("MESSAGE_SEARCH_PAGE_SIZE", "20"))
+MESSAGE_SEARCH_MAX_PAGE_SIZE = int(os.getenv("MESSAGE_SEARCH_MAX_PAGE_SIZE", "100"))
+
+# Group rooms: max members per room
+ROOM_MAX_MEMBERS = int(os.getenv("ROOM_MAX_MEMBERS", "10000"))
+
+# Conversation list pagination
+CONVERSATION_PAGE_SIZE = int(os.getenv("CONVERSATION_PAGE_SIZE", "30"))
+CONVERSATION_MAX_PAGE_SIZE = int(os.getenv("CONVERSATION_MAX_PAGE_SIZE", "200"))
+
+# Redis (shared tier for multi-worker deployments)
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# WebSocket fan-out broker: "memory" (single worker) or "redis" (pub/sub)
+BROKER_BACKEND = os.getenv("BROKER_BACKEND", "memory").lower()
+PRESENCE_TTL_SECONDS = int(os.getenv("PRESENCE_TTL_SECONDS", "30"))
+
+# Per-connection outbound queues: frame bound, full-queue policy
+# ("drop", "disconnect" or "coalesce") and per-frame send timeout in seconds
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_BACKPRESSURE_POLICY = os.getenv("WS_BACKPRESSURE_POLICY", "drop").lower()
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+# Max queued frames sent as one batch frame to clients that opt in (?batch=1)
+WS_BATCH_MAX_FRAMES = int(os.getenv("WS_BATCH_MAX_FRAMES", "32"))
+# Heartbeats: seconds of client silence before the server sends a ping
+# frame (0 disables heartbeats and idle reaping), and seconds of silence
+# after which the connection is closed as dead
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60"))
+
+# Typing indicators: min interval between forwarded "start" events per peer
+# (ms) and how long clients show one without a refresh (ms)
+TYPING_MIN_INTERVAL_MS = float(os.getenv("TYPING_MIN_INTERVAL_MS", "2000"))
+TYPING_TTL_MS = int(os.getenv("TYPING_TTL_MS", "6000"))
+
+# Contact sets kept after a user's last session closes, so reconnects skip
+# the cross-shard contact query: max users and seconds
+PRESENCE_CONTACTS_CACHE_SIZE = int(os.getenv("PRESENCE_CONTACTS_CACHE_SIZE", "10000"))
+PRESENCE_CONTACTS_CACHE_SECONDS = float(os.getenv("PRESENCE_CONTACTS_CACHE_SECONDS", "300"))
+
+# Large payloads: max WebSocket frame size (bytes, closes with 1009), max
+# message content (bytes, rejected), content size above which the body is
+# offloaded to chat_message_bodies, and characters per stored body chunk
+WS_MAX_FRAME_BYTES = int(os.getenv("WS_MAX_FRAME_BYTES", str(1024 * 1024)))
+MESSAGE_MAX_CONTENT_BYTES = int(os.getenv("MESSAGE_MAX_CONTENT_BYTES", str(256 * 1024)))
+MESSAGE_INLINE_MAX_BYTES = int(os.getenv("MESSAGE_INLINE_MAX_BYTES", "4096"))
+MESSAGE_BODY_CHUNK_CHARS = int(os.getenv("MESSAGE_BODY_CHUNK_CHARS", "16384"))
+
+# permessage-deflate (applied by `python -m app.server`): enable, smallest
+# frame worth compressing (bytes), zlib level, and max window bits (8-15;
+# lower saves per-connection memory at some ratio cost)
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() in ("1", "true", "yes")
+WS_DEFLATE_MIN_BYTES = int(os.getenv("WS_DEFLATE_MIN_BYTES", "256"))
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", "6"))
+WS_DEFLATE_MAX_WINDOW_BITS = int(os.getenv("WS_DEFLATE_MAX_WINDOW_BITS", "15"))
+
+# Write-behind message ingest: rows per INSERT, max wait before a partial
+# batch is flushed (ms), and max queued messages before submitters wait
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+INGEST_MAX_WAIT_MS = float(os.getenv("INGEST_MAX_WAIT_MS", "5"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+
+# Recently stored (sender, client_msg_id) pairs kept per worker, so retried
+# sends are answered without a query
+MESSAGE_DEDUPE_CACHE_SIZE = int(os.getenv("MESSAGE_DEDUPE_CACHE_SIZE", "10000"))
+
+# Max messages pushed in one reconnect sync frame
+SYNC_BATCH_LIMIT = int(os.getenv("SYNC_BATCH_LIMIT", "500"))
+
+# Rate limits as "N/S" (bursts of N, refilled at N per S seconds), keyed per
+# client IP (login, register, ws_connect), username (login_user, charged
+# by failed logins only), user id (ws_messages) or WebSocket connection
+# (ws_frames); backend "memory" or "redis" (shared by workers), and max
+# in-process buckets
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+RATE_LIMIT_POLICIES = {
+    "login": os.getenv("RATE_LIMIT_LOGIN", "10/60"),
+    "login_user": os.getenv("RATE_LIMIT_LOGIN_USER", "5/60"),
+    "register": os.getenv("RATE_LIMIT_REGISTER", "5/60"),
+    "ws_connect": os.getenv("RATE_LIMIT_WS_CONNECT", "30/60"),
+    "ws_frames": os.getenv("RATE_LIMIT_WS_FRAMES", "50/1"),
+    "ws_messages": os.getenv("RATE_LIMIT_WS_MESSAGES", "20/1"),
+}
+
 # JWT settings
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
 
+# Password hashing: bcrypt cost factor (existing hashes are upgraded on
+# login when it changes), worker pool kind ("thread" or "process") and size,
+# and max queued hash operations before requests are refused with 503
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread").lower()
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+# Auth caches: entry TTL (s), max cached users / decoded tokens, and the
+# shared tier ("memory" for in-process only, "redis" to add a Redis tier)
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_CACHE_BACKEND = os.getenv("AUTH_CACHE_BACKEND", "memory").lower()
+
 # CORS settings
 _raw_origins = os.getenv("FRONTEND_ORIGINS", "")
 # Parse comma-separated list into Python list, stripping whitespace
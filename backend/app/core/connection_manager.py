@@ -1,77 +1,343 @@
 # backend/app/core/connection_manager.py
 
+import asyncio
 import logging
-from typing import Dict, List
+import time
+from typing import Dict, Iterable, List, Optional, Set
 
-from fastapi import WebSocket
+from fastapi import WebSocket, status
+
+from app.core.broker import Broker, InMemoryBroker
+from app.core.config import WS_BATCH_MAX_FRAMES, WS_HEARTBEAT_INTERVAL, WS_IDLE_TIMEOUT
+from app.core.metrics import FANOUT_SECONDS, WS_REAPED
+from app.core.send_queue import SendQueue
+from app.core.wire import Codec, Frame, accepted_subprotocol, negotiate
 
 logger = logging.getLogger(__name__)
 
+# Events sent to a user when they are added to / removed from a room
+ROOM_JOINED = "room_joined"
+ROOM_LEFT = "room_left"
+
+# Heartbeat frames: the server pings silent connections, clients answer
+PING = "ping"
+PONG = "pong"
+
+# Connections visited per event loop turn by the heartbeat sweep
+SWEEP_CHUNK = 5000
+
+
+class Connection:
+    """
+    Registry entry for one local WebSocket: its owner, wire codec, send
+    queue and when it last sent a frame (monotonic seconds).
+    """
+    __slots__ = ("user_id", "websocket", "codec", "queue", "connected_at", "last_seen")
+
+    def __init__(self, user_id: int, websocket: WebSocket, codec: Codec, queue: SendQueue):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.codec = codec
+        self.queue = queue
+        self.connected_at = self.last_seen = time.monotonic()
+
+    def touch(self):
+        """
+        Record a frame received from the client.
+        """
+        self.last_seen = time.monotonic()
+
 
 class ConnectionManager:
     """
     Manages WebSocket connections for real-time chat.
     Supports multiple concurrent connections per user,
     graceful cleanup, and broadcasting.
+
+    Messages are published through a Broker, which delivers them back to
+    every worker holding a socket for the target user, so sends and
+    presence work the same with one worker or many.
+
+    Every socket has its own bounded SendQueue drained by a writer task, so
+    delivery is a non-blocking enqueue per recipient socket. A delivered
+    message is wrapped in one Frame shared by all those queues, so it is
+    serialized once per wire codec, not once per socket.
+
+    Room membership of locally connected users is indexed both ways
+    (room -> local users, user -> rooms), so a room message costs one
+    publish and then work proportional to the room's members online on
+    this worker, never to all connected users. Users are added to the index
+    by track_rooms after connecting and dropped with their last session;
+    "room_joined"/"room_left" events delivered to a user also update it, on
+    whichever worker holds their sockets.
+
+    Liveness is checked by one heartbeat sweep per worker rather than a
+    timer per socket: every heartbeat_interval, connections that have been
+    silent that long are sent a shared ping frame (which clients answer
+    with a pong), and those silent for idle_timeout are closed with 1001
+    and dropped from the registry, so half-open sockets stop counting as
+    online within idle_timeout plus one sweep.
     """
 
-    def __init__(self):
-        # Maps user_id to a list of WebSocket connections
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+    def __init__(
+        self,
+        broker: Optional[Broker] = None,
+        heartbeat_interval: float = WS_HEARTBEAT_INTERVAL,
+        idle_timeout: float = WS_IDLE_TIMEOUT,
+    ):
+        # Maps user_id to the user's connections on this worker
+        self.active_connections: Dict[int, Set[Connection]] = {}
+        # Maps each local WebSocket to its connection
+        self.connections: Dict[WebSocket, Connection] = {}
+        # Room membership of the users connected to this worker
+        self.room_members: Dict[int, Set[int]] = {}
+        self.user_rooms: Dict[int, Set[int]] = {}
+        self.broker: Broker = broker or InMemoryBroker()
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self._heartbeat_task: Optional[asyncio.Task] = None
 
-    async def connect(self, user_id: int, websocket: WebSocket):
+    async def start(self):
         """
-        Accepts the WebSocket and registers it under the given user_id.
+        Starts the broker, routing its deliveries to local sockets, and the
+        heartbeat sweep.
         """
-        await websocket.accept()
-        self.active_connections.setdefault(user_id, []).append(websocket)
-        logger.info(f"User {user_id} connected ({len(self.active_connections[user_id])} sessions).")
+        await self.broker.start(self._deliver_local)
+        if self.heartbeat_interval > 0:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
 
-    def disconnect(self, user_id: int, websocket: WebSocket):
+    async def stop(self):
+        """
+        Stops the heartbeat sweep and the broker; local sockets are left to
+        the server to close.
+        """
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+        await self.broker.stop()
+
+    async def connect(self, user_id: int, websocket: WebSocket, batch: bool = False) -> Connection:
+        """
+        Negotiates the wire codec, accepts the WebSocket and registers it
+        under the given user_id. With batch, queued frames may be sent
+        together as one batch frame. Returns the connection, whose codec
+        reads the client's frames.
+        """
+        codec = negotiate(websocket)
+        await websocket.accept(subprotocol=accepted_subprotocol(websocket, codec))
+
+        async def on_failure(ws: WebSocket):
+            await self.disconnect(user_id, ws)
+
+        queue = SendQueue(
+            websocket,
+            on_failure,
+            codec=codec,
+            batch_max=WS_BATCH_MAX_FRAMES if batch else 1,
+        )
+        connection = self.connections[websocket] = Connection(user_id, websocket, codec, queue)
+        connections = self.active_connections.setdefault(user_id, set())
+        connections.add(connection)
+        if len(connections) == 1:
+            await self.broker.subscribe(user_id)
+        logger.info(f"User {user_id} connected ({len(connections)} sessions, {codec.name}).")
+        return connection
+
+    async def disconnect(self, user_id: int, websocket: WebSocket):
         """
         Removes a specific WebSocket connection for a user.
         Cleans up the user entry if no connections remain.
         """
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        await connection.queue.aclose()
         connections = self.active_connections.get(user_id)
-        if not connections:
+        if connections is None:
             return
-        if websocket in connections:
-            connections.remove(websocket)
-            logger.info(f"User {user_id} disconnected ({len(connections)} sessions remaining).")
+        connections.discard(connection)
+        logger.info(f"User {user_id} disconnected ({len(connections)} sessions remaining).")
         if not connections:
             self.active_connections.pop(user_id, None)
+            await self.broker.unsubscribe(user_id)
+            for room_id in list(self.user_rooms.get(user_id, ())):
+                await self.untrack_room(user_id, room_id)
+            self.user_rooms.pop(user_id, None)
             logger.info(f"No active sessions left for user {user_id}; removed from registry.")
 
-    async def send_personal_message(self, message: dict, user_id: int):
+    async def send_personal_message(
+        self, message: dict, user_id: int, coalesce_key: Optional[str] = None
+    ):
+        """
+        Sends a JSON message to all active WebSocket sessions of a single user,
+        on whichever worker they are connected to.
+        Frames sharing a coalesce_key replace each other while still queued.
+        """
+        start = time.perf_counter()
+        await self.broker.publish(user_id, message, coalesce_key)
+        FANOUT_SECONDS.observe(time.perf_counter() - start, "personal")
+
+    async def send_room_message(
+        self, message: dict, room_id: int, exclude_user_id: Optional[int] = None
+    ):
+        """
+        Sends a JSON message to the online members of a room on every
+        worker: one publish, and one shared Frame per worker.
+        """
+        start = time.perf_counter()
+        await self.broker.publish_room(room_id, message, exclude_user_id)
+        FANOUT_SECONDS.observe(time.perf_counter() - start, "room")
+
+    async def track_rooms(self, user_id: int, room_ids: Iterable[int]):
         """
-        Sends a JSON message to all active WebSocket sessions of a single user.
-        Cleans up any sessions that have been closed unexpectedly.
+        Adds a locally connected user to the membership index of the given rooms.
         """
-        connections = self.active_connections.get(user_id, [])
-        for ws in connections.copy():
+        if user_id not in self.active_connections:
+            return
+        rooms = self.user_rooms.setdefault(user_id, set())
+        for room_id in room_ids:
+            if room_id in rooms:
+                continue
+            rooms.add(room_id)
+            members = self.room_members.setdefault(room_id, set())
+            members.add(user_id)
+            if len(members) == 1:
+                await self.broker.subscribe_room(room_id)
+
+    async def untrack_room(self, user_id: int, room_id: int):
+        """
+        Removes a user from a room's local membership index.
+        """
+        rooms = self.user_rooms.get(user_id)
+        if rooms is not None:
+            rooms.discard(room_id)
+        members = self.room_members.get(room_id)
+        if members is None or user_id not in members:
+            return
+        members.discard(user_id)
+        if not members:
+            del self.room_members[room_id]
+            await self.broker.unsubscribe_room(room_id)
+
+    async def broadcast(
+        self,
+        message: dict,
+        exclude_user_id: int = None,
+        coalesce_key: Optional[str] = None,
+    ):
+        """
+        Broadcasts a JSON message to all users except the optional exclude_user_id.
+        """
+        start = time.perf_counter()
+        await self.broker.broadcast(message, exclude_user_id, coalesce_key)
+        FANOUT_SECONDS.observe(time.perf_counter() - start, "broadcast")
+
+    def send_to_socket(self, websocket: WebSocket, message: dict) -> bool:
+        """
+        Queues a message on one local socket only (e.g. a reply to a request
+        frame). Returns False if the socket is gone or its queue refused it.
+        """
+        connection = self.connections.get(websocket)
+        return connection is not None and connection.queue.put(Frame(message))
+
+    async def _deliver_local(
+        self,
+        user_id: Optional[int],
+        message: dict,
+        exclude_user_id: Optional[int] = None,
+        coalesce_key: Optional[str] = None,
+        room_id: Optional[int] = None,
+    ):
+        """
+        Broker callback: queues a message on the sockets held by this worker.
+        user_id None means a room message (room_id set) or a broadcast.
+        Never awaits the network; writer tasks send the frames and clean up
+        sockets that fail.
+        """
+        if room_id is not None:
+            targets = [uid for uid in self.room_members.get(room_id, ()) if uid != exclude_user_id]
+        elif user_id is None:
+            targets = [uid for uid in self.active_connections if uid != exclude_user_id]
+        else:
+            targets = [user_id]
+            # Membership changes reach the worker holding the user's sockets
+            if message.get("type") == ROOM_JOINED:
+                await self.track_rooms(user_id, [message["room_id"]])
+            elif message.get("type") == ROOM_LEFT:
+                await self.untrack_room(user_id, message["room_id"])
+
+        frame = Frame(message)
+        for uid in targets:
+            for connection in self.active_connections.get(uid, ()):
+                if not connection.queue.put(frame, coalesce_key):
+                    logger.debug(f"Dropped frame for user {uid}: send queue full or closed.")
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
             try:
-                await ws.send_json(message)
+                await self.sweep()
             except Exception as e:
-                logger.warning(f"Error sending message to user {user_id}: {e}")
-                self.disconnect(user_id, ws)
+                logger.error(f"Heartbeat sweep failed: {e}")
 
-    async def broadcast(self, message: dict, exclude_user_id: int = None):
+    async def sweep(self) -> int:
         """
-        Broadcasts a JSON message to all users except the optional exclude_user_id.
-        Cleans up any closed connections encountered.
+        Pings the connections silent for heartbeat_interval and closes those
+        silent for idle_timeout. Yields to the event loop every SWEEP_CHUNK
+        connections. Returns the number of connections closed.
         """
-        for uid, connections in list(self.active_connections.items()):
-            if uid == exclude_user_id:
+        now = time.monotonic()
+        # One frame for every ping of the sweep, serialized once per codec
+        ping = Frame({"type": PING})
+        reaped = 0
+        for index, connection in enumerate(list(self.connections.values())):
+            if index and index % SWEEP_CHUNK == 0:
+                await asyncio.sleep(0)
+            if connection.queue.closed:
                 continue
-            for ws in connections.copy():
-                try:
-                    await ws.send_json(message)
-                except Exception as e:
-                    logger.warning(f"Error broadcasting to user {uid}: {e}")
-                    self.disconnect(uid, ws)
+            silent = now - connection.last_seen
+            if silent >= self.idle_timeout:
+                logger.info(
+                    f"Closing idle WebSocket of user {connection.user_id} "
+                    f"(silent for {silent:.0f}s)."
+                )
+                # The writer closes the socket, then disconnects it
+                connection.queue.close(status.WS_1001_GOING_AWAY)
+                WS_REAPED.inc()
+                reaped += 1
+            elif silent >= self.heartbeat_interval:
+                connection.queue.put(ping, PING)
+        return reaped
+
+    def queue_depths(self) -> List[int]:
+        """
+        Returns the number of frames waiting in each local send queue.
+        """
+        return [len(connection.queue) for connection in self.connections.values()]
 
-    def get_online_users(self) -> List[int]:
+    def get_local_users(self) -> List[int]:
         """
-        Returns a list of user_ids who currently have at least one active connection.
+        Returns the user_ids with at least one connection on this worker.
         """
         return list(self.active_connections.keys())
+
+    async def get_online_users(self) -> List[int]:
+        """
+        Returns a list of user_ids who currently have at least one active
+        connection on any worker.
+        """
+        return await self.broker.online_users()
+
+    async def get_presence(self, user_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        """
+        Returns the users among user_ids with an active connection on any
+        worker, with the status shared through set_status (None when unset).
+        """
+        return await self.broker.presence(user_ids)
+
+    async def set_status(self, user_id: int, status: Optional[str]):
+        """
+        Shares a user's presence status with every worker; None clears it.
+        """
+        await self.broker.set_status(user_id, status)
@@ -0,0 +1,315 @@
+# backend/app/core/conversations.py
+
+"""
+Maintenance and reads of the denormalized conversation summaries.
+
+update_conversations runs as a MessageIngest hook, inside the transaction
+that inserts a batch: it folds the batch into one summary per user pair
+and applies them with a single multi-row upsert (last message fields move
+forward, unread counters are incremented). Read receipts recount the
+reader's unread counter. rebuild_conversations recomputes every summary
+from the messages, archive partitions included, e.g. after a bulk import.
+
+The summary row also holds the conversation's sequence counter:
+reserve_sequences runs before a batch is inserted and allocates each
+message its per-conversation seq.
+
+Summaries live on their conversation's shard; per-user lists and contact
+sets are read from every shard and merged (see app.db.shards).
+"""
+
+import heapq
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import bindparam, case, delete, func, insert, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+
+from app.core.history import stream_message_tables
+from app.core.retention import list_partitions
+from app.db.shards import on_every_shard
+from app.db.upsert import execute_upsert
+from app.models.conversation import Conversation, PREVIEW_LENGTH
+from app.models.message import ChatMessage
+from app.models.receipt import ReadCursor
+
+_LAST_FIELDS = ("last_message_id", "last_sender_id", "last_preview", "last_timestamp")
+
+
+def conversation_key(user_a: int, user_b: int) -> Tuple[int, int]:
+    """
+    Stable key of the unordered user pair: (lower id, higher id).
+    """
+    return (user_a, user_b) if user_a <= user_b else (user_b, user_a)
+
+
+def _accumulate(
+    summaries: Dict[Tuple[int, int], dict],
+    msg_id: int,
+    sender_id: int,
+    recipient_id: int,
+    content: str,
+    timestamp,
+    seq: Optional[int],
+    unread: bool = True,
+):
+    low, high = conversation_key(sender_id, recipient_id)
+    summary = summaries.setdefault((low, high), {
+        "user_low_id": low,
+        "user_high_id": high,
+        "last_message_id": 0,
+        "last_seq": 0,
+        "unread_low": 0,
+        "unread_high": 0,
+    })
+    if msg_id > summary["last_message_id"]:
+        summary.update(
+            last_message_id=msg_id,
+            last_sender_id=sender_id,
+            last_preview=content[:PREVIEW_LENGTH],
+            last_timestamp=timestamp,
+        )
+    if seq is not None and seq > summary["last_seq"]:
+        summary["last_seq"] = seq
+    if unread and sender_id != recipient_id:
+        summary["unread_low" if recipient_id == low else "unread_high"] += 1
+
+
+async def update_conversations(db: AsyncSession, messages: List[ChatMessage]):
+    """
+    MessageIngest hook: fold a persisted batch into the conversation summaries.
+    """
+    summaries: Dict[Tuple[int, int], dict] = {}
+    for msg in messages:
+        _accumulate(
+            summaries, msg.id, msg.sender_id, msg.recipient_id, msg.content, msg.timestamp, msg.seq
+        )
+    if not summaries:
+        return
+
+    table = Conversation.__table__
+
+    def set_(excluded):
+        newer = excluded.last_message_id > table.c.last_message_id
+        values = {
+            name: case((newer, getattr(excluded, name)), else_=table.c[name])
+            for name in _LAST_FIELDS
+        }
+        values["unread_low"] = table.c.unread_low + excluded.unread_low
+        values["unread_high"] = table.c.unread_high + excluded.unread_high
+        return values
+
+    await execute_upsert(
+        db,
+        table,
+        list(summaries.values()),
+        ["user_low_id", "user_high_id"],
+        set_,
+    )
+
+
+async def reserve_sequences(db: AsyncSession, pairs: Sequence[Tuple[int, int]]) -> List[int]:
+    """
+    Allocate sequence numbers for a batch about to be inserted, given the
+    (sender_id, recipient_id) of each message in insert order. Returns one
+    seq per message.
+
+    One upsert advances last_seq of every conversation in the batch by its
+    number of messages and returns the new values. The
+    summary rows stay locked until the batch commits, so concurrent batches
+    of a conversation get consecutive ranges, in commit order. Summaries of
+    new conversations are created with placeholder last message fields,
+    which update_conversations fills in the same transaction.
+    """
+    counts: Dict[Tuple[int, int], int] = {}
+    for sender_id, recipient_id in pairs:
+        key = conversation_key(sender_id, recipient_id)
+        counts[key] = counts.get(key, 0) + 1
+
+    table = Conversation.__table__
+    now = datetime.now(timezone.utc)
+    # Sorted, so concurrent batches lock summary rows in the same order
+    rows = [
+        {
+            "user_low_id": low,
+            "user_high_id": high,
+            "last_message_id": 0,
+            "last_sender_id": low,
+            "last_preview": "",
+            "last_timestamp": now,
+            "last_seq": count,
+            "unread_low": 0,
+            "unread_high": 0,
+        }
+        for (low, high), count in sorted(counts.items())
+    ]
+    returned = await execute_upsert(
+        db,
+        table,
+        rows,
+        ["user_low_id", "user_high_id"],
+        lambda excluded: {"last_seq": table.c.last_seq + excluded.last_seq},
+        returning=(table.c.user_low_id, table.c.user_high_id, table.c.last_seq),
+    )
+
+    next_seq = {
+        (low, high): last_seq - counts[(low, high)] + 1
+        for low, high, last_seq in returned
+    }
+    seqs = []
+    for sender_id, recipient_id in pairs:
+        key = conversation_key(sender_id, recipient_id)
+        seqs.append(next_seq[key])
+        next_seq[key] += 1
+    return seqs
+
+
+async def recount_unread(db: AsyncSession, user_id: int, peer_id: int, read_id: int):
+    """
+    Recompute user_id's unread counter for the conversation with peer_id
+    from their read watermark (see mark_read), and commit. `db` is a
+    session on the conversation's shard.
+
+    The summary row is locked first, so an ingest batch holding it (see
+    reserve_sequences) commits before the count, and later batches wait
+    until the recount commits; the count then runs as a subquery of the
+    UPDATE. No batch's increment is overwritten by a stale count.
+    """
+    unread = (
+        select(func.count()).select_from(ChatMessage).filter(
+            ChatMessage.sender_id == peer_id,
+            ChatMessage.recipient_id == user_id,
+            ChatMessage.id > read_id,
+        )
+        .scalar_subquery()
+    )
+    low, high = conversation_key(user_id, peer_id)
+    key = (Conversation.user_low_id == low, Conversation.user_high_id == high)
+    await db.execute(select(Conversation.last_seq).where(*key).with_for_update())
+    column = Conversation.unread_low if user_id == low else Conversation.unread_high
+    await db.execute(update(Conversation).where(*key).values({column: unread}))
+    await db.commit()
+
+
+async def list_conversations(
+    db: AsyncSession, user_id: int, before: Optional[int], limit: int
+) -> List[Conversation]:
+    """
+    One page of a user's conversations, most recent activity first.
+    Each side of the pair is an index range scan; the two bounded legs are
+    merged in the same statement.
+    """
+    legs = []
+    for own, other in (
+        (Conversation.user_low_id, None),
+        (Conversation.user_high_id, Conversation.user_low_id),
+    ):
+        leg = select(Conversation).filter(own == user_id)
+        if other is not None:
+            # A conversation with oneself is already in the first leg
+            leg = leg.filter(other != user_id)
+        if before is not None:
+            leg = leg.filter(Conversation.last_message_id < before)
+        leg = leg.order_by(Conversation.last_message_id.desc()).limit(limit)
+        legs.append(select(leg.subquery()))
+
+    merged = aliased(Conversation, union_all(*legs).subquery())
+    result = await db.execute(
+        select(merged).order_by(merged.last_message_id.desc()).limit(limit)
+    )
+    return list(result.scalars())
+
+
+async def list_all_conversations(user_id: int, before: Optional[int], limit: int) -> List[Conversation]:
+    """
+    list_conversations across every shard, merged by last activity.
+    """
+    pages = await on_every_shard(
+        lambda db: list_conversations(db, user_id, before, limit), user_id=user_id
+    )
+    conversations: List[Conversation] = []
+    seen: Set[Tuple[int, int]] = set()
+    # A conversation being moved is briefly on two shards
+    for conversation in heapq.merge(*pages, key=lambda c: -c.last_message_id):
+        key = (conversation.user_low_id, conversation.user_high_id)
+        if key not in seen:
+            seen.add(key)
+            conversations.append(conversation)
+    return conversations[:limit]
+
+
+async def load_contacts(user_id: int) -> Set[int]:
+    """
+    Ids of everyone user_id has a conversation with, read from the two
+    per-side summary indexes of every shard.
+    """
+    async def contacts(db: AsyncSession) -> List[int]:
+        result = await db.execute(union_all(
+            select(Conversation.user_high_id).filter(Conversation.user_low_id == user_id),
+            select(Conversation.user_low_id).filter(Conversation.user_high_id == user_id),
+        ))
+        return list(result.scalars())
+
+    return {
+        peer_id
+        for shard in await on_every_shard(contacts, user_id=user_id)
+        for peer_id in shard
+        if peer_id != user_id
+    }
+
+
+async def load_read_ids(db: AsyncSession) -> Dict[Tuple[int, int], int]:
+    """
+    Every read watermark, as (user_id, peer_id) -> read_id (primary database).
+    """
+    return {
+        (user_id, peer_id): read_id
+        for user_id, peer_id, read_id in await db.execute(
+            select(ReadCursor.user_id, ReadCursor.peer_id, ReadCursor.read_id)
+        )
+    }
+
+
+async def rebuild_conversations(
+    db: AsyncSession, read_ids: Dict[Tuple[int, int], int], chunk_size: int = 1000
+) -> int:
+    """
+    Recompute the conversation summaries of one shard from its messages,
+    archived and hot, and the read watermarks (see load_read_ids), streaming
+    the messages. Like recount_unread, only hot messages count as unread.
+
+    Messages whose seq is missing (bulk imports, rows older than the column)
+    or out of place are renumbered, so that seqs run 1, 2, 3... in id order
+    within each conversation and last_seq continues from the last one.
+    Returns the number of conversations.
+    """
+    partitions = await list_partitions(db)
+    archived_up_to = partitions[-1].max_id if partitions else 0
+    summaries: Dict[Tuple[int, int], dict] = {}
+    async for table, chunk in stream_message_tables(db, chunk_size=chunk_size):
+        renumbered = []
+        for row in chunk:
+            msg_id, sender_id, recipient_id = row["id"], row["sender_id"], row["recipient_id"]
+            summary = summaries.get(conversation_key(sender_id, recipient_id))
+            seq = (summary["last_seq"] if summary else 0) + 1
+            if row["seq"] != seq:
+                renumbered.append({"b_id": msg_id, "b_seq": seq})
+            unread = msg_id > max(archived_up_to, read_ids.get((recipient_id, sender_id), 0))
+            _accumulate(
+                summaries, msg_id, sender_id, recipient_id,
+                row["content"], row["timestamp"], seq, unread,
+            )
+        if renumbered:
+            await db.execute(
+                update(table).where(table.c.id == bindparam("b_id")).values(seq=bindparam("b_seq")),
+                renumbered,
+            )
+
+    await db.execute(delete(Conversation))
+    rows = list(summaries.values())
+    for start in range(0, len(rows), chunk_size):
+        await db.execute(insert(Conversation), rows[start:start + chunk_size])
+    await db.commit()
+    return len(rows)
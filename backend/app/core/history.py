@@ -0,0 +1,223 @@
+# backend/app/core/history.py
+
+"""
+Conversation history reads across the hot table and archive partitions.
+
+Pages are read from chat_messages first; only when it cannot fill a page
+(the cursor is older than the hot horizon, or the conversation's recent
+part is short) does the read continue into the archive partitions whose id
+range the page can reach, newest first (or oldest first when paging
+forward). Callers see one id-ordered stream of ChatMessage objects either
+way.
+
+Every function takes a session on the conversation's shard, except
+find_message, which looks a message id up on every shard.
+"""
+
+from typing import AsyncIterator, List, Optional, Tuple
+
+from sqlalchemy import RowMapping, Table, and_, or_, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import HISTORY_EXPORT_CHUNK, HISTORY_PAGE_SIZE
+from app.core.retention import list_partitions, partition_table
+from app.db.shards import on_every_shard
+from app.models.message import ChatMessage
+
+HOT_TABLE: Table = ChatMessage.__table__
+
+
+def conversation_filter(user_id: int, other_user_id: int, table: Table = HOT_TABLE):
+    """
+    SQL condition matching every message exchanged between two users.
+    """
+    return or_(
+        and_(table.c.sender_id == user_id, table.c.recipient_id == other_user_id),
+        and_(table.c.sender_id == other_user_id, table.c.recipient_id == user_id),
+    )
+
+
+def conversation_page(
+    user_id: int,
+    other_user_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+    table: Table = HOT_TABLE,
+):
+    """
+    Build a keyset-paginated query for one page of a conversation in
+    `table` (chat_messages or an archive partition).
+
+    Each direction of the conversation is read separately as an index range
+    scan on the conversation index (bounded by `limit`), and only the two
+    small legs are merged, so the cost of a page does not depend on how
+    long the conversation is.
+    """
+    descending = after_id is None
+    order = table.c.id.desc() if descending else table.c.id
+    legs = []
+    for sender_id, recipient_id in ((user_id, other_user_id), (other_user_id, user_id)):
+        leg = select(table.c.id).filter(
+            table.c.sender_id == sender_id,
+            table.c.recipient_id == recipient_id,
+        )
+        if before_id is not None:
+            leg = leg.filter(table.c.id < before_id)
+        if after_id is not None:
+            leg = leg.filter(table.c.id > after_id)
+        leg = leg.order_by(order).limit(limit)
+        legs.append(select(leg.subquery().c.id))
+
+    ids = union_all(*legs).subquery()
+    return (
+        select(table)
+        .filter(table.c.id.in_(select(ids.c.id)))
+        .order_by(order)
+        .limit(limit)
+    )
+
+
+def _to_message(row) -> ChatMessage:
+    return ChatMessage(**row)
+
+
+async def _read_page(db: AsyncSession, table: Table, *args, **kwargs) -> List[ChatMessage]:
+    result = await db.execute(conversation_page(*args, table=table, **kwargs))
+    return [_to_message(row) for row in result.mappings()]
+
+
+async def conversation_history(
+    db: AsyncSession,
+    user_id: int,
+    other_user_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> List[ChatMessage]:
+    """
+    One page of the conversation, ordered by id ascending (see
+    conversation_page for the cursors), spanning hot and archived messages.
+    """
+    if after_id is None:
+        # Newest first: hot table, then partitions from the newest
+        messages = await _read_page(db, HOT_TABLE, user_id, other_user_id, before_id=before_id, limit=limit)
+        if len(messages) < limit:
+            for partition in reversed(await list_partitions(db)):
+                cursor = messages[-1].id if messages else before_id
+                if cursor is not None and partition.min_id >= cursor:
+                    continue
+                messages += await _read_page(
+                    db, partition_table(partition.name), user_id, other_user_id,
+                    before_id=cursor, limit=limit - len(messages),
+                )
+                if len(messages) >= limit:
+                    break
+        messages.reverse()
+        return messages
+
+    # Oldest first: partitions past the cursor, then the hot table
+    messages = []
+    for partition in await list_partitions(db):
+        cursor = messages[-1].id if messages else after_id
+        if partition.max_id <= cursor:
+            continue
+        messages += await _read_page(
+            db, partition_table(partition.name), user_id, other_user_id,
+            after_id=cursor, limit=limit - len(messages),
+        )
+        if len(messages) >= limit:
+            return messages
+    cursor = messages[-1].id if messages else after_id
+    messages += await _read_page(
+        db, HOT_TABLE, user_id, other_user_id, after_id=cursor, limit=limit - len(messages)
+    )
+    return messages
+
+
+async def stream_conversation(
+    db: AsyncSession,
+    user_id: int,
+    other_user_id: int,
+    chunk_size: int = HISTORY_EXPORT_CHUNK,
+) -> AsyncIterator[List[ChatMessage]]:
+    """
+    Yield the whole conversation, oldest first, in chunks read through
+    server-side cursors: each archive partition in turn, then the hot table.
+    """
+    tables = [partition_table(partition.name) for partition in await list_partitions(db)]
+    for table in tables + [HOT_TABLE]:
+        result = await db.stream(
+            select(table)
+            .filter(conversation_filter(user_id, other_user_id, table))
+            .order_by(table.c.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        async for chunk in result.mappings().partitions():
+            yield [_to_message(row) for row in chunk]
+
+
+async def stream_message_tables(
+    db: AsyncSession,
+    since_id: int = 0,
+    chunk_size: int = HISTORY_EXPORT_CHUNK,
+) -> AsyncIterator[Tuple[Table, List[RowMapping]]]:
+    """
+    Yield every message of the shard past since_id, oldest first, as chunks
+    of row mappings read through server-side cursors, each with the table
+    it was read from: the archive partitions that reach past since_id, then
+    the hot table.
+    """
+    tables = [
+        partition_table(partition.name)
+        for partition in await list_partitions(db)
+        if partition.max_id > since_id
+    ]
+    for table in tables + [HOT_TABLE]:
+        result = await db.stream(
+            select(table)
+            .filter(table.c.id > since_id)
+            .order_by(table.c.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        async for chunk in result.mappings().partitions():
+            yield table, chunk
+
+
+async def stream_messages(
+    db: AsyncSession,
+    since_id: int = 0,
+    chunk_size: int = HISTORY_EXPORT_CHUNK,
+) -> AsyncIterator[List[RowMapping]]:
+    """
+    stream_message_tables without the tables.
+    """
+    async for _, chunk in stream_message_tables(db, since_id, chunk_size):
+        yield chunk
+
+
+async def get_message(db: AsyncSession, message_id: int) -> Optional[ChatMessage]:
+    """
+    Look a message up by id in the hot table, then in the partition whose
+    id range holds it.
+    """
+    msg = await db.get(ChatMessage, message_id)
+    if msg is not None:
+        return msg
+    for partition in await list_partitions(db):
+        if partition.min_id <= message_id <= partition.max_id:
+            table = partition_table(partition.name)
+            result = await db.execute(select(table).filter(table.c.id == message_id))
+            row = result.mappings().first()
+            if row is not None:
+                return _to_message(row)
+    return None
+
+
+async def find_message(message_id: int, user_id: Optional[int] = None) -> Optional[ChatMessage]:
+    """
+    get_message on every shard (reads routed for user_id).
+    """
+    found = await on_every_shard(lambda db: get_message(db, message_id), user_id=user_id)
+    return next((msg for msg in found if msg is not None), None)
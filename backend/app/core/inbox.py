@@ -0,0 +1,197 @@
+# backend/app/core/inbox.py
+
+"""
+Offline inbox: delivery/read watermarks and reconnect catch-up.
+
+A reconnecting client sends one sync frame and receives every message
+addressed to it past its delivery watermarks, across all conversations.
+Clients then ack what they stored (advancing the delivery watermarks) and
+report per-peer read positions; both kinds of watermark only move forward.
+
+Delivery watermarks are kept per conversation (user, peer), as the highest
+message id from the peer that the user acknowledged. Ids are allocated
+before commit, so across conversations a lower id can become visible after
+a higher one (concurrent batches, several workers or shards); within one
+conversation they cannot, the summary row being locked from id allocation
+to commit (see reserve_sequences). A catch-up reads, for each conversation
+with activity past its watermark, an index range scan on
+ix_chat_messages_conversation; up to SYNC_SCANS_PER_QUERY of them are
+merged in one statement.
+
+Watermarks live on the primary database; messages and summaries live on
+their conversation's shard, so the inbox scan runs on every shard and the
+pages are merged by id (message ids are unique across shards).
+"""
+
+import heapq
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+
+from app.db.shards import on_every_shard
+from app.db.upsert import execute_upsert, greatest
+from app.models.conversation import Conversation
+from app.models.message import ChatMessage
+from app.models.receipt import DeliveryCursor, ReadCursor
+
+# Conversation range scans merged into one catch-up statement
+SYNC_SCANS_PER_QUERY = 50
+
+
+async def get_delivered_ids(db: AsyncSession, user_id: int) -> Dict[int, int]:
+    """
+    Return the user's delivery watermarks as peer id -> message id (peers
+    without one have had nothing acknowledged yet).
+    """
+    result = await db.execute(
+        select(DeliveryCursor.peer_id, DeliveryCursor.delivered_id)
+        .filter(DeliveryCursor.user_id == user_id)
+    )
+    return dict(result.all())
+
+
+async def _pending_peers(
+    db: AsyncSession, user_id: int, delivered: Dict[int, int]
+) -> List[Tuple[int, int]]:
+    """
+    (peer id, watermark) of the user's conversations on this shard whose
+    last message is past the watermark.
+    """
+    result = await db.execute(union_all(
+        select(Conversation.user_high_id, Conversation.last_message_id)
+        .filter(Conversation.user_low_id == user_id),
+        select(Conversation.user_low_id, Conversation.last_message_id)
+        .filter(Conversation.user_high_id == user_id),
+    ))
+    pending = {}
+    for peer_id, last_message_id in result:
+        since = delivered.get(peer_id, 0)
+        if last_message_id > since:
+            pending[peer_id] = since
+    return sorted(pending.items())
+
+
+async def fetch_undelivered(
+    db: AsyncSession, user_id: int, delivered: Dict[int, int], limit: int
+) -> Tuple[List[ChatMessage], bool]:
+    """
+    Return up to `limit` messages addressed to user_id past the watermark of
+    their sender (`delivered`, see get_delivered_ids), oldest first, and
+    whether more remain. The page holds a prefix of each conversation's
+    undelivered messages.
+    """
+    peers = await _pending_peers(db, user_id, delivered)
+    messages: List[ChatMessage] = []
+    for start in range(0, len(peers), SYNC_SCANS_PER_QUERY):
+        legs = [
+            select(
+                select(ChatMessage)
+                .filter(
+                    ChatMessage.sender_id == peer_id,
+                    ChatMessage.recipient_id == user_id,
+                    ChatMessage.id > since,
+                )
+                .order_by(ChatMessage.id)
+                .limit(limit + 1)
+                .subquery()
+            )
+            for peer_id, since in peers[start:start + SYNC_SCANS_PER_QUERY]
+        ]
+        merged = aliased(ChatMessage, union_all(*legs).subquery())
+        result = await db.execute(select(merged).order_by(merged.id).limit(limit + 1))
+        messages = list(heapq.merge(messages, result.scalars(), key=lambda m: m.id))
+        if len(messages) > limit:
+            return messages[:limit], True
+    return messages, False
+
+
+async def fetch_inbox(
+    user_id: int, delivered: Dict[int, int], limit: int
+) -> Tuple[List[ChatMessage], bool]:
+    """
+    fetch_undelivered across every shard: the first `limit` messages
+    addressed to user_id past their sender's watermark, oldest first, and
+    whether more remain.
+    """
+    pages = await on_every_shard(
+        lambda db: fetch_undelivered(db, user_id, delivered, limit), read_only=False
+    )
+    messages: List[ChatMessage] = []
+    seen: Set[int] = set()
+    # A conversation being moved is briefly on two shards
+    for msg in heapq.merge(*(page for page, _ in pages), key=lambda m: m.id):
+        if msg.id not in seen:
+            seen.add(msg.id)
+            messages.append(msg)
+    more = len(messages) > limit or any(more for _, more in pages)
+    return messages[:limit], more
+
+
+async def advance_delivered(db: AsyncSession, user_id: int, up_to: Dict[int, int]) -> Dict[int, int]:
+    """
+    Move the delivery watermarks forward to `up_to` (peer id -> message id)
+    and commit. Returns the watermarks that moved, as peer id -> new value.
+    """
+    current = await get_delivered_ids(db, user_id)
+    moved = {
+        peer_id: delivered_id
+        for peer_id, delivered_id in sorted(up_to.items())
+        if delivered_id > current.get(peer_id, 0)
+    }
+    if not moved:
+        return moved
+
+    table = DeliveryCursor.__table__
+    await execute_upsert(
+        db,
+        table,
+        [
+            {"user_id": user_id, "peer_id": peer_id, "delivered_id": delivered_id}
+            for peer_id, delivered_id in moved.items()
+        ],
+        ["user_id", "peer_id"],
+        lambda excluded: {"delivered_id": greatest(table.c.delivered_id, excluded.delivered_id)},
+    )
+    await db.commit()
+    return moved
+
+
+async def mark_read(db: AsyncSession, user_id: int, peer_id: int, up_to: int) -> int:
+    """
+    Move user_id's read watermark for messages from peer_id forward and
+    commit. Returns the watermark, which may already have been past up_to.
+    """
+    table = ReadCursor.__table__
+    rows = await execute_upsert(
+        db,
+        table,
+        {"user_id": user_id, "peer_id": peer_id, "read_id": up_to},
+        ["user_id", "peer_id"],
+        lambda excluded: {"read_id": greatest(table.c.read_id, excluded.read_id)},
+        returning=(table.c.read_id,),
+    )
+    read_id = rows[0][0]
+    await db.commit()
+    return read_id
+
+
+async def get_receipts(db: AsyncSession, user_id: int, peer_id: int) -> Dict[str, Optional[int]]:
+    """
+    Watermarks describing how far peer_id has received and read user_id's messages.
+    """
+    delivered = await db.execute(
+        select(DeliveryCursor.delivered_id).filter(
+            DeliveryCursor.user_id == peer_id,
+            DeliveryCursor.peer_id == user_id,
+        )
+    )
+    result = await db.execute(
+        select(ReadCursor.read_id).filter(
+            ReadCursor.user_id == peer_id,
+            ReadCursor.peer_id == user_id,
+        )
+    )
+    return {"delivered_up_to": delivered.scalar() or 0, "read_up_to": result.scalar() or 0}
@@ -0,0 +1,108 @@
+# backend/app/core/message_bodies.py
+
+"""
+Size limits and offloaded storage for large message bodies.
+
+Messages whose content exceeds MESSAGE_INLINE_MAX_BYTES are persisted with
+a preview in chat_messages.content and the full text split into
+MESSAGE_BODY_CHUNK_CHARS chunks in chat_message_bodies, written in the same
+transaction as the message. Clients see body_length on such messages and
+fetch the full text separately, streamed chunk by chunk.
+"""
+
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import (
+    MESSAGE_BODY_CHUNK_CHARS,
+    MESSAGE_INLINE_MAX_BYTES,
+    MESSAGE_MAX_CONTENT_BYTES,
+)
+from app.models.message_body import ArchivedBodyChunk, MessageBodyChunk
+
+
+class ContentTooLarge(ValueError):
+    """
+    Raised when message content exceeds MESSAGE_MAX_CONTENT_BYTES.
+    """
+
+
+def utf8_length(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+def offload(values: Dict, max_bytes: int = MESSAGE_MAX_CONTENT_BYTES) -> Tuple[Dict, Optional[str]]:
+    """
+    Split message column values into what is stored inline and the body to
+    offload (None when the content fits inline).
+    Raises ContentTooLarge above max_bytes.
+    """
+    content = values["content"]
+    size = utf8_length(content)
+    if size > max_bytes:
+        raise ContentTooLarge(f"Message content is {size} bytes; the limit is {max_bytes}")
+    if size <= MESSAGE_INLINE_MAX_BYTES:
+        # Every row of a batched insert must carry the same keys
+        return {**values, "body_length": None}, None
+    # A character is at most 4 bytes, so the preview always fits inline
+    preview = content[:MESSAGE_INLINE_MAX_BYTES // 4]
+    return {**values, "content": preview, "body_length": len(content)}, content
+
+
+async def store_bodies(db: AsyncSession, bodies: List[Tuple[int, str]]):
+    """
+    Insert the chunks of offloaded bodies, given as (message id, full text).
+    Does not commit; runs inside the transaction inserting the messages.
+    """
+    rows = [
+        {"message_id": message_id, "seq": seq, "data": body[start:start + MESSAGE_BODY_CHUNK_CHARS]}
+        for message_id, body in bodies
+        for seq, start in enumerate(range(0, len(body), MESSAGE_BODY_CHUNK_CHARS))
+    ]
+    if rows:
+        await db.execute(insert(MessageBodyChunk), rows)
+
+
+async def stream_body(db: AsyncSession, message_id: int) -> AsyncIterator[str]:
+    """
+    Yield the chunks of an offloaded body in order, from the hot table or,
+    for archived messages, from chat_message_bodies_archive.
+    """
+    for model in (MessageBodyChunk, ArchivedBodyChunk):
+        result = await db.stream_scalars(
+            select(model.data)
+            .filter(model.message_id == message_id)
+            .order_by(model.seq)
+            .execution_options(yield_per=1)
+        )
+        found = False
+        async for chunk in result:
+            found = True
+            yield chunk
+        if found:
+            return
+
+
+async def load_bodies(db: AsyncSession, message_ids: List[int]) -> Dict[int, str]:
+    """
+    The full text of several offloaded bodies, hot or archived, as
+    message id -> text.
+    """
+    bodies: Dict[int, str] = {}
+    for model in (MessageBodyChunk, ArchivedBodyChunk):
+        missing = [message_id for message_id in message_ids if message_id not in bodies]
+        if not missing:
+            break
+        parts: Dict[int, List[str]] = {}
+        result = await db.execute(
+            select(model.message_id, model.data)
+            .filter(model.message_id.in_(missing))
+            .order_by(model.message_id, model.seq)
+        )
+        for message_id, data in result:
+            parts.setdefault(message_id, []).append(data)
+        bodies.update((message_id, "".join(chunks)) for message_id, chunks in parts.items())
+    return bodies
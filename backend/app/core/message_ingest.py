@@ -0,0 +1,324 @@
+# backend/app/core/message_ingest.py
+
+"""
+Write-behind persistence pipeline for chat messages.
+
+WebSocket handlers submit messages to a shared MessageIngest. A single
+flusher task collects submissions from all connections and persists them
+with one multi-row INSERT ... RETURNING per batch, in one transaction.
+A batch is flushed when it reaches INGEST_BATCH_SIZE rows or when its
+oldest message has waited INGEST_MAX_WAIT_MS, whichever comes first.
+Each submitter gets back the stored row (id and server timestamp) so the
+sender and recipient receive the same acknowledgement. Hooks run inside the
+batch transaction with the stored messages, so derived tables (e.g. the
+conversation summaries) commit atomically with the messages, as do the
+chunks of offloaded large bodies (see app.core.message_bodies).
+
+Each message is given its per-conversation sequence number in the batch
+transaction (see reserve_sequences). A batch spanning several message
+shards is split into one transaction per shard (see app.db.shards), and
+the part of a batch routed with a stale slot map is routed again. A batch
+that fails otherwise is split in halves and retried, down to single
+messages, so one bad submission does not fail the others. Sends
+carrying a client_msg_id are idempotent: a retry of a message still in
+flight waits for the original, and a retry of a stored one (found in a
+small in-process cache, or in chat_messages when the cache misses) raises
+DuplicateMessage with the original instead of inserting a second row.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+
+from app.core.config import (
+    INGEST_BATCH_SIZE,
+    INGEST_MAX_WAIT_MS,
+    INGEST_QUEUE_SIZE,
+    MESSAGE_DEDUPE_CACHE_SIZE,
+)
+from app.core.conversations import reserve_sequences
+from app.core.message_bodies import offload, store_bodies
+from app.core.metrics import INGEST_BATCH_ROWS, INGEST_FLUSH_SECONDS, MESSAGE_PERSIST_SECONDS
+from app.db.session import shard_session
+from app.db.shards import (
+    SlotMoved,
+    allocate_message_ids,
+    check_slots,
+    shard_count,
+    shard_map,
+    slot_of,
+)
+from app.models.message import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# One queued submission: the column values, the offloaded body (if any) and
+# the future resolved on flush
+_Submission = Tuple[Dict[str, Any], Optional[str], asyncio.Future]
+
+# Times a batch is routed again after its slots moved to another shard
+MAX_ROUTING_ATTEMPTS = 3
+
+# Called as hook(session, messages) before the batch is committed
+IngestHook = Callable[[Any, List[ChatMessage]], Awaitable[None]]
+
+# (sender_id, client_msg_id)
+_ClientKey = Tuple[int, str]
+
+
+class DuplicateMessage(Exception):
+    """
+    Raised by MessageIngest.submit when the sender already used the
+    client_msg_id; `message` is the message stored the first time.
+    """
+
+    def __init__(self, message: ChatMessage):
+        super().__init__(f"Message {message.client_msg_id!r} was already sent")
+        self.message = message
+
+
+def _client_key(values: Dict[str, Any]) -> Optional[_ClientKey]:
+    client_msg_id = values.get("client_msg_id")
+    return None if client_msg_id is None else (values["sender_id"], client_msg_id)
+
+
+class MessageIngest:
+    """
+    Batches ChatMessage inserts across all connections.
+    """
+
+    def __init__(
+        self,
+        session_factory=shard_session,
+        batch_size: int = INGEST_BATCH_SIZE,
+        max_wait_ms: float = INGEST_MAX_WAIT_MS,
+        max_pending: int = INGEST_QUEUE_SIZE,
+        hooks: Sequence[IngestHook] = (),
+        dedupe_cache_size: int = MESSAGE_DEDUPE_CACHE_SIZE,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_pending = max_pending
+        self.hooks = list(hooks)
+        self.dedupe_cache_size = dedupe_cache_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._flusher: Optional[asyncio.Task] = None
+        # Recently stored messages with a client_msg_id, least recent first
+        self._recent: "OrderedDict[_ClientKey, ChatMessage]" = OrderedDict()
+        # Submissions with a client_msg_id waiting for their batch
+        self._in_flight: Dict[_ClientKey, asyncio.Future] = {}
+
+    async def start(self):
+        """
+        Start the background flusher.
+        """
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Flush everything already submitted, then stop the flusher.
+        """
+        if self._flusher is None:
+            return
+        await self._queue.join()
+        self._flusher.cancel()
+        await asyncio.gather(self._flusher, return_exceptions=True)
+        self._flusher = None
+
+    async def submit(self, **values: Any) -> ChatMessage:
+        """
+        Queue a message for persistence and wait until its batch is committed.
+        Returns a transient ChatMessage carrying the stored id, timestamp
+        and seq. Waits for room in the queue when the pipeline is saturated.
+        Raises ContentTooLarge if the content exceeds the size limit, and
+        DuplicateMessage if the sender already used values["client_msg_id"].
+        """
+        if self._flusher is None:
+            raise RuntimeError("MessageIngest is not started")
+        values.setdefault("client_msg_id", None)
+        key = _client_key(values)
+        if key is not None:
+            stored = self._recent.get(key)
+            if stored is not None:
+                self._recent.move_to_end(key)
+                raise DuplicateMessage(stored)
+            pending = self._in_flight.get(key)
+            if pending is not None:
+                raise DuplicateMessage(await asyncio.shield(pending))
+
+        values, body = offload(values)
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._in_flight[key] = future
+        try:
+            await self._queue.put((values, body, future))
+            msg = await future
+        finally:
+            if key is not None and self._in_flight.get(key) is future:
+                del self._in_flight[key]
+        MESSAGE_PERSIST_SECONDS.observe(time.perf_counter() - start)
+        return msg
+
+    def _remember(self, msg: ChatMessage):
+        self._recent[(msg.sender_id, msg.client_msg_id)] = msg
+        self._recent.move_to_end((msg.sender_id, msg.client_msg_id))
+        while len(self._recent) > self.dedupe_cache_size:
+            self._recent.popitem(last=False)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[_Submission] = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _fail(self, batch: List[_Submission], error: Exception):
+        logger.error(f"Failed to persist batch of {len(batch)} messages: {error}")
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _drop_duplicates(self, session, batch: List[_Submission]) -> List[_Submission]:
+        """
+        Resolve submissions whose client_msg_id is already stored (sent
+        through another worker, or evicted from the cache) with
+        DuplicateMessage, and return the others.
+        """
+        keys = {_client_key(values) for values, _, _ in batch} - {None}
+        if not keys:
+            return batch
+        table = ChatMessage.__table__
+        result = await session.execute(select(table).filter(
+            table.c.sender_id.in_({sender_id for sender_id, _ in keys}),
+            table.c.client_msg_id.in_({client_msg_id for _, client_msg_id in keys}),
+        ))
+        stored = {
+            (row["sender_id"], row["client_msg_id"]): ChatMessage(**row)
+            for row in result.mappings()
+        }
+        remaining = []
+        for submission in batch:
+            msg = stored.get(_client_key(submission[0]))
+            if msg is None:
+                remaining.append(submission)
+            else:
+                self._remember(msg)
+                submission[2].set_exception(DuplicateMessage(msg))
+        return remaining
+
+    async def _persist(
+        self, shard: int, batch: List[_Submission]
+    ) -> List[Tuple[asyncio.Future, ChatMessage]]:
+        async with self.session_factory(shard) as session:
+            pairs = [(values["sender_id"], values["recipient_id"]) for values, _, _ in batch]
+            await check_slots(session, {slot_of(*pair) for pair in pairs})
+            batch = await self._drop_duplicates(session, batch)
+            if not batch:
+                return []
+            rows = [values for values, _, _ in batch]
+            seqs = await reserve_sequences(
+                session, [(values["sender_id"], values["recipient_id"]) for values in rows]
+            )
+            for values, seq in zip(rows, seqs):
+                values["seq"] = seq
+            if shard_count() > 1:
+                # Allocated while the conversation rows are locked, so ids
+                # follow seq order within each conversation
+                first_id = await allocate_message_ids(len(rows), session if shard == 0 else None)
+                for offset, values in enumerate(rows):
+                    values["id"] = first_id + offset
+            stmt = insert(ChatMessage).returning(ChatMessage.id, ChatMessage.timestamp)
+            result = await session.execute(stmt, rows)
+            # Ids are allocated in VALUES order, but RETURNING order is
+            # not guaranteed (and SQLite has no sentinel support for
+            # sort_by_parameter_order), so match rows back by id.
+            stored = sorted(result.all(), key=lambda row: row.id)
+            messages = [
+                ChatMessage(**{**values, "id": msg_id, "timestamp": timestamp})
+                for (values, _, _), (msg_id, timestamp) in zip(batch, stored)
+            ]
+            await store_bodies(session, [
+                (msg.id, body)
+                for msg, (_, body, _) in zip(messages, batch)
+                if body is not None
+            ])
+            for hook in self.hooks:
+                await hook(session, messages)
+            await session.commit()
+        return [(future, msg) for (_, _, future), msg in zip(batch, messages)]
+
+    async def _flush(self, batch: List[_Submission], attempts: int = MAX_ROUTING_ATTEMPTS):
+        by_shard: Dict[int, List[_Submission]] = {}
+        try:
+            for submission in batch:
+                values = submission[0]
+                shard = await shard_map.shard_of(values["sender_id"], values["recipient_id"])
+                by_shard.setdefault(shard, []).append(submission)
+        except Exception as e:
+            # The slot map could not be loaded
+            self._fail(batch, e)
+            return
+        await asyncio.gather(*(
+            self._flush_shard(shard, submissions, attempts)
+            for shard, submissions in by_shard.items()
+        ))
+
+    async def _flush_shard(self, shard: int, batch: List[_Submission], attempts: int):
+        start = time.perf_counter()
+        try:
+            try:
+                persisted = await self._persist(shard, batch)
+            except IntegrityError:
+                # A client_msg_id of the batch was committed concurrently by
+                # another worker: retry once, dropping it as a duplicate.
+                persisted = await self._persist(shard, [s for s in batch if not s[2].done()])
+            INGEST_FLUSH_SECONDS.observe(time.perf_counter() - start)
+            INGEST_BATCH_ROWS.observe(len(persisted))
+        except SlotMoved as e:
+            if attempts > 1:
+                logger.info(f"Routing {len(batch)} messages again: {e}")
+                await shard_map.refresh(force=True)
+                await self._flush([s for s in batch if not s[2].done()], attempts - 1)
+                return
+            self._fail(batch, e)
+            return
+        except Exception as e:
+            pending = [s for s in batch if not s[2].done()]
+            if len(pending) > 1:
+                # Persist each half on its own, so that a bad row (e.g. one
+                # violating a constraint) fails only its own submitter
+                logger.warning(f"Splitting batch of {len(pending)} messages after: {e}")
+                half = len(pending) // 2
+                await self._flush_shard(shard, pending[:half], attempts)
+                await self._flush_shard(shard, pending[half:], attempts)
+                return
+            self._fail(pending, e)
+            return
+
+        for future, msg in persisted:
+            if msg.client_msg_id is not None:
+                self._remember(msg)
+            if not future.done():
+                future.set_result(msg)
@@ -0,0 +1,359 @@
+# backend/app/core/message_search.py
+
+"""
+Full-text search over the messages of the caller's conversations.
+
+Queries are split into words; a message matches when it contains every
+word, the last one as a prefix (so results follow the user's typing).
+Results are ranked by relevance, then newest first, and continued with an
+opaque cursor encoding (score, id).
+
+Backends, chosen by dialect:
+- PostgreSQL: a GIN index on to_tsvector('simple', content), ranked with
+  ts_rank. The index is maintained by the database on every insert, so the
+  ingest pipeline needs no extra work.
+- SQLite with FTS5: an external-content FTS5 table over chat_messages kept
+  in sync by insert/delete triggers, ranked with bm25.
+- Anything else: MessageSearchIndex, an in-process inverted index filled
+  incrementally from chat_messages (rows with a greater id than the last
+  refresh, so messages persisted by other workers are picked up too).
+
+Only the hot table is indexed: messages moved to archive partitions (see
+app.core.retention) are no longer searchable, and offloaded bodies are
+searchable by their stored preview.
+
+A search with a peer runs on that conversation's shard; otherwise every
+shard is searched for a full page and the pages are merged by key.
+"""
+
+import asyncio
+import base64
+import heapq
+import json
+import logging
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import Float, and_, cast, column, func, literal_column, or_, table, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.db.session import shard_session
+from app.db.shards import shard_count, shard_map
+from app.models.message import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# (score, message_id); higher scores rank first
+SearchKey = Tuple[float, int]
+
+MAX_QUERY_TERMS = 8
+_WORD = re.compile(r"\w+")
+
+POSTGRES_MESSAGE_SEARCH_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS ix_chat_messages_fts "
+    "ON chat_messages USING gin (to_tsvector('simple', content))",
+)
+
+SQLITE_FTS_TABLE = "chat_messages_fts"
+SQLITE_MESSAGE_SEARCH_SCHEMA = (
+    f"CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5("
+    "content, content='chat_messages', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_insert AFTER INSERT ON chat_messages BEGIN "
+    f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_delete AFTER DELETE ON chat_messages BEGIN "
+    f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, content) "
+    "VALUES ('delete', old.id, old.content); END",
+    # Index the rows that existed before the FTS table
+    f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')",
+)
+
+# Set by create_message_search_index: whether SQLite was built with FTS5
+_sqlite_fts = False
+
+
+def encode_cursor(key: SearchKey) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> SearchKey:
+    """
+    Decode a cursor produced by encode_cursor. Raises ValueError if malformed.
+    """
+    try:
+        score, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), int(message_id)
+    except Exception:
+        raise ValueError("Invalid search cursor")
+
+
+def query_terms(q: str) -> List[str]:
+    return _WORD.findall(q.lower())[:MAX_QUERY_TERMS]
+
+
+def _fold(value: str) -> str:
+    # Lowercase and strip diacritics, like FTS5's unicode61 tokenizer
+    decomposed = unicodedata.normalize("NFKD", value.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def create_message_search_index(sync_conn):
+    """
+    Create the database-native message index where supported (run_sync target).
+    """
+    global _sqlite_fts
+    dialect = sync_conn.dialect.name
+    if dialect == "postgresql":
+        for statement in POSTGRES_MESSAGE_SEARCH_INDEXES:
+            sync_conn.execute(text(statement))
+    elif dialect == "sqlite":
+        exists = sync_conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": SQLITE_FTS_TABLE},
+        ).first()
+        if exists:
+            _sqlite_fts = True
+            return
+        try:
+            for statement in SQLITE_MESSAGE_SEARCH_SCHEMA:
+                sync_conn.execute(text(statement))
+            _sqlite_fts = True
+        except OperationalError as e:
+            logger.warning(f"SQLite FTS5 unavailable, using the in-process message index: {e}")
+
+
+class MessageSearchIndex:
+    """
+    In-process inverted index over chat messages, for databases without
+    native full-text search.
+    """
+
+    def __init__(self):
+        # message id -> (sender_id, recipient_id)
+        self._docs: Dict[int, Tuple[int, int]] = {}
+        # term -> {message id: occurrences}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._terms: List[str] = []
+        self._max_id = 0
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, message_id: int, sender_id: int, recipient_id: int, content: str):
+        if message_id in self._docs:
+            return
+        self._docs[message_id] = (sender_id, recipient_id)
+        for term in _WORD.findall(_fold(content)):
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                insort(self._terms, term)
+            postings[message_id] = postings.get(message_id, 0) + 1
+        self._max_id = max(self._max_id, message_id)
+
+    async def refresh(self, db: AsyncSession, chunk_size: int = 5000):
+        """
+        Index messages persisted since the last refresh.
+        """
+        async with self._lock:
+            while True:
+                result = await db.execute(
+                    select(
+                        ChatMessage.id,
+                        ChatMessage.sender_id,
+                        ChatMessage.recipient_id,
+                        ChatMessage.content,
+                    )
+                    .filter(ChatMessage.id > self._max_id)
+                    .order_by(ChatMessage.id)
+                    .limit(chunk_size)
+                )
+                rows = result.all()
+                for row in rows:
+                    self.add(*row)
+                if len(rows) < chunk_size:
+                    return
+
+    def _prefix_postings(self, prefix: str) -> Dict[int, int]:
+        merged: Dict[int, int] = {}
+        for i in range(bisect_left(self._terms, prefix), len(self._terms)):
+            term = self._terms[i]
+            if not term.startswith(prefix):
+                break
+            for message_id, count in self._postings[term].items():
+                merged[message_id] = merged.get(message_id, 0) + count
+        return merged
+
+    def search(
+        self,
+        user_id: int,
+        terms: List[str],
+        limit: int,
+        peer_id: Optional[int] = None,
+        after: Optional[SearchKey] = None,
+    ) -> List[SearchKey]:
+        """
+        Return up to `limit` (score, id) keys of user_id's messages containing
+        every term (the last as a prefix), strictly after `after`. The score
+        is the number of term occurrences.
+        """
+        terms = [_fold(term) for term in terms]
+        postings = [self._postings.get(term, {}) for term in terms[:-1]]
+        postings.append(self._prefix_postings(terms[-1]))
+        postings.sort(key=len)
+        candidates: Set[int] = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting.keys()
+
+        keys = []
+        for message_id in candidates:
+            sender_id, recipient_id = self._docs[message_id]
+            if user_id not in (sender_id, recipient_id):
+                continue
+            if peer_id is not None and peer_id not in (sender_id, recipient_id):
+                continue
+            key = (float(sum(posting[message_id] for posting in postings)), message_id)
+            if after is None or (-key[0], -key[1]) > (-after[0], -after[1]):
+                keys.append(key)
+        keys.sort(key=lambda k: (-k[0], -k[1]))
+        return keys[:limit]
+
+
+# One in-process index per shard
+message_indexes: Dict[int, MessageSearchIndex] = {}
+
+
+def _participant_filter(table, user_id: int, peer_id: Optional[int]):
+    if peer_id is None:
+        return or_(table.c.sender_id == user_id, table.c.recipient_id == user_id)
+    return or_(
+        and_(table.c.sender_id == user_id, table.c.recipient_id == peer_id),
+        and_(table.c.sender_id == peer_id, table.c.recipient_id == user_id),
+    )
+
+
+def _paged(stmt, score, message_id, after: Optional[SearchKey], limit: int):
+    if after is not None:
+        after_score, after_id = after
+        stmt = stmt.filter(or_(
+            score < after_score,
+            and_(score == after_score, message_id < after_id),
+        ))
+    return stmt.order_by(score.desc(), message_id.desc()).limit(limit)
+
+
+async def _search_postgres(
+    db: AsyncSession, user_id: int, terms: List[str], limit: int,
+    peer_id: Optional[int], after: Optional[SearchKey],
+) -> List[Tuple[SearchKey, dict]]:
+    messages = ChatMessage.__table__
+    config = literal_column("'simple'")
+    # Same expression as ix_chat_messages_fts, so the planner can use it
+    vector = func.to_tsvector(config, messages.c.content)
+    tsquery = func.to_tsquery(config, " & ".join(terms[:-1] + [f"{terms[-1]}:*"]))
+    score = cast(func.ts_rank(vector, tsquery), Float)
+    stmt = select(messages, score.label("score")).filter(
+        vector.op("@@")(tsquery),
+        _participant_filter(messages, user_id, peer_id),
+    )
+    result = await db.execute(_paged(stmt, score, messages.c.id, after, limit))
+    return [((row["score"], row["id"]), row) for row in result.mappings()]
+
+
+async def _search_sqlite_fts(
+    db: AsyncSession, user_id: int, terms: List[str], limit: int,
+    peer_id: Optional[int], after: Optional[SearchKey],
+) -> List[Tuple[SearchKey, dict]]:
+    messages = ChatMessage.__table__
+    fts = table(SQLITE_FTS_TABLE, column("rowid"))
+    match = " ".join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+    # bm25 is lower for better matches
+    score = literal_column(f"(-bm25({SQLITE_FTS_TABLE}))")
+    stmt = (
+        select(messages, score.label("score"))
+        .select_from(fts.join(messages, messages.c.id == fts.c.rowid))
+        .filter(
+            literal_column(SQLITE_FTS_TABLE).op("MATCH")(match),
+            _participant_filter(messages, user_id, peer_id),
+        )
+    )
+    result = await db.execute(_paged(stmt, score, messages.c.id, after, limit))
+    return [((row["score"], row["id"]), row) for row in result.mappings()]
+
+
+async def _search_index(
+    db: AsyncSession, user_id: int, terms: List[str], limit: int,
+    peer_id: Optional[int], after: Optional[SearchKey], shard: int,
+) -> List[Tuple[SearchKey, dict]]:
+    message_index = message_indexes.setdefault(shard, MessageSearchIndex())
+    await message_index.refresh(db)
+    keys = message_index.search(user_id, terms, limit, peer_id, after)
+    messages = ChatMessage.__table__
+    result = await db.execute(select(messages).filter(messages.c.id.in_([key[1] for key in keys])))
+    rows = {row["id"]: row for row in result.mappings()}
+    # Messages archived since they were indexed are skipped
+    return [(key, rows[key[1]]) for key in keys if key[1] in rows]
+
+
+async def search_shard(
+    db: AsyncSession,
+    shard: int,
+    user_id: int,
+    terms: List[str],
+    limit: int,
+    peer_id: Optional[int] = None,
+    after: Optional[SearchKey] = None,
+) -> List[Tuple[SearchKey, ChatMessage]]:
+    """
+    One ranked page of matches on one shard, with their keys.
+    """
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        rows = await _search_postgres(db, user_id, terms, limit, peer_id, after)
+    elif dialect == "sqlite" and _sqlite_fts:
+        rows = await _search_sqlite_fts(db, user_id, terms, limit, peer_id, after)
+    else:
+        rows = await _search_index(db, user_id, terms, limit, peer_id, after, shard)
+    columns = ChatMessage.__table__.columns.keys()
+    return [(key, ChatMessage(**{name: row[name] for name in columns})) for key, row in rows]
+
+
+async def search_messages(
+    user_id: int,
+    q: str,
+    limit: int,
+    peer_id: Optional[int] = None,
+    after: Optional[SearchKey] = None,
+) -> Tuple[List[ChatMessage], Optional[SearchKey]]:
+    """
+    Return one ranked page of user_id's messages (optionally only those
+    exchanged with peer_id) matching `q`, and the key to continue from
+    (None when there are no more results).
+    """
+    terms = query_terms(q)
+    if not terms:
+        return [], None
+    if peer_id is not None:
+        shard = await shard_map.shard_of(user_id, peer_id)
+        async with shard_session(shard, read_only=True, user_id=user_id) as db:
+            results = await search_shard(db, shard, user_id, terms, limit, peer_id, after)
+    else:
+        async def search(shard: int) -> List[Tuple[SearchKey, ChatMessage]]:
+            async with shard_session(shard, read_only=True, user_id=user_id) as db:
+                return await search_shard(db, shard, user_id, terms, limit, None, after)
+
+        pages = await asyncio.gather(*(search(shard) for shard in range(shard_count())))
+        results, seen = [], set()
+        # A conversation being moved is briefly on two shards
+        for key, msg in heapq.merge(*pages, key=lambda result: (-result[0][0], -result[0][1])):
+            if msg.id not in seen:
+                seen.add(msg.id)
+                results.append((key, msg))
+        results = results[:limit]
+    next_key = results[-1][0] if len(results) == limit else None
+    return [msg for _, msg in results], next_key
@@ -0,0 +1,269 @@
+# backend/app/core/metrics.py
+
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+
+Counters and histograms are plain Python objects updated inline on the hot
+paths (a dict lookup and a few additions per observation, and no locks:
+all updates happen on the event loop thread). Gauges are callbacks evaluated only when /metrics is scraped,
+so state that is already tracked elsewhere (connections, send queues, the
+DB pool, caches, rate limiters) costs nothing between scrapes.
+
+Metrics are per worker; Prometheus aggregates across workers.
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond fan-out to slow commits
+DEFAULT_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum]
+        self._series: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self) -> Iterable[str]:
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            plain = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{plain} {_format_value(total)}"
+            yield f"{self.name}_count{plain} {cumulative}"
+
+
+class CallbackMetric(Metric):
+    """
+    Gauge or counter whose samples are read from a callback at scrape time.
+    The callback returns {label values: value}; use () for an unlabelled metric.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        callback: Callable[[], Dict[LabelValues, float]],
+        labelnames: Sequence[str] = (),
+        kind: str = "gauge",
+    ):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self.callback().items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge_callback(
+        self,
+        name: str,
+        help: str,
+        callback: Callable[[], Dict[LabelValues, float]],
+        labelnames: Sequence[str] = (),
+        kind: str = "gauge",
+    ) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, callback, labelnames, kind))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+# Hot-path metrics, updated by the modules that own the code paths
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "nextext_http_request_duration_seconds",
+    "HTTP request latency by route template, method and status",
+    ("route", "method", "status"),
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "nextext_db_query_duration_seconds",
+    "Database statement execution time by statement kind",
+    ("kind",),
+)
+DB_READS = REGISTRY.counter(
+    "nextext_db_reads_total",
+    "Read sessions with replicas configured, by route: replica, sticky "
+    "(primary after the user's own write) or fallback (no replica reachable, "
+    "or a statement failed on it)",
+    ("route",),
+)
+FANOUT_SECONDS = REGISTRY.histogram(
+    "nextext_fanout_duration_seconds",
+    "Time to publish a frame and queue it on the target sockets",
+    ("kind",),
+)
+WS_SEND_SECONDS = REGISTRY.histogram(
+    "nextext_ws_send_duration_seconds",
+    "Time to write one frame (or batch frame) to a WebSocket",
+)
+WS_FRAMES_DROPPED = REGISTRY.counter(
+    "nextext_ws_frames_dropped_total",
+    "Outbound frames refused by full send queues, by backpressure policy",
+    ("policy",),
+)
+WS_REAPED = REGISTRY.counter(
+    "nextext_ws_reaped_total",
+    "WebSocket connections closed by the heartbeat sweep after WS_IDLE_TIMEOUT of silence",
+)
+INGEST_FLUSH_SECONDS = REGISTRY.histogram(
+    "nextext_ingest_flush_duration_seconds",
+    "Time to insert and commit one batch of chat messages",
+)
+INGEST_BATCH_ROWS = REGISTRY.histogram(
+    "nextext_ingest_batch_size",
+    "Messages per committed ingest batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024),
+)
+MESSAGE_PERSIST_SECONDS = REGISTRY.histogram(
+    "nextext_message_persist_duration_seconds",
+    "Time from submitting a WebSocket message to its batch being committed",
+)
+PASSWORD_HASH_SECONDS = REGISTRY.histogram(
+    "nextext_password_hash_duration_seconds",
+    "bcrypt hash/verify time including pool queueing, by operation",
+    ("operation",),
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording HTTP latency per route template (not raw
+    path, which keeps label cardinality bounded). WebSocket traffic passes
+    through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                getattr(route, "path", "unmatched"),
+                scope["method"],
+                str(status_code),
+            )
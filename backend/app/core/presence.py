@@ -0,0 +1,170 @@
+# backend/app/core/presence.py
+
+"""
+Ephemeral presence and typing events over the chat WebSocket.
+
+Presence (online / away / offline) is pushed to a user's online contacts
+(the peers they have a conversation with) when their first session
+connects, when they change status and when their last session closes; a
+connecting user gets a snapshot of their contacts' presence. Presence is
+only ever looked up for a user's contacts, through the broker, which also
+shares statuses between workers. Typing indicators go to the one peer being
+typed to, if that peer is a contact.
+
+Events never touch the database: contacts are loaded once when a user's
+first session on this worker connects and then kept up to date from sent
+messages. They stay cached for PRESENCE_CONTACTS_CACHE_SECONDS after the
+last session closes, so a reconnect does not query every shard again (a
+conversation started on another worker meanwhile shows up once the entry
+expires). Bursts are collapsed on the server: a typing "start" is forwarded
+at most once per TYPING_MIN_INTERVAL_MS per peer (clients expire it after
+TYPING_TTL_MS unless refreshed), unchanged statuses are not re-sent, and
+every event carries a coalesce key, so a queued event is replaced by a newer
+one and is dropped rather than displacing messages when a send queue is
+full.
+"""
+
+import asyncio
+from typing import Dict, Optional, Set, Tuple
+
+from app.core.auth_cache import TTLCache
+from app.core.config import (
+    PRESENCE_CONTACTS_CACHE_SECONDS,
+    PRESENCE_CONTACTS_CACHE_SIZE,
+    TYPING_MIN_INTERVAL_MS,
+    TYPING_TTL_MS,
+)
+from app.core.connection_manager import ConnectionManager
+from app.core.conversations import load_contacts
+
+ONLINE = "online"
+AWAY = "away"
+OFFLINE = "offline"
+
+# Statuses a client may set for itself
+CLIENT_STATUSES = (ONLINE, AWAY)
+
+
+class PresenceHub:
+    """
+    Presence and typing state for the users connected to this worker.
+    """
+
+    def __init__(
+        self,
+        manager: ConnectionManager,
+        typing_interval_ms: float = TYPING_MIN_INTERVAL_MS,
+        typing_ttl_ms: int = TYPING_TTL_MS,
+    ):
+        self.manager = manager
+        self.typing_interval = typing_interval_ms / 1000
+        self.typing_ttl_ms = typing_ttl_ms
+        self.contacts: Dict[int, Set[int]] = {}
+        self.status: Dict[int, str] = {}
+        # Contacts of users who disconnected recently
+        self._recent_contacts: TTLCache[Set[int]] = TTLCache(
+            PRESENCE_CONTACTS_CACHE_SIZE, PRESENCE_CONTACTS_CACHE_SECONDS
+        )
+        # (user_id, peer_id) -> loop time the last "start" was forwarded
+        self._typing: Dict[Tuple[int, int], float] = {}
+
+    async def connected(self, user_id: int) -> dict:
+        """
+        Called after a session of user_id connected: announce the user to
+        their contacts if this is their first session here. Returns the
+        snapshot of the contacts' presence to send to the new session.
+        """
+        if user_id not in self.contacts:
+            # Registered before loading so concurrent sessions load once
+            contacts = self.contacts[user_id] = set()
+            cached = self._recent_contacts.get(user_id)
+            contacts.update(cached if cached is not None else await load_contacts(user_id))
+            self.status[user_id] = ONLINE
+            await self.manager.set_status(user_id, None)
+            await self._announce(user_id, ONLINE)
+
+        online = await self.manager.get_presence(self.contacts.get(user_id, ()))
+        return {
+            "type": "presence_snapshot",
+            "users": [
+                {"user_id": peer_id, "status": online[peer_id] or ONLINE}
+                for peer_id in sorted(online)
+            ],
+        }
+
+    async def disconnected(self, user_id: int):
+        """
+        Called after a session of user_id closed: once no session is left on
+        any worker, tell the contacts the user went offline and forget them.
+        """
+        if user_id in self.manager.active_connections or user_id not in self.contacts:
+            return
+        for key in [key for key in self._typing if key[0] == user_id]:
+            del self._typing[key]
+        self.status.pop(user_id, None)
+        if user_id not in await self.manager.get_presence([user_id]):
+            await self.manager.set_status(user_id, None)
+            await self._announce(user_id, OFFLINE)
+        # Contacts may have been dropped by a concurrent reconnect
+        if user_id not in self.manager.active_connections:
+            contacts = self.contacts.pop(user_id, None)
+            if contacts is not None:
+                self._recent_contacts.set(user_id, contacts)
+
+    async def set_status(self, user_id: int, status: str):
+        """
+        Change a user's own status (online or away); unchanged statuses are ignored.
+        """
+        if status not in CLIENT_STATUSES:
+            raise ValueError(f"Unknown presence status: {status!r}")
+        if user_id not in self.contacts or self.status.get(user_id) == status:
+            return
+        self.status[user_id] = status
+        await self.manager.set_status(user_id, None if status == ONLINE else status)
+        await self._announce(user_id, status)
+
+    async def typing(self, user_id: int, peer_id: int, active: bool):
+        """
+        Forward a typing start/stop from user_id to peer_id, debounced;
+        ignored unless peer_id is a contact.
+        """
+        if peer_id not in self.contacts.get(user_id, ()):
+            return
+        key = (user_id, peer_id)
+        now = asyncio.get_running_loop().time()
+        if active:
+            last = self._typing.get(key)
+            if last is not None and now - last < self.typing_interval:
+                return
+            self._typing[key] = now
+        elif self._typing.pop(key, None) is None:
+            return
+        await self.manager.send_personal_message(
+            {"type": "typing", "user_id": user_id, "active": active, "ttl_ms": self.typing_ttl_ms},
+            peer_id,
+            coalesce_key=f"typing:{user_id}",
+        )
+
+    def message_sent(self, sender_id: int, recipient_id: int):
+        """
+        Called for every delivered message: a message ends the sender's
+        typing indicator and makes the two users contacts.
+        """
+        self._typing.pop((sender_id, recipient_id), None)
+        if sender_id == recipient_id:
+            return
+        for user_id, peer_id in ((sender_id, recipient_id), (recipient_id, sender_id)):
+            contacts: Optional[Set[int]] = self.contacts.get(user_id)
+            if contacts is None:
+                contacts = self._recent_contacts.get(user_id)
+            if contacts is not None:
+                contacts.add(peer_id)
+
+    async def _announce(self, user_id: int, status: str):
+        event = {"type": "presence", "user_id": user_id, "status": status}
+        key = f"presence:{user_id}"
+        online = await self.manager.get_presence(self.contacts.get(user_id, ()))
+        await asyncio.gather(*(
+            self.manager.send_personal_message(event, peer_id, coalesce_key=key)
+            for peer_id in online
+        ))
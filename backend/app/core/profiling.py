@@ -0,0 +1,261 @@
+# backend/app/core/profiling.py
+
+"""
+Opt-in request and query profiling.
+
+- Slow-query log (SLOW_QUERY_MS > 0): statements slower than the threshold
+  are logged, sampled at SLOW_QUERY_SAMPLE_RATE, with bound parameter
+  values redacted (only their names or count are logged).
+- Query profiles (PROFILING_ENABLED): statement count and time are
+  recorded per HTTP request and per WebSocket frame. HTTP responses carry
+  them in a Server-Timing header, and a statement repeated at least
+  PROFILE_N_PLUS_ONE_THRESHOLD times within one unit logs an N+1 warning.
+- Captures (PROFILING_ENABLED and PROFILE_TOKEN set): a request sent with
+  "X-Profile: <PROFILE_TOKEN>" runs under pyinstrument (if installed) or
+  cProfile and is answered with the profile report instead of its normal
+  response. One capture runs at a time; cProfile sees every task on the
+  event loop while it runs, so captures are for quiet instances.
+
+The database hooks are installed by app.db.session and cost one context
+variable lookup per statement when profiling is off.
+"""
+
+import cProfile
+import hmac
+import io
+import json
+import logging
+import pstats
+import random
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, List, Optional, Tuple
+
+from app.core.config import (
+    PROFILE_N_PLUS_ONE_THRESHOLD,
+    PROFILE_TOKEN,
+    PROFILING_ENABLED,
+    SLOW_QUERY_MS,
+    SLOW_QUERY_SAMPLE_RATE,
+)
+
+try:
+    from pyinstrument import Profiler as _Pyinstrument
+except ImportError:  # optional dependency
+    _Pyinstrument = None
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("app.db.slow_query")
+
+PROFILE_HEADER = b"x-profile"
+
+# Runs of placeholders, e.g. expanded IN lists, collapse to one so that
+# statements differing only in list length count as the same statement
+_PLACEHOLDER_RUN = re.compile(r"(\?|\$\d+|%s|%\(\w+\)s|:\w+)(\s*,\s*(\?|\$\d+|%s|%\(\w+\)s|:\w+))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str) -> str:
+    return _PLACEHOLDER_RUN.sub(r"\1, ...", _WHITESPACE.sub(" ", statement.strip()))
+
+
+def redact_parameters(parameters: Any) -> Any:
+    """
+    Describe bound parameters without their values: names for mappings,
+    a count for sequences, and the row count for executemany.
+    """
+    if isinstance(parameters, dict):
+        return {name: "?" for name in parameters}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return {"rows": len(parameters), "params": redact_parameters(parameters[0])}
+        return f"{len(parameters)} values"
+    return None
+
+
+class QueryProfile:
+    """
+    Statements executed within one request or WebSocket frame.
+    """
+
+    __slots__ = ("label", "count", "seconds", "statements")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[normalize_statement(statement)] += 1
+
+    def repeated(self, threshold: int = PROFILE_N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int]]:
+        """
+        Statements executed at least `threshold` times, most frequent first.
+        """
+        return [(sql, n) for sql, n in self.statements.most_common() if n >= threshold]
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.seconds * 1000:.2f};desc="{self.count} queries"'
+
+
+_current_profile: ContextVar[Optional[QueryProfile]] = ContextVar("query_profile", default=None)
+
+
+def record_query(statement: str, parameters: Any, seconds: float):
+    """
+    Called by the engine after every statement.
+    """
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.record(statement, seconds)
+    if (
+        SLOW_QUERY_MS > 0
+        and seconds * 1000 >= SLOW_QUERY_MS
+        and random.random() < SLOW_QUERY_SAMPLE_RATE
+    ):
+        slow_query_logger.warning(json.dumps({
+            "event": "slow_query",
+            "duration_ms": round(seconds * 1000, 2),
+            "statement": normalize_statement(statement),
+            "parameters": redact_parameters(parameters),
+            "unit": profile.label if profile is not None else None,
+        }))
+
+
+@contextmanager
+def profile_queries(label: str) -> Iterator[Optional[QueryProfile]]:
+    """
+    Record the statements run in this block (and tasks it awaits directly)
+    into a QueryProfile and report likely N+1 patterns on exit. Yields None
+    when profiling is disabled.
+    """
+    if not PROFILING_ENABLED:
+        yield None
+        return
+    profile = QueryProfile(label)
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+        for statement, count in profile.repeated():
+            logger.warning(json.dumps({
+                "event": "n_plus_one",
+                "unit": profile.label,
+                "executions": count,
+                "statement": statement,
+            }))
+        logger.debug(json.dumps({
+            "event": "query_profile",
+            "unit": profile.label,
+            "queries": profile.count,
+            "db_ms": round(profile.seconds * 1000, 2),
+        }))
+
+
+class _Capture:
+    """
+    One cProfile or pyinstrument run rendered as text.
+    """
+
+    running = False
+
+    def __init__(self):
+        self.profiler = _Pyinstrument(async_mode="enabled") if _Pyinstrument else cProfile.Profile()
+
+    def __enter__(self):
+        _Capture.running = True
+        if _Pyinstrument:
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if _Pyinstrument:
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+        _Capture.running = False
+
+    def report(self) -> str:
+        if _Pyinstrument:
+            return self.profiler.output_text(unicode=True)
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(60)
+        return out.getvalue()
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware opening a QueryProfile per HTTP request (reported in a
+    Server-Timing header) and running token-authorized profile captures.
+    A no-op pass-through unless PROFILING_ENABLED.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not PROFILING_ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if PROFILE_TOKEN and not _Capture.running and _wants_capture(scope):
+            await self._capture(scope, receive, send)
+            return
+
+        with profile_queries(f"{scope['method']} {scope['path']}") as profile:
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    route = scope.get("route")
+                    if route is not None:
+                        profile.label = f"{scope['method']} {route.path}"
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", profile.server_timing().encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+    async def _capture(self, scope, receive, send):
+        status_code = 500
+
+        async def discard(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+        start = time.perf_counter()
+        with profile_queries(f"{scope['method']} {scope['path']}") as profile, _Capture() as capture:
+            await self.app(scope, receive, discard)
+        header = (
+            f"{scope['method']} {scope['path']} -> {status_code} "
+            f"in {(time.perf_counter() - start) * 1000:.1f} ms, "
+            f"{profile.count} queries ({profile.seconds * 1000:.1f} ms)\n\n"
+        )
+        body = (header + capture.report()).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+                (b"x-profiled-status", str(status_code).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def _wants_capture(scope) -> bool:
+    for name, value in scope.get("headers", ()):
+        if name == PROFILE_HEADER:
+            return hmac.compare_digest(value, PROFILE_TOKEN.encode())
+    return False
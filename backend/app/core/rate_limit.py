@@ -0,0 +1,239 @@
+# backend/app/core/rate_limit.py
+
+"""
+Token-bucket rate limiting.
+
+Each policy ("login", "ws_messages", ...) is a rate written "N/S": buckets
+hold up to N tokens (the burst) and refill at N per S seconds. A bucket is
+kept per policy and key (user id, client IP or connection), so one client
+running out of tokens never slows down anyone else.
+
+Buckets live in process by default. With RATE_LIMIT_BACKEND=redis, user and
+IP buckets are shared by all workers through an atomic Redis script; if
+Redis is unreachable the worker falls back to its local bucket. Per-
+connection buckets are always local.
+
+HTTP endpoints use the rate_limit() dependency (429 with Retry-After); the
+WebSocket endpoint calls RateLimiter.hit directly.
+"""
+
+import logging
+import math
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+from app.core.config import (
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_MAX_BUCKETS,
+    RATE_LIMIT_POLICIES,
+)
+from app.core.metrics import REGISTRY
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1]: bucket hash; ARGV: refill rate (tokens/s), capacity, cost.
+# Returns {allowed (0/1), seconds to wait as a string}.
+_REDIS_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+
+class RateLimited(Exception):
+    """
+    Raised when a policy's bucket for a key is empty.
+    """
+
+    def __init__(self, policy: str, retry_after: float):
+        super().__init__(f"Rate limit {policy!r} exceeded; retry in {retry_after:.2f}s")
+        self.policy = policy
+        self.retry_after = retry_after
+
+
+def parse_rate(spec: str) -> Tuple[float, float]:
+    """
+    Parse "N/S" into (refill rate in tokens per second, capacity N).
+    """
+    count, _, seconds = spec.partition("/")
+    capacity = float(count)
+    period = float(seconds or 1)
+    if capacity <= 0 or period <= 0:
+        raise ValueError(f"Invalid rate limit {spec!r}")
+    return capacity / period, capacity
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1) -> float:
+        """
+        Take `cost` tokens. Returns 0 if allowed, else the seconds until
+        enough tokens will be available (nothing is taken then).
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Named token-bucket policies with in-process buckets and an optional
+    shared Redis tier.
+    """
+
+    def __init__(
+        self,
+        policies: Dict[str, str] = RATE_LIMIT_POLICIES,
+        backend: str = RATE_LIMIT_BACKEND,
+        max_buckets: int = RATE_LIMIT_MAX_BUCKETS,
+        client: Any = None,
+    ):
+        if backend not in ("memory", "redis"):
+            raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend!r}")
+        self.policies = {name: parse_rate(spec) for name, spec in policies.items()}
+        self.backend = backend
+        self.max_buckets = max_buckets
+        self._client = client
+        self._buckets: "OrderedDict[Tuple[str, Hashable], TokenBucket]" = OrderedDict()
+        self.allowed: Counter = Counter()
+        self.limited: Counter = Counter()
+        self.redis_errors = 0
+
+    async def hit(self, policy: str, key: Hashable, shared: bool = True, cost: float = 1):
+        """
+        Spend `cost` tokens of `policy` for `key`. Raises RateLimited when
+        the bucket is empty. `shared` buckets use the Redis tier if enabled.
+        """
+        rate, capacity = self.policies[policy]
+        wait = None
+        if shared and self.backend == "redis":
+            wait = await self._take_shared(policy, key, rate, capacity, cost)
+        if wait is None:
+            wait = self._take_local(policy, key, rate, capacity, cost)
+        if wait > 0:
+            self.limited[policy] += 1
+            raise RateLimited(policy, wait)
+        self.allowed[policy] += 1
+
+    def forget(self, policy: str, key: Hashable):
+        """
+        Drop a local bucket whose key will not be used again (e.g. a closed connection).
+        """
+        self._buckets.pop((policy, key), None)
+
+    def _take_local(self, policy: str, key: Hashable, rate: float, capacity: float, cost: float) -> float:
+        bucket_key = (policy, key)
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = self._buckets[bucket_key] = TokenBucket(rate, capacity)
+            # Evicting the least recently used bucket only forgives its debt
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(bucket_key)
+        return bucket.take(cost)
+
+    async def _take_shared(
+        self, policy: str, key: Hashable, rate: float, capacity: float, cost: float
+    ) -> Optional[float]:
+        try:
+            client = self._client or get_redis()
+            allowed, wait = await client.eval(
+                _REDIS_BUCKET_SCRIPT, 1, f"nextext:ratelimit:{policy}:{key}", rate, capacity, cost
+            )
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f"Rate limiter Redis call failed, using local bucket: {e}")
+            return None
+        return 0.0 if int(allowed) else float(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Allowed/limited counters per policy and the number of local buckets.
+        """
+        return {
+            "backend": self.backend,
+            "local_buckets": len(self._buckets),
+            "redis_errors": self.redis_errors,
+            "policies": {
+                name: {
+                    "rate_per_sec": rate,
+                    "burst": capacity,
+                    "allowed": self.allowed[name],
+                    "limited": self.limited[name],
+                }
+                for name, (rate, capacity) in self.policies.items()
+            },
+        }
+
+
+limiter = RateLimiter()
+
+REGISTRY.gauge_callback(
+    "nextext_rate_limit_decisions_total",
+    "Rate limiter decisions by policy and outcome",
+    lambda: {
+        **{(name, "allowed"): count for name, count in limiter.allowed.items()},
+        **{(name, "limited"): count for name, count in limiter.limited.items()},
+    },
+    ("policy", "outcome"),
+    kind="counter",
+)
+
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+def too_many_requests(e: RateLimited) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests, please retry later",
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+    )
+
+
+def rate_limit(policy: str):
+    """
+    FastAPI dependency applying `policy` per client IP; answers 429 with
+    Retry-After when exceeded.
+    """
+    async def dependency(request: Request):
+        try:
+            await limiter.hit(policy, client_ip(request))
+        except RateLimited as e:
+            raise too_many_requests(e)
+
+    return dependency
@@ -0,0 +1,58 @@
+# backend/app/core/redis.py
+
+"""
+Shared asyncio Redis client.
+
+The client is created lazily from REDIS_URL and reused by every subsystem
+that needs a shared tier (pub/sub broker, caches, rate limits).
+The client comes from `redis.asyncio` (redis-py >= 4.2, where aioredis was
+merged upstream).
+"""
+
+import logging
+from typing import Any, Optional
+
+from app.core.config import REDIS_URL
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # pragma: no cover - depends on installed packages
+    redis_asyncio = None
+
+_client: Optional[Any] = None
+
+
+def redis_available() -> bool:
+    """
+    Return True if an asyncio Redis client library can be imported.
+    """
+    return redis_asyncio is not None
+
+
+def get_redis() -> Any:
+    """
+    Return the process-wide Redis client, creating it on first use.
+    Raises RuntimeError if no Redis client library is installed.
+    """
+    global _client
+    if _client is None:
+        if redis_asyncio is None:
+            raise RuntimeError(
+                "A Redis backend is configured but 'redis.asyncio' cannot be "
+                "imported (pip install 'redis>=4.2')"
+            )
+        _client = redis_asyncio.from_url(REDIS_URL, decode_responses=True)
+        logger.info(f"Redis client created for {REDIS_URL}")
+    return _client
+
+
+async def close_redis() -> None:
+    """
+    Close the shared Redis client if it was created.
+    """
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
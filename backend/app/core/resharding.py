@@ -0,0 +1,345 @@
+# backend/app/core/resharding.py
+
+"""
+Moving conversation slots between message shards (see app.db.shards).
+
+A move copies every conversation of the slots from the source shard to the
+target while writes continue, then switches ownership in a short fenced
+step:
+
+1. Bulk copy: each conversation's archived and hot messages, with their
+   offloaded bodies, are streamed into the same tables on the target.
+2. Switch: in one source transaction, the slots are removed from the
+   source's owned_slots. That delete waits for in-flight writes holding
+   the slots (check_slots) and makes later ones fail with SlotMoved, so no
+   message can land on the source after it. The messages written since
+   the bulk copy and the conversation summaries (with their seq counters)
+   are then copied, the target takes the slots, the primary's slot map is
+   updated, and the source drops its summaries and commits.
+3. Cleanup: once every worker has reloaded the map (twice
+   SHARD_MAP_REFRESH_SECONDS), the source deletes its copies of the
+   messages. Until then readers still routing with the old map see the
+   messages up to the switch; sync, search and conversation lists, which
+   read every shard, skip the duplicates.
+
+Run moves from one process at a time, with `python -m app.cli move-slots`
+or `python -m app.cli rebalance`. The in-process search index (used only
+without PostgreSQL or FTS5) picks up moved messages on its next restart.
+"""
+
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import Table, delete, insert, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import SHARD_MAP_REFRESH_SECONDS
+from app.core.history import HOT_TABLE, conversation_filter
+from app.core.message_search import create_message_search_index
+from app.core.retention import add_to_partition, list_partitions, partition_table
+from app.db.session import session_scope, shard_engines, shard_session
+from app.db.shards import (
+    SHARD_SLOTS,
+    create_shard_schema,
+    init_shards,
+    shard_count,
+    shard_map,
+    slot_of,
+)
+from app.models.conversation import Conversation
+from app.models.message_body import ArchivedBodyChunk, MessageBodyChunk
+from app.models.partition import MessagePartition
+from app.models.shard import OwnedSlot, ShardSlot
+
+logger = logging.getLogger(__name__)
+
+MOVE_CHUNK_SIZE = 1000
+
+Pair = Tuple[int, int]
+
+
+async def setup_shards():
+    """
+    Create the schema and message search index on the secondary shards,
+    then seed the slot map (see init_shards). The primary's schema must
+    already exist.
+    """
+    for shard_engine in shard_engines[1:]:
+        async with shard_engine.begin() as conn:
+            await conn.run_sync(create_shard_schema)
+            await conn.run_sync(create_message_search_index)
+    await init_shards()
+
+
+async def load_slot_map() -> List[int]:
+    """
+    The current slot -> shard map, read from the primary.
+    """
+    async with session_scope() as db:
+        result = await db.execute(select(ShardSlot.slot, ShardSlot.shard))
+        slots = [0] * SHARD_SLOTS
+        for slot, shard in result:
+            slots[slot] = shard
+    return slots
+
+
+async def _slot_pairs(db: AsyncSession, slots: Set[int]) -> List[Pair]:
+    """
+    The conversations of `slots` on a shard, from its summaries.
+    """
+    result = await db.stream(
+        select(Conversation.user_low_id, Conversation.user_high_id)
+        .execution_options(yield_per=MOVE_CHUNK_SIZE)
+    )
+    return [(low, high) async for low, high in result if slot_of(low, high) in slots]
+
+
+def _body_model(table: Table):
+    return MessageBodyChunk if table is HOT_TABLE else ArchivedBodyChunk
+
+
+async def _message_tables(db: AsyncSession) -> List[Table]:
+    """
+    A shard's archive partitions, oldest first, then the hot table.
+    """
+    return [partition_table(p.name) for p in await list_partitions(db)] + [HOT_TABLE]
+
+
+async def _copy_rows(source: AsyncSession, target: AsyncSession, table: Table, rows: List[Dict]):
+    """
+    Insert message rows read from `table` on the source into the same
+    table on the target, with their offloaded bodies. Does not commit.
+    """
+    if table is HOT_TABLE:
+        await target.execute(insert(table), rows)
+    else:
+        await add_to_partition(target, table.name, rows)
+
+    offloaded = [row["id"] for row in rows if row["body_length"] is not None]
+    if offloaded:
+        model = _body_model(table)
+        chunks = await source.execute(
+            select(model.__table__).filter(model.message_id.in_(offloaded))
+        )
+        chunk_rows = [dict(chunk) for chunk in chunks.mappings()]
+        if chunk_rows:
+            await target.execute(insert(model), chunk_rows)
+
+
+async def _copy_conversation(source: AsyncSession, target: AsyncSession, pair: Pair) -> int:
+    """
+    Copy every message of a conversation, archived and hot, and commit on
+    the target. Returns the number of messages.
+    """
+    copied = 0
+    for table in await _message_tables(source):
+        result = await source.stream(
+            select(table)
+            .filter(conversation_filter(*pair, table))
+            .order_by(table.c.id)
+            .execution_options(yield_per=MOVE_CHUNK_SIZE)
+        )
+        async for chunk in result.mappings().partitions():
+            await _copy_rows(source, target, table, [dict(row) for row in chunk])
+            await target.commit()
+            copied += len(chunk)
+    return copied
+
+
+async def _copy_missing(source: AsyncSession, target: AsyncSession, pair: Pair) -> int:
+    """
+    Copy the hot messages of a conversation that are not on the target yet
+    (written since the bulk copy). Does not commit.
+    """
+    source_ids = set((await source.execute(
+        select(HOT_TABLE.c.id).filter(conversation_filter(*pair))
+    )).scalars())
+    if not source_ids:
+        return 0
+    # The target may have archived part of the bulk copy meanwhile
+    for table in await _message_tables(target):
+        source_ids -= set((await target.execute(
+            select(table.c.id).filter(
+                conversation_filter(*pair, table), table.c.id >= min(source_ids)
+            )
+        )).scalars())
+        if not source_ids:
+            return 0
+    result = await source.execute(
+        select(HOT_TABLE).filter(HOT_TABLE.c.id.in_(source_ids)).order_by(HOT_TABLE.c.id)
+    )
+    await _copy_rows(source, target, HOT_TABLE, [dict(row) for row in result.mappings()])
+    return len(source_ids)
+
+
+async def _copy_summaries(source: AsyncSession, target: AsyncSession, pairs: List[Pair]):
+    """
+    Replace the target's summaries of `pairs` with the source's. Does not commit.
+    """
+    table = Conversation.__table__
+    for start in range(0, len(pairs), MOVE_CHUNK_SIZE):
+        chunk = pairs[start:start + MOVE_CHUNK_SIZE]
+        condition = or_(*(
+            (table.c.user_low_id == low) & (table.c.user_high_id == high) for low, high in chunk
+        ))
+        await target.execute(delete(table).where(condition))
+        result = await source.execute(select(table).filter(condition))
+        rows = [dict(row) for row in result.mappings()]
+        if rows:
+            await target.execute(insert(table), rows)
+
+
+async def _delete_summaries(db: AsyncSession, pairs: List[Pair]):
+    table = Conversation.__table__
+    for start in range(0, len(pairs), MOVE_CHUNK_SIZE):
+        await db.execute(delete(table).where(or_(*(
+            (table.c.user_low_id == low) & (table.c.user_high_id == high)
+            for low, high in pairs[start:start + MOVE_CHUNK_SIZE]
+        ))))
+
+
+async def _delete_conversation(db: AsyncSession, pair: Pair) -> int:
+    """
+    Delete a moved conversation's messages and bodies from a shard and
+    commit. Returns the number of messages.
+    """
+    deleted = 0
+    for table in await _message_tables(db):
+        ids = (await db.execute(
+            select(table.c.id, table.c.body_length).filter(conversation_filter(*pair, table))
+        )).all()
+        if not ids:
+            continue
+        offloaded = [message_id for message_id, body_length in ids if body_length is not None]
+        model = _body_model(table)
+        for start in range(0, len(offloaded), MOVE_CHUNK_SIZE):
+            await db.execute(delete(model.__table__).where(
+                model.message_id.in_(offloaded[start:start + MOVE_CHUNK_SIZE])
+            ))
+        await db.execute(delete(table).where(conversation_filter(*pair, table)))
+        if table is not HOT_TABLE:
+            # The id range stays as is; it only has to cover the partition
+            await db.execute(
+                update(MessagePartition)
+                .where(MessagePartition.name == table.name)
+                .values(row_count=MessagePartition.row_count - len(ids))
+            )
+        await db.commit()
+        deleted += len(ids)
+    return deleted
+
+
+async def _assign(db: AsyncSession, slots: Set[int], shard: int):
+    await db.execute(update(ShardSlot).where(ShardSlot.slot.in_(slots)).values(shard=shard))
+
+
+async def _move(source: int, target: int, slots: Set[int], grace_seconds: float) -> int:
+    """
+    Move `slots` from source to target (phases in the module docstring).
+    Returns the number of messages moved.
+    """
+    async with shard_session(source) as source_db, shard_session(target) as target_db:
+        pairs = await _slot_pairs(source_db, slots)
+        await source_db.rollback()
+        copied = 0
+        for pair in pairs:
+            # Leftovers of an interrupted move
+            await _delete_conversation(target_db, pair)
+            copied += await _copy_conversation(source_db, target_db, pair)
+            await source_db.rollback()
+        logger.info(f"Slots {sorted(slots)}: copied {copied} messages to shard {target}")
+
+        # Switch, fenced by the delete of the source's owned slots
+        await source_db.execute(delete(OwnedSlot).where(OwnedSlot.slot.in_(slots)))
+        # Conversations started during the bulk copy
+        pairs = sorted(set(pairs) | set(await _slot_pairs(source_db, slots)))
+        for pair in pairs:
+            copied += await _copy_missing(source_db, target_db, pair)
+        await _copy_summaries(source_db, target_db, pairs)
+        await target_db.execute(insert(OwnedSlot), [{"slot": slot} for slot in sorted(slots)])
+        await target_db.commit()
+        await _delete_summaries(source_db, pairs)
+        try:
+            if source == 0:
+                # The slot map is on the source: switch it in the fenced transaction
+                await _assign(source_db, slots, target)
+                await source_db.commit()
+            else:
+                async with session_scope() as db:
+                    await _assign(db, slots, target)
+                    await db.commit()
+        except Exception:
+            # The source keeps the slots; withdraw the target's claim
+            await target_db.execute(delete(OwnedSlot).where(OwnedSlot.slot.in_(slots)))
+            await target_db.commit()
+            raise
+        await source_db.commit()
+        logger.info(f"Slots {sorted(slots)}: switched from shard {source} to shard {target}")
+
+    # Readers with the old map still read the source meanwhile
+    await asyncio.sleep(grace_seconds)
+    async with shard_session(source) as db:
+        for pair in pairs:
+            await _delete_conversation(db, pair)
+    return copied
+
+
+async def move_slots(
+    slots: Set[int], target: int, grace_seconds: Optional[float] = None
+) -> int:
+    """
+    Move `slots` (from whichever shards hold them) to shard `target`.
+    Returns the number of messages moved.
+    Raises ValueError for unknown slots or shards.
+    """
+    if not 0 <= target < shard_count():
+        raise ValueError(f"No shard {target}; there are {shard_count()}")
+    invalid = [slot for slot in slots if not 0 <= slot < SHARD_SLOTS]
+    if invalid:
+        raise ValueError(f"Slots must be in 0..{SHARD_SLOTS - 1}: {invalid}")
+    if grace_seconds is None:
+        grace_seconds = 2 * SHARD_MAP_REFRESH_SECONDS
+
+    by_source: Dict[int, Set[int]] = {}
+    current = await load_slot_map()
+    for slot in slots:
+        if current[slot] != target:
+            by_source.setdefault(current[slot], set()).add(slot)
+    moved = 0
+    for source, source_slots in sorted(by_source.items()):
+        moved += await _move(source, target, source_slots, grace_seconds)
+    await shard_map.refresh(force=True)
+    return moved
+
+
+def plan_rebalance(slots: List[int], count: int) -> Dict[int, Set[int]]:
+    """
+    Slot moves (target shard -> slots) that even out the number of slots
+    per shard, moving as few as possible.
+    """
+    owned: Dict[int, List[int]] = {shard: [] for shard in range(count)}
+    for slot, shard in enumerate(slots):
+        owned[shard].append(slot)
+    quota = {shard: SHARD_SLOTS // count + (shard < SHARD_SLOTS % count) for shard in range(count)}
+
+    surplus = [slot for shard in range(count) for slot in owned[shard][quota[shard]:]]
+    plan: Dict[int, Set[int]] = {}
+    for shard in range(count):
+        missing = quota[shard] - len(owned[shard])
+        if missing > 0:
+            plan[shard] = set(surplus[:missing])
+            surplus = surplus[missing:]
+    return plan
+
+
+async def rebalance(grace_seconds: Optional[float] = None) -> int:
+    """
+    Spread the slots evenly over the configured shards, e.g. after adding
+    one to DATABASE_SHARD_URLS. Returns the number of messages moved.
+    """
+    moved = 0
+    for target, slots in plan_rebalance(await load_slot_map(), shard_count()).items():
+        moved += await move_slots(slots, target, grace_seconds)
+    return moved
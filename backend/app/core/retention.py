@@ -0,0 +1,216 @@
+# backend/app/core/retention.py
+
+"""
+Message retention: monthly archive partitions for old chat messages.
+
+chat_messages only keeps the hot horizon (RETENTION_HOT_DAYS). A background
+job moves older messages, oldest id first, into one table per calendar
+month (chat_messages_YYYYMM, same columns plus the conversation index) and
+their offloaded bodies into chat_message_bodies_archive. Each batch is one
+transaction of at most RETENTION_BATCH_SIZE rows followed by a pause, so
+compaction never holds long locks or saturates the disk, and the hot table
+and its indexes stay at a constant size.
+
+Partitions are listed in message_partitions with their id range; history
+reads (app.core.history) fall through to them only when the hot table
+cannot fill a page. Sync and unread counts cover the hot horizon only.
+
+Archiving moves a prefix of chat_messages in id order, so every archived id
+is lower than every hot id. Each message shard archives its own messages
+into its own partitions. Run the job on a single worker (or with
+`python -m app.cli compact`).
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, Index, MetaData, Table, delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import (
+    RETENTION_BATCH_PAUSE_MS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_HOT_DAYS,
+    RETENTION_INTERVAL_SECONDS,
+)
+from app.db.session import shard_session
+from app.db.shards import shard_count
+from app.models.message import ChatMessage
+from app.models.message_body import ArchivedBodyChunk, MessageBodyChunk
+from app.models.partition import MessagePartition
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = "chat_messages_"
+
+# Partition tables are created on demand, not by Base.metadata.create_all
+archive_metadata = MetaData()
+_partition_tables: Dict[str, Table] = {}
+
+
+def partition_name(timestamp: datetime) -> str:
+    return f"{PARTITION_PREFIX}{timestamp:%Y%m}"
+
+
+def partition_table(name: str) -> Table:
+    """
+    The Table object for an archive partition (shaped like chat_messages).
+    """
+    table = _partition_tables.get(name)
+    if table is None:
+        table = _partition_tables[name] = Table(
+            name,
+            archive_metadata,
+            *(
+                Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+                for column in ChatMessage.__table__.columns
+            ),
+            Index(f"ix_{name}_conversation", "sender_id", "recipient_id", "id"),
+        )
+    return table
+
+
+async def list_partitions(db: AsyncSession) -> List[MessagePartition]:
+    """
+    Archive partitions, oldest ids first.
+    """
+    result = await db.execute(select(MessagePartition).order_by(MessagePartition.min_id))
+    return list(result.scalars())
+
+
+def _as_utc(timestamp: datetime) -> datetime:
+    # SQLite returns naive UTC timestamps
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+
+async def add_to_partition(db: AsyncSession, name: str, rows: List[Dict]):
+    """
+    Insert message rows (ascending ids, all from one month) into partition
+    `name`, creating it and its catalog entry if needed. Does not commit.
+    """
+    table = partition_table(name)
+    partition = await db.get(MessagePartition, name)
+    if partition is None:
+        await db.run_sync(lambda session: table.create(session.connection(), checkfirst=True))
+        month = _as_utc(rows[0]["timestamp"])
+        partition = MessagePartition(
+            name=name,
+            period_start=month.replace(day=1, hour=0, minute=0, second=0, microsecond=0),
+            min_id=rows[0]["id"],
+            max_id=rows[-1]["id"],
+            row_count=0,
+        )
+        db.add(partition)
+    await db.execute(insert(table), rows)
+    partition.min_id = min(partition.min_id, rows[0]["id"])
+    partition.max_id = max(partition.max_id, rows[-1]["id"])
+    partition.row_count += len(rows)
+
+
+async def archive_batch(db: AsyncSession, cutoff: datetime, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """
+    Move up to batch_size of the oldest hot messages sent before cutoff into
+    their monthly partitions, in one transaction. Returns the number moved.
+    """
+    hot = ChatMessage.__table__
+    result = await db.execute(select(hot).order_by(hot.c.id).limit(batch_size))
+    rows = []
+    for row in result.mappings():
+        # Stop at the first recent message: the batch is the oldest hot rows
+        if _as_utc(row["timestamp"]) >= cutoff:
+            break
+        rows.append(dict(row))
+    if not rows:
+        return 0
+
+    by_partition: Dict[str, List[Dict]] = {}
+    for row in rows:
+        by_partition.setdefault(partition_name(_as_utc(row["timestamp"])), []).append(row)
+
+    for name, partition_rows in by_partition.items():
+        await add_to_partition(db, name, partition_rows)
+
+    offloaded = [row["id"] for row in rows if row["body_length"] is not None]
+    if offloaded:
+        chunks = await db.execute(
+            select(MessageBodyChunk.__table__).filter(MessageBodyChunk.message_id.in_(offloaded))
+        )
+        chunk_rows = [dict(chunk) for chunk in chunks.mappings()]
+        if chunk_rows:
+            await db.execute(insert(ArchivedBodyChunk), chunk_rows)
+        await db.execute(
+            delete(MessageBodyChunk.__table__).where(MessageBodyChunk.message_id.in_(offloaded))
+        )
+
+    # Delete exactly the rows copied: ids are assigned before commit, so a
+    # lower id may have been committed after the SELECT and is not archived yet
+    await db.execute(delete(hot).where(hot.c.id.in_([row["id"] for row in rows])))
+    await db.commit()
+    return len(rows)
+
+
+class RetentionJob:
+    """
+    Background task archiving messages past the hot horizon.
+    """
+
+    def __init__(
+        self,
+        session_factory=shard_session,
+        hot_days: float = RETENTION_HOT_DAYS,
+        batch_size: int = RETENTION_BATCH_SIZE,
+        batch_pause_ms: float = RETENTION_BATCH_PAUSE_MS,
+        interval_seconds: float = RETENTION_INTERVAL_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.hot_days = hot_days
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause_ms / 1000
+        self.interval = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """
+        Start archiving every interval_seconds.
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the job; an interrupted batch is rolled back.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def run_once(self) -> int:
+        """
+        Archive everything currently past the horizon, batch by batch, one
+        shard after the other. Returns the number of messages moved.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.hot_days)
+        moved = 0
+        for shard in range(shard_count()):
+            while True:
+                async with self.session_factory(shard) as db:
+                    count = await archive_batch(db, cutoff, self.batch_size)
+                moved += count
+                if count < self.batch_size:
+                    break
+                await asyncio.sleep(self.batch_pause)
+        return moved
+
+    async def _run(self):
+        while True:
+            try:
+                moved = await self.run_once()
+                if moved:
+                    logger.info(f"Archived {moved} messages older than {self.hot_days:g} days")
+            except Exception as e:
+                logger.error(f"Message archival failed: {e}")
+            await asyncio.sleep(self.interval)
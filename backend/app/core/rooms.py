@@ -0,0 +1,187 @@
+# backend/app/core/rooms.py
+
+"""
+Group conversations (rooms): membership, persistence and fan-out.
+
+Memberships live in room_members and are read once per user, when their
+first session on a worker connects; from then on ConnectionManager's
+in-memory index says which local users are in which room, and membership
+changes are pushed to it as room_joined / room_left events.
+
+Sending to a room is one insert into room_messages and one broker publish,
+whatever the size of the room: each worker then serializes the frame once
+and queues it for its online members only. Offline members catch up with
+the room history endpoint.
+"""
+
+import asyncio
+from typing import Iterable, List, Optional, Set
+
+from sqlalchemy import delete, func, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import HISTORY_PAGE_SIZE, MESSAGE_MAX_CONTENT_BYTES, ROOM_MAX_MEMBERS
+from app.core.connection_manager import ROOM_JOINED, ROOM_LEFT, ConnectionManager
+from app.core.message_bodies import ContentTooLarge, utf8_length
+from app.db.session import session_scope
+from app.models.room import Room, RoomMember, RoomMessage
+from app.models.user import User
+
+
+class RoomFull(ValueError):
+    """
+    Raised when adding members would exceed ROOM_MAX_MEMBERS.
+    """
+
+
+async def load_user_rooms(db: AsyncSession, user_id: int) -> Set[int]:
+    """
+    Ids of the rooms user_id belongs to (ix_room_members_user).
+    """
+    result = await db.execute(select(RoomMember.room_id).filter(RoomMember.user_id == user_id))
+    return set(result.scalars())
+
+
+async def is_member(db: AsyncSession, room_id: int, user_id: int) -> bool:
+    return await db.get(RoomMember, (room_id, user_id)) is not None
+
+
+async def add_members(db: AsyncSession, room_id: int, user_ids: Iterable[int]) -> List[int]:
+    """
+    Add existing users to a room with one multi-row insert and commit.
+    Returns the ids that were not members before.
+    Raises RoomFull if the room would exceed ROOM_MAX_MEMBERS.
+    """
+    candidates = set(user_ids)
+    if not candidates:
+        return []
+    existing = await db.execute(
+        select(RoomMember.user_id).filter(
+            RoomMember.room_id == room_id,
+            RoomMember.user_id.in_(candidates),
+        )
+    )
+    candidates -= set(existing.scalars())
+    users = await db.execute(select(User.id).filter(User.id.in_(candidates)))
+    new_ids = sorted(users.scalars())
+    if not new_ids:
+        return []
+
+    count = await db.execute(
+        select(func.count()).select_from(RoomMember).filter(RoomMember.room_id == room_id)
+    )
+    if count.scalar() + len(new_ids) > ROOM_MAX_MEMBERS:
+        raise RoomFull(f"Rooms are limited to {ROOM_MAX_MEMBERS} members")
+    await db.execute(insert(RoomMember), [{"room_id": room_id, "user_id": uid} for uid in new_ids])
+    await db.commit()
+    return new_ids
+
+
+async def remove_member(db: AsyncSession, room_id: int, user_id: int) -> bool:
+    """
+    Remove a user from a room and commit. Returns False if they were not a member.
+    """
+    result = await db.execute(
+        delete(RoomMember).where(RoomMember.room_id == room_id, RoomMember.user_id == user_id)
+    )
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def room_page(
+    db: AsyncSession,
+    room_id: int,
+    before_id: Optional[int] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> List[RoomMessage]:
+    """
+    One page of a room's history, ordered by id ascending: the newest
+    `limit` messages, or those older than before_id.
+    """
+    stmt = select(RoomMessage).filter(RoomMessage.room_id == room_id)
+    if before_id is not None:
+        stmt = stmt.filter(RoomMessage.id < before_id)
+    result = await db.execute(stmt.order_by(RoomMessage.id.desc()).limit(limit))
+    messages = list(result.scalars())
+    messages.reverse()
+    return messages
+
+
+def room_message_payload(msg: RoomMessage) -> dict:
+    return {
+        "type": "room_message",
+        "id": msg.id,
+        "room_id": msg.room_id,
+        "sender_id": msg.sender_id,
+        "content": msg.content,
+        "timestamp": msg.timestamp.isoformat(),
+    }
+
+
+class RoomHub:
+    """
+    Room membership tracking and delivery for one worker.
+    """
+
+    def __init__(self, manager: ConnectionManager, session_factory=session_scope):
+        self.manager = manager
+        self.session_factory = session_factory
+
+    async def connected(self, user_id: int):
+        """
+        Called after a session of user_id connected: index the user's rooms
+        if this is their first session here.
+        """
+        if user_id in self.manager.user_rooms:
+            return
+        async with self.session_factory() as db:
+            room_ids = await load_user_rooms(db, user_id)
+        if user_id not in self.manager.active_connections:
+            return
+        # Always registered, so an empty set marks the user as loaded
+        self.manager.user_rooms.setdefault(user_id, set())
+        await self.manager.track_rooms(user_id, room_ids)
+
+    def is_member(self, user_id: int, room_id: int) -> bool:
+        """
+        Membership check for a locally connected user, without a query.
+        """
+        return room_id in self.manager.user_rooms.get(user_id, ())
+
+    async def send(self, room_id: int, sender_id: int, content: str) -> dict:
+        """
+        Persist a room message and fan it out to the online members,
+        including the sender's sessions. Returns the delivered payload.
+        Raises ContentTooLarge above MESSAGE_MAX_CONTENT_BYTES.
+        """
+        size = utf8_length(content)
+        if size > MESSAGE_MAX_CONTENT_BYTES:
+            raise ContentTooLarge(
+                f"Message content is {size} bytes; the limit is {MESSAGE_MAX_CONTENT_BYTES}"
+            )
+        async with self.session_factory() as db:
+            result = await db.execute(
+                insert(RoomMessage)
+                .values(room_id=room_id, sender_id=sender_id, content=content)
+                .returning(RoomMessage.id, RoomMessage.timestamp)
+            )
+            msg_id, timestamp = result.one()
+            await db.commit()
+        payload = room_message_payload(RoomMessage(
+            id=msg_id, room_id=room_id, sender_id=sender_id, content=content, timestamp=timestamp,
+        ))
+        await self.manager.send_room_message(payload, room_id)
+        return payload
+
+    async def members_added(self, room: Room, user_ids: Iterable[int]):
+        """
+        Tell new members (and the index on their workers) about the room.
+        """
+        event = {"type": ROOM_JOINED, "room_id": room.id, "name": room.name}
+        await asyncio.gather(*(
+            self.manager.send_personal_message(event, user_id) for user_id in user_ids
+        ))
+
+    async def member_removed(self, room_id: int, user_id: int):
+        await self.manager.send_personal_message({"type": ROOM_LEFT, "room_id": room_id}, user_id)
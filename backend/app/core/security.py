@@ -1,16 +1,43 @@
 # backend/app/core/security.py
 
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
 import jwt
 from jwt import ExpiredSignatureError, InvalidTokenError
 from passlib.context import CryptContext
 
-from app.core.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.core.config import (
+    SECRET_KEY,
+    ALGORITHM,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    BCRYPT_ROUNDS,
+    PASSWORD_HASH_EXECUTOR,
+    PASSWORD_HASH_WORKERS,
+    PASSWORD_HASH_MAX_PENDING,
+)
+from app.core.metrics import PASSWORD_HASH_SECONDS, REGISTRY
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing context. Hashes made with a different cost factor are
+# reported as needing an update, which drives rehash-on-login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+)
+
+# Worker pool for bcrypt, created on first use
+_hash_executor: Optional[Executor] = None
+_hash_pending = 0
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when too many hash/verify operations are already queued.
+    """
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -27,6 +54,89 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password and, if its hash uses outdated settings (e.g. a
+    different bcrypt cost factor), return a fresh hash to store.
+    Returns (valid, new_hash_or_None).
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _get_hash_executor() -> Executor:
+    global _hash_executor
+    if _hash_executor is None:
+        if PASSWORD_HASH_EXECUTOR == "process":
+            _hash_executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        else:
+            # bcrypt releases the GIL, so threads hash in parallel
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                thread_name_prefix="bcrypt",
+            )
+    return _hash_executor
+
+
+async def _run_hasher(func, *args):
+    """
+    Run a hashing function in the worker pool, keeping the event loop free.
+    Raises PasswordHasherBusy instead of queueing beyond PASSWORD_HASH_MAX_PENDING.
+    """
+    global _hash_pending
+    if _hash_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise PasswordHasherBusy("Password hashing queue is full")
+    _hash_pending += 1
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_hash_executor(), func, *args)
+    finally:
+        _hash_pending -= 1
+        PASSWORD_HASH_SECONDS.observe(time.perf_counter() - start, func.__name__)
+
+
+REGISTRY.gauge_callback(
+    "nextext_password_hash_pending",
+    "Hash/verify operations running or queued in the bcrypt pool",
+    lambda: {(): _hash_pending},
+)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    verify_password, run in the password hashing pool.
+    """
+    return await _run_hasher(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    get_password_hash, run in the password hashing pool.
+    """
+    return await _run_hasher(get_password_hash, password)
+
+
+async def verify_and_update_password_async(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """
+    verify_and_update_password, run in the password hashing pool.
+    """
+    return await _run_hasher(verify_and_update_password, plain_password, hashed_password)
+
+
+def shutdown_password_hasher():
+    """
+    Stop the password hashing pool.
+    """
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False, cancel_futures=True)
+        _hash_executor = None
+
+
 def create_access_token(
     data: Dict[str, Any],
     expires_delta: Optional[timedelta] = None
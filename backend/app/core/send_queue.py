@@ -0,0 +1,171 @@
+# backend/app/core/send_queue.py
+
+"""
+Bounded outbound queue for a single WebSocket.
+
+Fan-out only enqueues frames; each socket's own writer task drains its
+queue, so a slow or stalled client never delays delivery to anyone else or
+the sender's receive loop.
+
+Backpressure policies when the queue is full:
+- "drop": discard the new frame.
+- "disconnect": close the socket as a slow consumer.
+- "coalesce": frames with the same coalesce key replace the queued one in
+  place; otherwise the oldest queued frame is evicted to make room.
+Frames carrying a coalesce key are ephemeral state updates (presence,
+typing): they are always collapsed with a queued frame of the same key, and
+when the queue is full they are dropped, whatever the policy, so they never
+evict a message or get a socket disconnected.
+
+Frames are written with the socket's negotiated codec. With batching
+enabled, whatever has queued up while the previous send was in flight (up
+to batch_max frames) goes out as one batch frame, so batching only kicks in
+under load and never delays a frame.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from fastapi import WebSocket, status
+
+from app.core.config import WS_BACKPRESSURE_POLICY, WS_SEND_QUEUE_SIZE, WS_SEND_TIMEOUT
+from app.core.metrics import WS_FRAMES_DROPPED, WS_SEND_SECONDS
+from app.core.wire import JSON_CODEC, Codec, Frame
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_POLICIES = ("drop", "disconnect", "coalesce")
+
+
+class SendQueue:
+    """
+    Outbound frame queue plus the writer task that drains it.
+    """
+    __slots__ = (
+        "websocket", "maxsize", "policy", "send_timeout", "codec", "batch_max", "dropped",
+        "closed", "_on_failure", "_frames", "_pending", "_ready", "_close_code", "_task",
+    )
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        on_failure: Callable[[WebSocket], Awaitable[None]],
+        maxsize: int = WS_SEND_QUEUE_SIZE,
+        policy: str = WS_BACKPRESSURE_POLICY,
+        send_timeout: float = WS_SEND_TIMEOUT,
+        codec: Codec = JSON_CODEC,
+        batch_max: int = 1,
+    ):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy!r}")
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.codec = codec
+        self.batch_max = max(batch_max, 1)
+        self.dropped = 0
+        self.closed = False
+        self._on_failure = on_failure
+        # Entries are [coalesce_key, frame] lists so coalescing can
+        # replace the frame of a queued entry in place.
+        self._frames: Deque[List] = deque()
+        self._pending: Dict[str, List] = {}
+        self._ready = asyncio.Event()
+        self._close_code: Optional[int] = None
+        self._task = asyncio.create_task(self._writer())
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def put(self, frame: Frame, coalesce_key: Optional[str] = None) -> bool:
+        """
+        Enqueue a frame without blocking. Returns False if it was not queued.
+        """
+        if self.closed:
+            return False
+
+        if coalesce_key is not None and coalesce_key in self._pending:
+            self._pending[coalesce_key][1] = frame
+            return True
+
+        if len(self._frames) >= self.maxsize:
+            self.dropped += 1
+            WS_FRAMES_DROPPED.inc(self.policy)
+            if self.policy == "drop" or coalesce_key is not None:
+                return False
+            if self.policy == "disconnect":
+                logger.warning("Closing slow WebSocket consumer: send queue full.")
+                self.close(status.WS_1008_POLICY_VIOLATION)
+                return False
+            self._forget(self._frames.popleft())
+
+        entry = [coalesce_key, frame]
+        self._frames.append(entry)
+        if coalesce_key is not None:
+            self._pending[coalesce_key] = entry
+        self._ready.set()
+        return True
+
+    def close(self, code: Optional[int] = None):
+        """
+        Stop accepting frames; the writer closes the socket with `code` if given.
+        """
+        self.closed = True
+        self._close_code = code
+        self._ready.set()
+
+    async def aclose(self):
+        """
+        Cancel the writer task and drop any queued frames.
+        """
+        self.closed = True
+        if not self._task.done() and self._task is not asyncio.current_task():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._frames.clear()
+        self._pending.clear()
+
+    def _forget(self, entry: List):
+        key = entry[0]
+        if key is not None and self._pending.get(key) is entry:
+            del self._pending[key]
+
+    def _next_payload(self):
+        count = min(self.batch_max, len(self._frames))
+        encoded = []
+        for _ in range(count):
+            entry = self._frames.popleft()
+            self._forget(entry)
+            encoded.append(entry[1].encode(self.codec))
+        return encoded[0] if count == 1 else self.codec.encode_batch(encoded)
+
+    async def _writer(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._frames and not (self.closed and self._close_code is not None):
+                    start = time.perf_counter()
+                    await asyncio.wait_for(
+                        self.codec.send(self.websocket, self._next_payload()),
+                        timeout=self.send_timeout,
+                    )
+                    WS_SEND_SECONDS.observe(time.perf_counter() - start)
+                if self.closed:
+                    if self._close_code is not None:
+                        # Bounded: the peer of a half-open socket never answers
+                        await asyncio.wait_for(
+                            self.websocket.close(code=self._close_code), timeout=self.send_timeout
+                        )
+                        await self._on_failure(self.websocket)
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"WebSocket writer stopped: {e!r}")
+            self.closed = True
+            await self._on_failure(self.websocket)
@@ -0,0 +1,302 @@
+# backend/app/core/user_search.py
+
+"""
+User search by username / email with relevance ranking and keyset pagination.
+
+Matches are ranked in tiers, each ordered by the matched field then id:
+    0. exact username
+    1. username prefix
+    2. email prefix
+    3. substring of username or email
+
+On PostgreSQL each tier is its own statement, run until the page is full:
+the prefix tiers are ordered range scans of btree indexes on
+(lower(username|email) COLLATE "C", id), and the substring tier is served
+by pg_trgm GIN indexes (or by walking the username index in order, when
+most rows match). Other databases (SQLite) use UserSearchIndex, an
+in-process index of sorted username/email lists (for prefix ranges) plus
+a trigram posting map (for substrings), built in bulk and kept up to date
+from the append-only users table. Its substring tier sorts the trigram
+candidates when they are few, and otherwise walks the username list in
+tier order, stopping once the page is full.
+
+Queries shorter than a trigram have no index for the substring tier: it is
+a sequential scan (in tier order, in the in-process index).
+
+Pages are continued with an opaque cursor encoding (rank, sort key, id).
+"""
+
+import asyncio
+import base64
+import json
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, func, or_, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models.user import User
+
+# (rank, sort_key, user_id)
+SearchKey = Tuple[int, str, int]
+
+# Shortest query the trigram index can serve
+MIN_SUBSTRING_LENGTH = 3
+
+# Trigram candidates sorted directly; larger sets are filtered while walking
+# the sorted username list
+SORT_CANDIDATES_MAX = 4096
+
+# Users indexed between yields to the event loop
+REFRESH_CHUNK = 5000
+
+POSTGRES_SEARCH_INDEXES = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+    "ON users USING gin (lower(username) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_email_trgm "
+    "ON users USING gin (lower(email) gin_trgm_ops)",
+    'CREATE INDEX IF NOT EXISTS ix_users_username_lower '
+    'ON users ((lower(username) COLLATE "C"), id)',
+    'CREATE INDEX IF NOT EXISTS ix_users_email_lower '
+    'ON users ((lower(email) COLLATE "C"), id)',
+)
+
+
+def encode_cursor(key: SearchKey) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> SearchKey:
+    """
+    Decode a cursor produced by encode_cursor. Raises ValueError if malformed.
+    """
+    try:
+        rank, sort_key, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(rank), str(sort_key), int(user_id)
+    except Exception:
+        raise ValueError("Invalid search cursor")
+
+
+def _trigrams(value: str) -> Set[str]:
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class UserSearchIndex:
+    """
+    In-process search index over users, for databases without trigram support.
+    """
+
+    def __init__(self):
+        self._usernames: List[Tuple[str, int]] = []
+        self._emails: List[Tuple[str, int]] = []
+        self._docs: Dict[int, Tuple[str, str]] = {}
+        # Trigram -> ids of the users containing it, ascending
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._max_id = 0
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add_many(self, rows: Iterable[Tuple[int, str, str]], resort: bool = True):
+        """
+        Index (id, username, email) rows, in ascending id order. The sorted
+        lists are re-sorted once per call, or left to the caller with
+        resort=False (see refresh).
+        """
+        postings = self._postings
+        for user_id, username, email in rows:
+            if user_id <= self._max_id:
+                continue
+            username, email = username.lower(), email.lower()
+            self._docs[user_id] = (username, email)
+            self._usernames.append((username, user_id))
+            self._emails.append((email, user_id))
+            for gram in _trigrams(username) | _trigrams(email):
+                postings[gram].append(user_id)
+            self._max_id = user_id
+        if resort:
+            self._usernames.sort()
+            self._emails.sort()
+
+    def add(self, user_id: int, username: str, email: str):
+        self.add_many([(user_id, username, email)])
+
+    async def refresh(self, db: AsyncSession):
+        """
+        Index users created since the last refresh (users are append-only,
+        so this also picks up registrations handled by other workers).
+        Rows are indexed in chunks of REFRESH_CHUNK, yielding to the event
+        loop in between, and the sorted lists are sorted once at the end
+        (searches wait for the refresh).
+        """
+        async with self._lock:
+            result = await db.stream(
+                select(User.id, User.username, User.email)
+                .filter(User.id > self._max_id)
+                .order_by(User.id)
+                .execution_options(yield_per=REFRESH_CHUNK)
+            )
+            try:
+                async for rows in result.partitions():
+                    self.add_many(rows, resort=False)
+                    await asyncio.sleep(0)
+            finally:
+                self._usernames.sort()
+                self._emails.sort()
+
+    def _range(self, entries: List[Tuple[str, int]], prefix: str, start: Tuple[str, int]):
+        for i in range(bisect_left(entries, start), len(entries)):
+            value, user_id = entries[i]
+            if not value.startswith(prefix):
+                return
+            yield value, user_id
+
+    def _iter_matches(self, q: str, after: Optional[SearchKey]) -> Iterator[SearchKey]:
+        after_rank = after[0] if after else -1
+
+        def start(rank: int, floor: str) -> Tuple[str, int]:
+            # Resume inside the cursor's tier, start other tiers at their floor
+            if after and rank == after_rank:
+                return after[1], after[2] + 1
+            return floor, 0
+
+        if after_rank <= 0:
+            for value, user_id in self._range(self._usernames, q, start(0, q)):
+                if value != q:
+                    break
+                yield 0, value, user_id
+
+        if after_rank <= 1:
+            for value, user_id in self._range(self._usernames, q, start(1, q)):
+                if value != q:
+                    yield 1, value, user_id
+
+        if after_rank <= 2:
+            for value, user_id in self._range(self._emails, q, start(2, q)):
+                if not self._docs[user_id][0].startswith(q):
+                    yield 2, value, user_id
+
+        floor = start(3, "")
+        if len(q) < MIN_SUBSTRING_LENGTH:
+            # No trigram to look up: scan in (username, id) order, lazily
+            for i in range(bisect_left(self._usernames, floor), len(self._usernames)):
+                username, user_id = self._usernames[i]
+                email = self._docs[user_id][1]
+                if username.startswith(q) or email.startswith(q):
+                    continue
+                if q in username or q in email:
+                    yield 3, username, user_id
+            return
+        grams = sorted(_trigrams(q), key=lambda g: len(self._postings.get(g, ())))
+        if len(self._postings.get(grams[0], ())) > SORT_CANDIDATES_MAX:
+            # Only common trigrams: walk the usernames in tier order instead
+            # of sorting every candidate, and stop once the page is full
+            order = (
+                self._usernames[i]
+                for i in range(bisect_left(self._usernames, floor), len(self._usernames))
+            )
+        else:
+            candidates = set(self._postings.get(grams[0], ()))
+            for gram in grams[1:]:
+                candidates.intersection_update(self._postings.get(gram, ()))
+            order = sorted(
+                (self._docs[user_id][0], user_id)
+                for user_id in candidates
+                if (self._docs[user_id][0], user_id) >= floor
+            )
+        for username, user_id in order:
+            email = self._docs[user_id][1]
+            if username.startswith(q) or email.startswith(q):
+                continue
+            if q in username or q in email:
+                yield 3, username, user_id
+
+    def search(self, q: str, limit: int, after: Optional[SearchKey] = None) -> List[SearchKey]:
+        """
+        Return up to `limit` ranked matches strictly after the `after` key.
+        """
+        results = []
+        for key in self._iter_matches(q.lower(), after):
+            results.append(key)
+            if len(results) >= limit:
+                break
+        return results
+
+
+user_index = UserSearchIndex()
+
+
+def uses_database_search(db: AsyncSession) -> bool:
+    return db.bind.dialect.name == "postgresql"
+
+
+def create_search_indexes(sync_conn):
+    """
+    Create database-native search indexes where supported (run_sync target).
+    """
+    if sync_conn.dialect.name == "postgresql":
+        for statement in POSTGRES_SEARCH_INDEXES:
+            sync_conn.execute(text(statement))
+
+
+async def _search_database(
+    db: AsyncSession, q: str, limit: int, after: Optional[SearchKey]
+) -> List[Tuple[SearchKey, User]]:
+    q = q.lower()
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    # Byte-order sort keys, matching the in-process index and served by the
+    # (lower(...) COLLATE "C", id) btree indexes, which also serve prefix LIKE
+    username = func.lower(User.username).collate("C")
+    email = func.lower(User.email).collate("C")
+    username_prefix = username.like(f"{escaped}%", escape="\\")
+    email_prefix = email.like(f"{escaped}%", escape="\\")
+    substring = or_(
+        func.lower(User.username).like(f"%{escaped}%", escape="\\"),
+        func.lower(User.email).like(f"%{escaped}%", escape="\\"),
+    )
+    tiers = (
+        (username, func.lower(User.username) == q),
+        (username, and_(username_prefix, func.lower(User.username) != q)),
+        (email, and_(email_prefix, ~username_prefix)),
+        (username, and_(substring, ~username_prefix, ~email_prefix)),
+    )
+
+    # One statement per tier, each an ordered index scan stopped by LIMIT,
+    # until the page is full
+    rows: List[Tuple[SearchKey, User]] = []
+    for rank, (sort_key, condition) in enumerate(tiers):
+        if after is not None and rank < after[0]:
+            continue
+        stmt = select(User, sort_key).filter(condition)
+        if after is not None and rank == after[0]:
+            stmt = stmt.filter(tuple_(sort_key, User.id) > tuple_(after[1], after[2]))
+        stmt = stmt.order_by(sort_key, User.id).limit(limit - len(rows))
+        result = await db.execute(stmt)
+        rows.extend(((rank, key, user.id), user) for user, key in result)
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+async def search_users(
+    db: AsyncSession, q: str, limit: int, after: Optional[SearchKey] = None
+) -> Tuple[List[User], Optional[SearchKey]]:
+    """
+    Return one ranked page of users matching `q` and the key to continue
+    from (None when there are no more results).
+    """
+    if uses_database_search(db):
+        rows = await _search_database(db, q, limit, after)
+    else:
+        await user_index.refresh(db)
+        keys = user_index.search(q, limit, after)
+        result = await db.execute(select(User).filter(User.id.in_([k[2] for k in keys])))
+        users = {user.id: user for user in result.scalars()}
+        rows = [(key, users[key[2]]) for key in keys if key[2] in users]
+
+    next_key = rows[-1][0] if len(rows) == limit else None
+    return [user for _, user in rows], next_key
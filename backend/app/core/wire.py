@@ -0,0 +1,152 @@
+# backend/app/core/wire.py
+
+"""
+WebSocket wire protocol: frame codecs and per-fan-out encoding.
+
+Clients pick a codec with the WebSocket subprotocol header:
+- "nextext.json" (also the default when no subprotocol is offered): text
+  frames holding one JSON object;
+- "nextext.msgpack": binary frames holding one MessagePack map (needs the
+  `msgpack` package from requirements.txt; without it the subprotocol is not
+  offered and a warning is logged at import).
+
+Outbound messages are wrapped in a Frame, which caches its encoding per
+codec, so a message fanned out to many sockets is serialized once per codec
+rather than once per socket. Clients that connect with ?batch=1 may receive
+several queued frames at once as {"type": "batch", "frames": [...]}; the
+batch is assembled from the cached encodings without re-serializing.
+
+Inbound frames larger than WS_MAX_FRAME_BYTES are refused with FrameTooLarge
+before they are decoded. The server launcher (app.server) also passes the
+limit to the WebSocket implementation, which then rejects such frames before
+buffering them.
+"""
+
+import json
+import logging
+from typing import Any, Dict, List, Optional, Union
+
+from fastapi import WebSocket
+
+from app.core.config import WS_MAX_FRAME_BYTES
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on installed packages
+    msgpack = None
+    logger.warning("msgpack is not installed; the nextext.msgpack subprotocol is disabled")
+
+Encoded = Union[str, bytes]
+
+
+class FrameTooLarge(Exception):
+    """
+    Raised when an inbound frame exceeds the size limit.
+    """
+
+
+def _check_size(size: int, max_size: int):
+    if size > max_size:
+        raise FrameTooLarge(f"Frame is {size} bytes; the limit is {max_size}")
+
+
+class JsonCodec:
+    name = "json"
+    subprotocol = "nextext.json"
+
+    def encode(self, message: Dict[str, Any]) -> str:
+        # Same output as WebSocket.send_json
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+    def encode_batch(self, frames: List[str]) -> str:
+        return '{"type":"batch","frames":[' + ",".join(frames) + "]}"
+
+    async def send(self, websocket: WebSocket, data: str):
+        await websocket.send_text(data)
+
+    async def receive(self, websocket: WebSocket, max_size: int = WS_MAX_FRAME_BYTES) -> Any:
+        data = await websocket.receive_text()
+        # Characters are 1-4 bytes; only count bytes when it can matter
+        if len(data) * 4 > max_size:
+            _check_size(len(data.encode("utf-8")), max_size)
+        return json.loads(data)
+
+
+class MsgPackCodec:
+    name = "msgpack"
+    subprotocol = "nextext.msgpack"
+
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        return msgpack.packb(message)
+
+    def encode_batch(self, frames: List[bytes]) -> bytes:
+        packer = msgpack.Packer()
+        return b"".join((
+            packer.pack_map_header(2),
+            packer.pack("type"),
+            packer.pack("batch"),
+            packer.pack("frames"),
+            packer.pack_array_header(len(frames)),
+            *frames,
+        ))
+
+    async def send(self, websocket: WebSocket, data: bytes):
+        await websocket.send_bytes(data)
+
+    async def receive(self, websocket: WebSocket, max_size: int = WS_MAX_FRAME_BYTES) -> Any:
+        data = await websocket.receive_bytes()
+        _check_size(len(data), max_size)
+        try:
+            return msgpack.unpackb(data)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise ValueError(f"Invalid MessagePack frame: {e}") from e
+
+
+JSON_CODEC = JsonCodec()
+
+# Subprotocol -> codec, in server preference order
+CODECS = {JSON_CODEC.subprotocol: JSON_CODEC}
+if msgpack is not None:
+    CODECS = {MsgPackCodec.subprotocol: MsgPackCodec(), **CODECS}
+
+Codec = Union[JsonCodec, MsgPackCodec]
+
+
+def negotiate(websocket: WebSocket) -> Codec:
+    """
+    Pick the codec for a connecting socket from the subprotocols it offers.
+    Falls back to JSON when none is offered or none is supported.
+    """
+    offered = websocket.scope.get("subprotocols") or ()
+    for subprotocol, codec in CODECS.items():
+        if subprotocol in offered:
+            return codec
+    return JSON_CODEC
+
+
+def accepted_subprotocol(websocket: WebSocket, codec: Codec) -> Optional[str]:
+    """
+    The subprotocol to confirm in the handshake: only echo one the client offered.
+    """
+    offered = websocket.scope.get("subprotocols") or ()
+    return codec.subprotocol if codec.subprotocol in offered else None
+
+
+class Frame:
+    """
+    One outbound message, encoded lazily and at most once per codec.
+    """
+
+    __slots__ = ("message", "_encoded")
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self._encoded: Dict[str, Encoded] = {}
+
+    def encode(self, codec: Codec) -> Encoded:
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = self._encoded[codec.name] = codec.encode(self.message)
+        return data
@@ -14,4 +14,7 @@ Base = declarative_base()
 # Expose metadata for migrations and schema generation
 metadata = Base.metadata
 
-__all__ = ["Base", "metadata"]
+# Largest value of the (32-bit INTEGER) id columns
+MAX_ID = 2 ** 31 - 1
+
+__all__ = ["Base", "metadata", "MAX_ID"]
@@ -0,0 +1,88 @@
+# backend/app/db/migrate.py
+
+"""
+Additive schema upgrades for databases created by an older version.
+
+Base.metadata.create_all creates missing tables but never alters an
+existing one. upgrade_schema runs after it and adds what later versions
+added to existing tables: nullable columns (or NOT NULL ones with a server
+default), indexes and unique constraints. Nothing is dropped or changed;
+anything else needs a manual migration.
+"""
+
+import logging
+from typing import Optional
+
+from sqlalchemy import MetaData, inspect
+from sqlalchemy.schema import AddConstraint, CreateIndex, UniqueConstraint
+
+from app.db.base import Base
+
+logger = logging.getLogger(__name__)
+
+
+def _add_column(sync_conn, table, column):
+    dialect = sync_conn.dialect
+    preparer = dialect.identifier_preparer
+    ddl = (
+        f"ALTER TABLE {preparer.format_table(table)} "
+        f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=dialect)}"
+    )
+    if column.server_default is not None:
+        default = column.server_default.arg
+        default = default if isinstance(default, str) else default.compile(dialect=dialect)
+        ddl += f" DEFAULT {default}"
+    if not column.nullable:
+        if column.server_default is None:
+            raise RuntimeError(
+                f"Cannot add NOT NULL column {table.name}.{column.name} without a "
+                "server default; migrate it manually"
+            )
+        ddl += " NOT NULL"
+    sync_conn.exec_driver_sql(ddl)
+
+
+def upgrade_schema(sync_conn, metadata: Optional[MetaData] = None):
+    """
+    Add the columns, indexes and unique constraints of `metadata` (default:
+    every model) missing from tables that already exist (run_sync target,
+    after create_all).
+    """
+    metadata = metadata if metadata is not None else Base.metadata
+    inspector = inspect(sync_conn)
+    existing_tables = set(inspector.get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                logger.info(f"Adding column {table.name}.{column.name}")
+                _add_column(sync_conn, table, column)
+
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        uniques = {constraint["name"] for constraint in inspector.get_unique_constraints(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                logger.info(f"Creating index {index.name}")
+                sync_conn.execute(CreateIndex(index))
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint) or constraint.name is None:
+                continue
+            if constraint.name in uniques or constraint.name in indexes:
+                continue
+            logger.info(f"Adding unique constraint {constraint.name}")
+            if sync_conn.dialect.name == "sqlite":
+                # SQLite cannot add constraints to a table; a unique index
+                # of the same name enforces the same rule
+                columns_sql = ", ".join(
+                    sync_conn.dialect.identifier_preparer.format_column(column)
+                    for column in constraint.columns
+                )
+                sync_conn.exec_driver_sql(
+                    f"CREATE UNIQUE INDEX {constraint.name} "
+                    f"ON {sync_conn.dialect.identifier_preparer.format_table(table)} ({columns_sql})"
+                )
+            else:
+                sync_conn.execute(AddConstraint(constraint))
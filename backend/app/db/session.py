@@ -6,21 +6,75 @@ Async SQLAlchemy session and engine setup.
 Provides:
 - engine: AsyncEngine connected via DATABASE_URL
 - AsyncSessionLocal: session factory for AsyncSession
+- session_scope: async context manager for one unit of work
 - get_db: FastAPI dependency yielding an AsyncSession
+- read_session_scope: like session_scope, routed to a read replica, with
+  statements that fail on the replica retried on the primary
+- note_write: keep a user's reads on the primary after their own writes
+  (per worker, or shared through Redis with REPLICA_STICKY_BACKEND=redis)
+- shard_engines / shard_session: message shards (see app.db.shards)
+- pool_status: connection pool gauges and checkout/wait counters
+Statement timings and pool gauges are also exported through app.core.metrics,
+and statements feed the slow-query log and query profiles of app.core.profiling.
 """
 
-from typing import AsyncGenerator
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional
 
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from app.core.metrics import DB_QUERY_SECONDS, DB_READS, REGISTRY
+from app.core.profiling import record_query
+from app.core.redis import get_redis
+from app.core.config import (
+    DATABASE_URL,
+    DATABASE_REPLICA_URLS,
+    DATABASE_SHARD_URLS,
+    REPLICA_RETRY_SECONDS,
+    REPLICA_STICKY_BACKEND,
+    REPLICA_STICKY_SECONDS,
+    DB_ECHO,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _engine_options(url: str) -> Dict[str, Any]:
+    """
+    Pool options for the engine. In-memory SQLite uses a single static
+    connection, which takes no sizing options.
+    """
+    options: Dict[str, Any] = {"pool_pre_ping": DB_POOL_PRE_PING}
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return options
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    return options
 
-from app.core.config import DATABASE_URL
 
 # Create the async engine
 engine: AsyncEngine = create_async_engine(
     DATABASE_URL,
-    echo=True,      # toggle SQL logging; set False in production
+    echo=DB_ECHO,   # log every statement; local debugging only
     future=True,    # use 2.0 style API
+    **_engine_options(DATABASE_URL),
 )
 
 # Configure a sessionmaker for AsyncSession
@@ -30,6 +84,304 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False,  # prevent attribute expiration after commit
 )
 
+# Pool counters, updated by pool events and session_scope
+_pool_counters: Dict[str, float] = {
+    "connects": 0,
+    "checkouts": 0,
+    "checkins": 0,
+    "invalidations": 0,
+    "wait_count": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+}
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    _pool_counters["connects"] += 1
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    _pool_counters["checkouts"] += 1
+
+
+@event.listens_for(engine.sync_engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    _pool_counters["checkins"] += 1
+
+
+@event.listens_for(engine.sync_engine, "invalidate")
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    _pool_counters["invalidations"] += 1
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    kind = statement.lstrip()[:6].upper()
+    if kind not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+        kind = "OTHER"
+    elapsed = time.perf_counter() - context._query_start
+    DB_QUERY_SECONDS.observe(elapsed, kind)
+    record_query(statement, parameters, elapsed)
+
+
+def _instrument(async_engine: AsyncEngine):
+    """
+    Feed the engine's statements to the query metrics and profiles.
+    """
+    event.listen(async_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(async_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+_instrument(engine)
+
+class ReplicaSession(AsyncSession):
+    """
+    AsyncSession on a read replica. A statement failing with a connection
+    or server error (lost connection, replica shutting down or in recovery)
+    is retried once on the primary, where the session stays for the rest of
+    its unit of work; objects already loaded are kept, detached. Errors
+    raised while iterating a streamed result are not retried.
+    """
+
+    replica_index: int = 0
+
+    async def _on_primary(self, method, *args, **kwargs):
+        try:
+            return await method(self, *args, **kwargs)
+        except (OperationalError, InterfaceError) as e:
+            if self.bind is engine:
+                raise
+            if e.connection_invalidated:
+                _replica_down_until[self.replica_index] = time.monotonic() + REPLICA_RETRY_SECONDS
+            logger.warning(f"Read replica {self.replica_index} query failed, retrying on the primary: {e}")
+            DB_READS.inc("fallback")
+            await self.close()
+            self.bind = engine
+            self.sync_session.bind = engine.sync_engine
+            return await method(self, *args, **kwargs)
+
+    async def execute(self, *args, **kwargs):
+        return await self._on_primary(AsyncSession.execute, *args, **kwargs)
+
+    async def scalar(self, *args, **kwargs):
+        return await self._on_primary(AsyncSession.scalar, *args, **kwargs)
+
+    async def scalars(self, *args, **kwargs):
+        return await self._on_primary(AsyncSession.scalars, *args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        return await self._on_primary(AsyncSession.get, *args, **kwargs)
+
+    async def stream(self, *args, **kwargs):
+        return await self._on_primary(AsyncSession.stream, *args, **kwargs)
+
+    async def stream_scalars(self, *args, **kwargs):
+        return await self._on_primary(AsyncSession.stream_scalars, *args, **kwargs)
+
+
+# Read replicas, each with its own pool; reads are spread round-robin
+replica_engines: List[AsyncEngine] = [
+    create_async_engine(url, echo=DB_ECHO, future=True, **_engine_options(url))
+    for url in DATABASE_REPLICA_URLS
+]
+_replica_sessions = [
+    sessionmaker(bind=replica, class_=ReplicaSession, expire_on_commit=False)
+    for replica in replica_engines
+]
+for replica in replica_engines:
+    _instrument(replica)
+
+# Message shards: shard 0 is the primary, DATABASE_SHARD_URLS adds 1..N-1
+shard_engines: List[AsyncEngine] = [engine] + [
+    create_async_engine(url, echo=DB_ECHO, future=True, **_engine_options(url))
+    for url in DATABASE_SHARD_URLS
+]
+_shard_sessions = [AsyncSessionLocal] + [
+    sessionmaker(bind=shard, class_=AsyncSession, expire_on_commit=False)
+    for shard in shard_engines[1:]
+]
+for shard in shard_engines[1:]:
+    _instrument(shard)
+
+# Replica index -> monotonic time before which it is skipped
+_replica_down_until: Dict[int, float] = {}
+_next_replica = 0
+# User id -> monotonic time until which their reads go to the primary
+# (writes made through this worker)
+_sticky_until: Dict[int, float] = {}
+
+
+def pool_status() -> Dict[str, Any]:
+    """
+    Snapshot of pool occupancy plus cumulative checkout and wait counters.
+    """
+    pool = engine.pool
+    status: Dict[str, Any] = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=DB_MAX_OVERFLOW,
+        )
+    status.update(_pool_counters)
+    return status
+
+
+REGISTRY.gauge_callback(
+    "nextext_db_pool",
+    "Connection pool gauges and cumulative counters (see /health/db)",
+    lambda: {
+        (name,): value
+        for name, value in pool_status().items()
+        if isinstance(value, (int, float))
+    },
+    ("stat",),
+)
+
+
+@asynccontextmanager
+async def session_scope() -> AsyncIterator[AsyncSession]:
+    """
+    Yield an AsyncSession for a single unit of work.
+
+    A pooled connection is checked out on entry (recording how long the
+    pool made us wait) and returned on exit, so callers such as WebSocket
+    handlers only hold a connection while they are actually using it.
+    """
+    async with AsyncSessionLocal() as session:
+        start = time.perf_counter()
+        await session.connection()
+        waited = time.perf_counter() - start
+        _pool_counters["wait_count"] += 1
+        _pool_counters["wait_seconds_total"] += waited
+        _pool_counters["wait_seconds_max"] = max(_pool_counters["wait_seconds_max"], waited)
+        yield session
+
+
+def _sticky_key(user_id: int) -> str:
+    return f"nextext:sticky:{user_id}"
+
+
+async def note_write(user_id: int):
+    """
+    Record that user_id just wrote: for REPLICA_STICKY_SECONDS their reads
+    go to the primary, so they see their own writes despite replica lag.
+    Kept per worker, and in Redis (with that TTL) when
+    REPLICA_STICKY_BACKEND is "redis", so every worker honours it.
+    """
+    if not replica_engines:
+        return
+    now = time.monotonic()
+    if len(_sticky_until) >= 10000:
+        for stale in [uid for uid, until in _sticky_until.items() if until <= now]:
+            del _sticky_until[stale]
+    _sticky_until[user_id] = now + REPLICA_STICKY_SECONDS
+    if REPLICA_STICKY_BACKEND == "redis":
+        try:
+            await get_redis().set(_sticky_key(user_id), 1, px=int(REPLICA_STICKY_SECONDS * 1000))
+        except Exception as e:
+            logger.warning(f"Replica stickiness Redis store failed: {e}")
+
+
+async def _is_sticky(user_id: int) -> bool:
+    """
+    Whether user_id wrote within REPLICA_STICKY_SECONDS (see note_write).
+    When the shared tier cannot be reached, reads stay on the primary.
+    """
+    if _sticky_until.get(user_id, 0) > time.monotonic():
+        return True
+    if REPLICA_STICKY_BACKEND != "redis":
+        return False
+    try:
+        return bool(await get_redis().exists(_sticky_key(user_id)))
+    except Exception as e:
+        logger.warning(f"Replica stickiness Redis lookup failed: {e}")
+        return True
+
+
+async def _replica_session() -> Optional[AsyncSession]:
+    """
+    Open a session on the next healthy replica, with its connection
+    checked out. A replica that cannot be reached is skipped for
+    REPLICA_RETRY_SECONDS. Returns None when no replica is available.
+    """
+    global _next_replica
+    now = time.monotonic()
+    for _ in range(len(_replica_sessions)):
+        index = _next_replica
+        _next_replica = (_next_replica + 1) % len(_replica_sessions)
+        if _replica_down_until.get(index, 0) > now:
+            continue
+        session = _replica_sessions[index]()
+        session.replica_index = index
+        try:
+            await session.connection()
+        except (DBAPIError, OSError) as e:
+            await session.close()
+            _replica_down_until[index] = now + REPLICA_RETRY_SECONDS
+            logger.warning(f"Read replica {index} unavailable, skipping it for {REPLICA_RETRY_SECONDS:g}s: {e}")
+            continue
+        _replica_down_until.pop(index, None)
+        return session
+    return None
+
+
+@asynccontextmanager
+async def read_session_scope(user_id: Optional[int] = None) -> AsyncIterator[AsyncSession]:
+    """
+    Yield an AsyncSession for read-only work, on a read replica when one is
+    configured and reachable and user_id has not written recently (see
+    note_write); on the primary otherwise. A statement that fails on the
+    replica is retried on the primary (see ReplicaSession). Nothing must be
+    written through it.
+    """
+    if not replica_engines:
+        async with session_scope() as session:
+            yield session
+        return
+
+    if user_id is not None and await _is_sticky(user_id):
+        DB_READS.inc("sticky")
+        async with session_scope() as session:
+            yield session
+        return
+
+    replica = await _replica_session()
+    if replica is None:
+        DB_READS.inc("fallback")
+        async with session_scope() as session:
+            yield session
+        return
+
+    DB_READS.inc("replica")
+    async with replica as session:
+        yield session
+
+
+@asynccontextmanager
+async def shard_session(
+    shard: int = 0, read_only: bool = False, user_id: Optional[int] = None
+) -> AsyncIterator[AsyncSession]:
+    """
+    Yield an AsyncSession on one message shard. Read-only work on shard 0
+    (the primary) is routed like read_session_scope.
+    """
+    if shard == 0:
+        scope = read_session_scope(user_id) if read_only else session_scope()
+        async with scope as session:
+            yield session
+        return
+    async with _shard_sessions[shard]() as session:
+        yield session
+
+
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """
     FastAPI dependency: yields an AsyncSession and ensures its closure.
@@ -37,5 +389,5 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
         async def endpoint(db: AsyncSession = Depends(get_db)):
             ...
     """
-    async with AsyncSessionLocal() as session:
+    async with session_scope() as session:
         yield session
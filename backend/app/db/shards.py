@@ -0,0 +1,276 @@
+# backend/app/db/shards.py
+
+"""
+Conversation-keyed sharding of message data across databases.
+
+All the data of a conversation (an unordered user pair) lives on one
+shard: its messages, hot and archived, their offloaded bodies, and its
+summary row with the seq counter. Shard 0 is the primary database
+(DATABASE_URL), which also keeps everything that is not per conversation
+(users, watermarks, rooms, the slot map); DATABASE_SHARD_URLS adds shards
+1..N-1.
+
+Placement: a conversation hashes into one of SHARD_SLOTS slots, and
+shard_slots on the primary says which shard holds each slot. Workers cache
+the map and reload it every SHARD_MAP_REFRESH_SECONDS. The map is seeded
+once, round-robin over the shards configured at that time; a shard added
+later receives conversations only when slots are moved to it (see
+app.core.resharding).
+
+Writes check the batch's slots against the shard's owned_slots inside the
+write transaction, so a worker routing with a stale map gets SlotMoved
+instead of writing to a shard that gave the slot away. With several
+shards, message ids come from a counter on the primary so they stay unique
+(and roughly time-ordered) across shards.
+
+Reads of one conversation go to its shard; reads spanning conversations
+(sync, search, conversation lists) run on every shard concurrently and are
+merged. With a single shard none of this costs anything: no slot checks,
+ids from the table's own sequence, reads through read_session_scope.
+"""
+
+import asyncio
+import time
+import zlib
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Set, TypeVar
+
+from sqlalchemy import MetaData, func, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import SHARD_MAP_REFRESH_SECONDS
+from app.db.base import Base
+from app.db.migrate import upgrade_schema
+from app.db.session import session_scope, shard_engines, shard_session
+from app.models.message import ChatMessage
+from app.models.partition import MessagePartition
+from app.models.shard import MessageIdCounter, OwnedSlot, ShardSlot
+
+# Fixed: changing it would move every conversation to another slot
+SHARD_SLOTS = 1024
+
+# Tables holding per-conversation data, present on every shard
+SHARDED_TABLES = (
+    "chat_messages",
+    "chat_message_bodies",
+    "chat_message_bodies_archive",
+    "conversations",
+    "message_partitions",
+    "owned_slots",
+)
+
+T = TypeVar("T")
+
+
+class SlotMoved(Exception):
+    """
+    Raised when a shard no longer owns a slot a write was routed to it for.
+    """
+
+    def __init__(self, slots: Set[int]):
+        super().__init__(f"Slots moved to another shard: {sorted(slots)}")
+        self.slots = slots
+
+
+def shard_count() -> int:
+    return len(shard_engines)
+
+
+def slot_of(user_a: int, user_b: int) -> int:
+    """
+    Slot of the conversation between two users (order does not matter).
+    """
+    low, high = (user_a, user_b) if user_a <= user_b else (user_b, user_a)
+    return zlib.crc32(f"{low}:{high}".encode()) % SHARD_SLOTS
+
+
+def create_shard_schema(sync_conn):
+    """
+    Create the per-conversation tables on a secondary shard (run_sync
+    target). Foreign keys to tables that only exist on the primary (users)
+    are left out.
+    """
+    metadata = MetaData()
+    for name in SHARDED_TABLES:
+        table = Base.metadata.tables[name].to_metadata(metadata)
+        for constraint in list(table.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.split(".")[0] in SHARDED_TABLES:
+                continue
+            table.constraints.discard(constraint)
+            for fk in constraint.elements:
+                fk.parent.foreign_keys.discard(fk)
+                table.foreign_keys.discard(fk)
+    metadata.create_all(sync_conn)
+    upgrade_schema(sync_conn, metadata)
+
+
+class ShardMap:
+    """
+    Cached slot -> shard map.
+    """
+
+    def __init__(self, refresh_seconds: float = SHARD_MAP_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.slots: List[int] = [0] * SHARD_SLOTS
+        self.loaded_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        async with session_scope() as db:
+            result = await db.execute(select(ShardSlot.slot, ShardSlot.shard))
+            rows = result.all()
+        slots = [0] * SHARD_SLOTS
+        for slot, shard in rows:
+            slots[slot] = shard
+        self.slots = slots
+        self.loaded_at = time.monotonic()
+
+    async def refresh(self, force: bool = False):
+        """
+        Reload the map if it is older than refresh_seconds (or if forced).
+        """
+        if shard_count() == 1:
+            return
+        loaded_at = self.loaded_at
+        if not force and time.monotonic() - loaded_at < self.refresh_seconds:
+            return
+        async with self._lock:
+            # Reloaded by a concurrent caller meanwhile
+            if self.loaded_at == loaded_at:
+                await self.load()
+
+    async def shard_of(self, user_a: int, user_b: int) -> int:
+        """
+        Shard holding the conversation between two users.
+        """
+        if shard_count() == 1:
+            return 0
+        await self.refresh()
+        return self.slots[slot_of(user_a, user_b)]
+
+
+shard_map = ShardMap()
+
+
+async def init_shards():
+    """
+    Seed the slot map and the shards' owned slots on first start, and the
+    message id counter the first time several shards are configured.
+    Secondary shard schemas must exist (create_shard_schema).
+    """
+    count = shard_count()
+    async with session_scope() as db:
+        seeded = (await db.execute(select(func.count()).select_from(ShardSlot))).scalar()
+        if not seeded:
+            try:
+                await db.execute(
+                    insert(ShardSlot),
+                    [{"slot": slot, "shard": slot % count} for slot in range(SHARD_SLOTS)],
+                )
+                await db.commit()
+            except IntegrityError:
+                # Seeded by another worker starting at the same time
+                await db.rollback()
+                seeded = True
+    if not seeded:
+        for shard in range(count):
+            async with shard_session(shard) as db:
+                await db.execute(
+                    insert(OwnedSlot),
+                    [{"slot": slot} for slot in range(shard, SHARD_SLOTS, count)],
+                )
+                await db.commit()
+
+    if count > 1:
+        async with session_scope() as db:
+            if await db.get(MessageIdCounter, "chat_messages") is None:
+                next_id = max(await on_every_shard(_max_message_id, read_only=False)) + 1
+                try:
+                    db.add(MessageIdCounter(name="chat_messages", next_id=next_id))
+                    await db.commit()
+                except IntegrityError:
+                    await db.rollback()
+    await shard_map.refresh(force=True)
+
+
+async def _max_message_id(db: AsyncSession) -> int:
+    hot = (await db.execute(select(func.max(ChatMessage.id)))).scalar()
+    archived = (await db.execute(select(func.max(MessagePartition.max_id)))).scalar()
+    return max(hot or 0, archived or 0)
+
+
+async def check_slots(db: AsyncSession, slots: Set[int]):
+    """
+    Verify, in the write transaction, that the shard still owns `slots`,
+    holding shared locks on them until commit so a slot cannot be moved
+    away meanwhile. Raises SlotMoved otherwise.
+    """
+    if shard_count() == 1:
+        return
+    stmt = select(OwnedSlot.slot).filter(OwnedSlot.slot.in_(slots))
+    if db.bind.dialect.name != "postgresql":
+        # SQLite ignores FOR SHARE and runs plain SELECTs outside the
+        # transaction; a no-op update takes the database write lock instead
+        touched = await db.execute(
+            update(OwnedSlot).where(OwnedSlot.slot.in_(slots)).values(slot=OwnedSlot.slot)
+        )
+        if touched.rowcount == len(slots):
+            return
+    else:
+        stmt = stmt.with_for_update(read=True)
+    missing = slots - set((await db.execute(stmt)).scalars())
+    if missing:
+        raise SlotMoved(missing)
+
+
+async def allocate_message_ids(count: int, db: Optional[AsyncSession] = None) -> int:
+    """
+    Reserve `count` consecutive message ids on the primary and return the
+    first one (several shards only). Pass `db` when already in a write
+    transaction on the primary: the reservation then commits with it
+    (a second transaction would wait for the first one on SQLite).
+    """
+    stmt = (
+        update(MessageIdCounter)
+        .where(MessageIdCounter.name == "chat_messages")
+        .values(next_id=MessageIdCounter.next_id + count)
+        .returning(MessageIdCounter.next_id)
+    )
+    if db is not None:
+        return (await db.execute(stmt)).scalar_one() - count
+    async with session_scope() as db:
+        next_id = (await db.execute(stmt)).scalar_one()
+        await db.commit()
+    return next_id - count
+
+
+async def on_every_shard(
+    fn: Callable[[AsyncSession], Awaitable[T]],
+    read_only: bool = True,
+    user_id: Optional[int] = None,
+) -> List[T]:
+    """
+    Run fn(session) on every shard concurrently and return the results in
+    shard order.
+    """
+    async def run(shard: int) -> T:
+        async with shard_session(shard, read_only=read_only, user_id=user_id) as db:
+            return await fn(db)
+
+    if shard_count() == 1:
+        return [await run(0)]
+    return list(await asyncio.gather(*(run(shard) for shard in range(shard_count()))))
+
+
+@asynccontextmanager
+async def conversation_session(
+    user_a: int, user_b: int, read_only: bool = False, user_id: Optional[int] = None
+) -> AsyncIterator[AsyncSession]:
+    """
+    Yield a session on the shard holding the conversation between two users.
+    """
+    shard = await shard_map.shard_of(user_a, user_b)
+    async with shard_session(shard, read_only=read_only, user_id=user_id) as db:
+        yield db
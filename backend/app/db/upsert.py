@@ -0,0 +1,100 @@
+# backend/app/db/upsert.py
+
+"""
+Dialect-aware INSERT ... ON CONFLICT DO UPDATE.
+
+PostgreSQL and SQLite run the upsert as one statement. Other databases fall
+back to an UPDATE of the existing row followed, when there was none, by an
+INSERT in a savepoint (retried as an UPDATE if a concurrent transaction
+inserted the row first), one row at a time.
+"""
+
+from typing import Any, Callable, Dict, List, Sequence, Union
+
+from sqlalchemy import Table, and_, case, insert, literal, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.sql import ColumnElement
+
+NATIVE_UPSERT_DIALECTS = ("postgresql", "sqlite")
+
+
+def upsert(
+    dialect_name: str,
+    table: Table,
+    values: Union[Dict[str, Any], List[Dict[str, Any]]],
+    index_elements: List[str],
+    set_: Callable[[Any], Dict[str, Any]],
+):
+    """
+    Build an upsert for PostgreSQL or SQLite.
+    `set_` receives the `excluded` row namespace and returns the SET clause.
+    """
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upsert is not supported on {dialect_name}")
+
+    stmt = insert(table).values(values)
+    return stmt.on_conflict_do_update(index_elements=index_elements, set_=set_(stmt.excluded))
+
+
+class _Excluded:
+    """
+    The `excluded` namespace of one row, for the fallback path: each
+    column is the incoming value as a bound literal.
+    """
+
+    def __init__(self, table: Table, row: Dict[str, Any]):
+        self._table = table
+        self._row = row
+
+    def __getattr__(self, name: str) -> ColumnElement:
+        return literal(self._row[name], type_=self._table.c[name].type)
+
+
+async def execute_upsert(
+    db: AsyncSession,
+    table: Table,
+    values: Union[Dict[str, Any], List[Dict[str, Any]]],
+    index_elements: List[str],
+    set_: Callable[[Any], Dict[str, Any]],
+    returning: Sequence[ColumnElement] = (),
+) -> List[Any]:
+    """
+    Upsert `values` in the session's transaction and return the `returning`
+    columns of each affected row (in no particular order on the native path).
+    """
+    rows = values if isinstance(values, list) else [values]
+    dialect_name = db.bind.dialect.name
+    if dialect_name in NATIVE_UPSERT_DIALECTS:
+        stmt = upsert(dialect_name, table, rows, index_elements, set_)
+        if not returning:
+            await db.execute(stmt)
+            return []
+        return list(await db.execute(stmt.returning(*returning)))
+
+    results = []
+    for row in rows:
+        key = and_(*(table.c[name] == row[name] for name in index_elements))
+        update_row = update(table).where(key).values(set_(_Excluded(table, row)))
+        if (await db.execute(update_row)).rowcount == 0:
+            try:
+                async with db.begin_nested():
+                    await db.execute(insert(table).values(row))
+            except IntegrityError:
+                # Inserted by a concurrent transaction since the UPDATE
+                await db.execute(update_row)
+        if returning:
+            results.append((await db.execute(select(*returning).where(key))).one())
+    return results
+
+
+def greatest(current: ColumnElement, incoming: ColumnElement) -> ColumnElement:
+    """
+    Portable GREATEST() of two values, for monotonic watermark columns.
+    """
+    return case((incoming > current, incoming), else_=current)
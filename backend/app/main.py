@@ -2,11 +2,22 @@
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from app.core.config import CORS_ORIGINS
-from app.api.v1 import users, chat
+from app.core.config import CORS_ORIGINS, RETENTION_ENABLED
+from app.core.message_search import create_message_search_index
+from app.core.metrics import REGISTRY, MetricsMiddleware
+from app.core.profiling import ProfilingMiddleware
+from app.core.rate_limit import limiter
+from app.core.resharding import setup_shards
+from app.core.redis import close_redis
+from app.core.retention import RetentionJob
+from app.core.security import shutdown_password_hasher
+from app.core.user_search import create_search_indexes, user_index
+from app.api.v1 import users, chat, rooms
 from app.db.base import Base
-from app.db.session import engine
+from app.db.migrate import upgrade_schema
+from app.db.session import engine, pool_status, session_scope
 
 app = FastAPI(
     title="NexText API",
@@ -14,6 +25,8 @@ app = FastAPI(
     description="A real-time chat application backend",
 )
 
+retention = RetentionJob()
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -24,13 +37,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency histograms
+app.add_middleware(MetricsMiddleware)
+
+# Per-request query profiles and X-Profile captures (PROFILING_ENABLED only)
+app.add_middleware(ProfilingMiddleware)
+
 @app.on_event("startup")
 async def on_startup():
     """
-    Create all database tables on startup if they don't exist.
+    Create all database tables on startup if they don't exist (and add
+    columns and indexes missing from older ones), then start the background
+    services.
     """
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+        await conn.run_sync(create_search_indexes)
+        await conn.run_sync(create_message_search_index)
+    await setup_shards()
+    if engine.dialect.name != "postgresql":
+        # Warm the in-process user search index
+        async with session_scope() as db:
+            await user_index.refresh(db)
+    await chat.ingest.start()
+    await chat.manager.start()
+    if RETENTION_ENABLED:
+        await retention.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """
+    Flush pending messages, stop the WebSocket broker and archival job and
+    release shared clients.
+    """
+    await retention.stop()
+    await chat.ingest.stop()
+    await chat.manager.stop()
+    await close_redis()
+    shutdown_password_hasher()
 
 @app.get("/health", summary="Health Check")
 async def health_check():
@@ -39,8 +84,32 @@ async def health_check():
     """
     return {"status": "OK"}
 
+@app.get("/health/db", summary="Database pool status")
+async def db_pool_status():
+    """
+    Connection pool occupancy and checkout/wait counters for this worker.
+    """
+    return pool_status()
+
+@app.get("/health/ratelimit", summary="Rate limiter status")
+async def rate_limit_status():
+    """
+    Per-policy allowed/limited counters and bucket count for this worker.
+    """
+    return limiter.stats()
+
+@app.get("/metrics", summary="Prometheus metrics", include_in_schema=False)
+async def metrics():
+    """
+    This worker's metrics in the Prometheus text exposition format.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 # User routes (mounted with their own prefix)
 app.include_router(users.router)
 
 # Chat routes (WebSocket + history) under /api/v1/chat
 app.include_router(chat.router, prefix="/api/v1/chat", tags=["chat"])
+
+# Group conversation routes (mounted with their own prefix)
+app.include_router(rooms.router)
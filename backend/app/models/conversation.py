@@ -0,0 +1,55 @@
+# backend/app/models/conversation.py
+
+"""
+ORM model for the denormalized per-conversation summary.
+
+One row per unordered user pair, stored as (user_low_id, user_high_id),
+maintained incrementally as messages are persisted so that an inbox view
+is a single indexed read instead of a history query per contact.
+"""
+
+from sqlalchemy import Column, Integer, ForeignKey, String, DateTime, Index
+from app.db.base import Base
+
+PREVIEW_LENGTH = 140
+
+
+class Conversation(Base):
+    __tablename__ = "conversations"
+    __table_args__ = (
+        # Inbox ordering for each side of the pair
+        Index("ix_conversations_low_last", "user_low_id", "last_message_id"),
+        Index("ix_conversations_high_last", "user_high_id", "last_message_id"),
+    )
+
+    user_low_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    user_high_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    last_message_id = Column(Integer, nullable=False)
+    last_sender_id = Column(Integer, nullable=False)
+    last_preview = Column(String(PREVIEW_LENGTH), nullable=False)
+    last_timestamp = Column(DateTime(timezone=True), nullable=False)
+    # Sequence number of the last message (see ChatMessage.seq)
+    last_seq = Column(Integer, nullable=False, default=0)
+    # Messages not yet read by each side
+    unread_low = Column(Integer, nullable=False, default=0)
+    unread_high = Column(Integer, nullable=False, default=0)
+
+    def peer_of(self, user_id: int) -> int:
+        return self.user_high_id if user_id == self.user_low_id else self.user_low_id
+
+    def unread_for(self, user_id: int) -> int:
+        return self.unread_low if user_id == self.user_low_id else self.unread_high
+
+    def __repr__(self) -> str:
+        return (
+            f"<Conversation {self.user_low_id}<->{self.user_high_id} "
+            f"last={self.last_message_id}>"
+        )
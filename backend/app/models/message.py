@@ -4,13 +4,24 @@
 ORM model for chat messages between users.
 """
 
-from sqlalchemy import Column, Integer, ForeignKey, Text, DateTime, func
+from sqlalchemy import Column, Integer, ForeignKey, String, Text, DateTime, Index, UniqueConstraint, func
 from sqlalchemy.orm import relationship
 from app.db.base import Base
 
+CLIENT_MSG_ID_MAX_LENGTH = 64
+
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # Conversation index: serves keyset pagination of one direction of a
+        # conversation (sender -> recipient) ordered by id, and the inbox
+        # catch-up past a delivery watermark.
+        Index("ix_chat_messages_conversation", "sender_id", "recipient_id", "id"),
+        # Idempotent sends: a client message id is used once per sender
+        # (rows without one are not constrained, NULLs being distinct).
+        UniqueConstraint("sender_id", "client_msg_id", name="uq_chat_messages_client_msg_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(
@@ -23,7 +34,15 @@ class ChatMessage(Base):
         ForeignKey("users.id", ondelete="CASCADE"),
         nullable=False,
     )
+    # Full text, or only a preview when the body is offloaded to
+    # chat_message_bodies; body_length is then the full length in characters.
     content = Column(Text, nullable=False)
+    body_length = Column(Integer, nullable=True)
+    # Position in the conversation (the unordered user pair), allocated from
+    # Conversation.last_seq: 1, 2, 3... with no gaps, in id order.
+    seq = Column(Integer, nullable=True)
+    # Optional id chosen by the sending client, to deduplicate retries
+    client_msg_id = Column(String(CLIENT_MSG_ID_MAX_LENGTH), nullable=True)
     timestamp = Column(
         DateTime(timezone=True),
         server_default=func.now(),
@@ -0,0 +1,45 @@
+# backend/app/models/message_body.py
+
+"""
+ORM model for offloaded message bodies.
+
+Content larger than MESSAGE_INLINE_MAX_BYTES is split into ordered chunks
+stored here, keyed by message id, while the chat_messages row keeps only a
+preview. Conversation pages and inbox scans therefore never read large
+bodies; they are fetched on demand.
+"""
+
+from sqlalchemy import Column, Integer, ForeignKey, Text
+from app.db.base import Base
+
+
+class MessageBodyChunk(Base):
+    __tablename__ = "chat_message_bodies"
+
+    message_id = Column(
+        Integer,
+        ForeignKey("chat_messages.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    seq = Column(Integer, primary_key=True)
+    data = Column(Text, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<MessageBodyChunk message={self.message_id} seq={self.seq}>"
+
+
+class ArchivedBodyChunk(Base):
+    """
+    Body chunks of messages moved to archive partitions (see
+    app.core.retention). Unlike chat_message_bodies this table has no
+    foreign key, since its messages no longer live in chat_messages.
+    """
+
+    __tablename__ = "chat_message_bodies_archive"
+
+    message_id = Column(Integer, primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    data = Column(Text, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<ArchivedBodyChunk message={self.message_id} seq={self.seq}>"
@@ -0,0 +1,27 @@
+# backend/app/models/partition.py
+
+"""
+ORM model for the catalog of archived message partitions.
+
+Messages older than the retention horizon are moved out of chat_messages
+into one table per calendar month (chat_messages_YYYYMM, see
+app.core.retention). Each partition is listed here with the id range it
+holds, so history reads only visit the partitions a page can touch.
+"""
+
+from sqlalchemy import Column, Integer, String, DateTime
+from app.db.base import Base
+
+
+class MessagePartition(Base):
+    __tablename__ = "message_partitions"
+
+    name = Column(String(64), primary_key=True)
+    # First instant of the month the partition holds
+    period_start = Column(DateTime(timezone=True), nullable=False)
+    min_id = Column(Integer, nullable=False)
+    max_id = Column(Integer, nullable=False)
+    row_count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"<MessagePartition {self.name} ids={self.min_id}..{self.max_id}>"
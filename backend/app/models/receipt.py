@@ -0,0 +1,69 @@
+# backend/app/models/receipt.py
+
+"""
+ORM models for per-user delivery and read watermarks.
+
+Within a conversation, messages become visible in id order, so a single id
+per conversation side records everything acknowledged up to it. Ids of
+different conversations may commit out of order, so no watermark spans
+several conversations (see app.core.inbox).
+"""
+
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, func
+from app.db.base import Base
+
+
+class DeliveryCursor(Base):
+    """
+    Highest message id from peer_id delivered to (acknowledged by) user_id.
+    """
+    __tablename__ = "delivery_cursors"
+
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    peer_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    delivered_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False,
+    )
+
+    def __repr__(self) -> str:
+        return f"<DeliveryCursor user={self.user_id} peer={self.peer_id} delivered={self.delivered_id}>"
+
+
+class ReadCursor(Base):
+    """
+    Highest message id from peer_id that user_id has read.
+    """
+    __tablename__ = "read_cursors"
+
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    peer_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    read_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False,
+    )
+
+    def __repr__(self) -> str:
+        return f"<ReadCursor user={self.user_id} peer={self.peer_id} read={self.read_id}>"
@@ -0,0 +1,76 @@
+# backend/app/models/room.py
+
+"""
+ORM models for group conversations (rooms).
+
+A room message is stored once in room_messages, however many members the
+room has; who receives it is resolved from room_members (on connect) and
+the in-memory membership index of ConnectionManager (on send).
+"""
+
+from sqlalchemy import Column, Integer, ForeignKey, String, Text, DateTime, Index, func
+from app.db.base import Base
+
+
+class Room(Base):
+    __tablename__ = "rooms"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False)
+    created_by = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="SET NULL"),
+        nullable=True,
+    )
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<Room id={self.id} name={self.name!r}>"
+
+
+class RoomMember(Base):
+    __tablename__ = "room_members"
+    __table_args__ = (
+        # A user's rooms, loaded when their first session connects
+        Index("ix_room_members_user", "user_id", "room_id"),
+    )
+
+    room_id = Column(
+        Integer,
+        ForeignKey("rooms.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    joined_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<RoomMember room={self.room_id} user={self.user_id}>"
+
+
+class RoomMessage(Base):
+    __tablename__ = "room_messages"
+    __table_args__ = (
+        # Keyset pagination of one room's history
+        Index("ix_room_messages_room", "room_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    room_id = Column(
+        Integer,
+        ForeignKey("rooms.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    sender_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    content = Column(Text, nullable=False)
+    timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<RoomMessage id={self.id} room={self.room_id} from={self.sender_id}>"
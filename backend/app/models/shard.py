@@ -0,0 +1,48 @@
+# backend/app/models/shard.py
+
+"""
+ORM models for conversation-keyed sharding (see app.db.shards).
+
+Conversations are hashed into a fixed number of slots. The primary
+database maps each slot to the shard that holds its conversations
+(shard_slots) and hands out message ids that are unique across shards
+(message_id_counters); every shard lists the slots it currently accepts
+writes for (owned_slots), which fences writers still routing with a stale
+slot map while a slot is moved.
+"""
+
+from sqlalchemy import Column, Integer, String
+from app.db.base import Base
+
+
+class ShardSlot(Base):
+    """
+    Slot -> shard map (primary database only).
+    """
+    __tablename__ = "shard_slots"
+
+    slot = Column(Integer, primary_key=True, autoincrement=False)
+    shard = Column(Integer, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<ShardSlot {self.slot} -> shard {self.shard}>"
+
+
+class OwnedSlot(Base):
+    """
+    A slot whose conversations this shard accepts writes for (every shard).
+    """
+    __tablename__ = "owned_slots"
+
+    slot = Column(Integer, primary_key=True, autoincrement=False)
+
+
+class MessageIdCounter(Base):
+    """
+    Next message id to hand out when messages are spread over several
+    shards (primary database only).
+    """
+    __tablename__ = "message_id_counters"
+
+    name = Column(String(32), primary_key=True)
+    next_id = Column(Integer, nullable=False)
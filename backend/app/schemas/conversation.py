@@ -0,0 +1,17 @@
+# backend/app/schemas/conversation.py
+
+from datetime import datetime
+from pydantic import BaseModel, Field
+
+
+class ConversationRead(BaseModel):
+    """
+    One entry of the authenticated user's conversation list.
+    """
+    peer_id: int = Field(..., example=2, description="The other participant")
+    last_message_id: int = Field(..., example=42)
+    last_sender_id: int = Field(..., example=2)
+    last_preview: str = Field(..., example="See you tomorrow!", description="Start of the last message")
+    last_timestamp: datetime = Field(..., example="2025-05-22T12:34:56Z")
+    last_seq: int = Field(..., example=42, description="seq of the last message")
+    unread_count: int = Field(..., example=3, description="Messages from the peer not yet read")
@@ -1,6 +1,7 @@
 # backend/app/schemas/message.py
 
 from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel, Field
 
 
@@ -30,6 +31,23 @@ class MessageRead(MessageBase):
         example="2025-05-22T12:34:56Z",
         description="ISO 8601 timestamp when the message was created"
     )
+    body_length: Optional[int] = Field(
+        None,
+        example=250000,
+        description="Set when content is only a preview: length of the full body, "
+                    "served by /messages/{id}/content"
+    )
+    seq: Optional[int] = Field(
+        None,
+        example=17,
+        description="Position in the conversation: consecutive for each user pair, "
+                    "so a jump means messages are missing"
+    )
+    client_msg_id: Optional[str] = Field(
+        None,
+        example="3f2b8c1e-msg-1",
+        description="Id the sending client chose for the message, if any"
+    )
 
     class Config:
         orm_mode = True
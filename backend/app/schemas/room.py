@@ -0,0 +1,47 @@
+# backend/app/schemas/room.py
+
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+
+class RoomCreate(BaseModel):
+    """
+    Properties required for creating a room; the creator is always a member.
+    """
+    name: str = Field(..., min_length=1, max_length=100, example="Weekend plans")
+    member_ids: List[int] = Field(default_factory=list, example=[2, 3], description="Initial members")
+
+
+class RoomMembersAdd(BaseModel):
+    """
+    Users to add to a room.
+    """
+    user_ids: List[int] = Field(..., min_items=1, example=[4, 5])
+
+
+class RoomRead(BaseModel):
+    """
+    Properties returned when reading a room.
+    """
+    id: int = Field(..., example=1)
+    name: str = Field(..., example="Weekend plans")
+    created_by: Optional[int] = Field(None, example=1)
+    created_at: datetime = Field(..., example="2025-05-22T12:34:56Z")
+
+    class Config:
+        orm_mode = True
+
+
+class RoomMessageRead(BaseModel):
+    """
+    Properties returned when reading a room message.
+    """
+    id: int = Field(..., example=1)
+    room_id: int = Field(..., example=1)
+    sender_id: int = Field(..., example=1)
+    content: str = Field(..., example="Hello everyone!")
+    timestamp: datetime = Field(..., example="2025-05-22T12:34:56Z")
+
+    class Config:
+        orm_mode = True
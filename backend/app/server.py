@@ -0,0 +1,119 @@
+# backend/app/server.py
+
+"""
+Run the API with uvicorn, applying the WebSocket settings from app.core.config.
+
+Usage (from the backend directory):
+    python -m app.server --host 0.0.0.0 --port 8000
+
+Compared to `uvicorn app.main:app`, this enforces WS_MAX_FRAME_BYTES in the
+WebSocket implementation itself and tunes permessage-deflate: the window
+size and zlib level are configurable, and frames smaller than
+WS_DEFLATE_MIN_BYTES are sent uncompressed (RFC 7692 allows this per
+message), which saves CPU on the many small frames where deflate gains
+nothing. uvicorn's own keepalive pings (a timer per socket) are turned off
+when the application heartbeat is enabled, since the heartbeat sweep
+already detects dead connections (see app.core.connection_manager).
+"""
+
+import argparse
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+from websockets.frames import OP_BINARY, OP_TEXT
+
+from app.core.config import (
+    WS_DEFLATE_LEVEL,
+    WS_DEFLATE_MAX_WINDOW_BITS,
+    WS_DEFLATE_MIN_BYTES,
+    WS_HEARTBEAT_INTERVAL,
+    WS_MAX_FRAME_BYTES,
+    WS_PER_MESSAGE_DEFLATE,
+)
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """
+    permessage-deflate that leaves small single-frame messages uncompressed.
+    """
+
+    def __init__(self, *args: Any, min_size: int = 0, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+
+    def encode(self, frame):
+        if frame.opcode in (OP_TEXT, OP_BINARY) and frame.fin and len(frame.data) < self.min_size:
+            return frame
+        return super().encode(frame)
+
+
+class ThresholdDeflateFactory(ServerPerMessageDeflateFactory):
+    def __init__(self, min_size: int, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.min_size = min_size
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size,
+        )
+
+
+class ChatWebSocketProtocol(WebSocketProtocol):
+    """
+    uvicorn's websockets protocol with the tuned permessage-deflate extension.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        if self.config.ws_per_message_deflate:
+            self.available_extensions = [ThresholdDeflateFactory(
+                min_size=WS_DEFLATE_MIN_BYTES,
+                server_max_window_bits=WS_DEFLATE_MAX_WINDOW_BITS,
+                compress_settings={"level": WS_DEFLATE_LEVEL},
+            )]
+
+
+def websocket_options() -> Dict[str, Any]:
+    """
+    uvicorn.Config keyword arguments for the chat WebSocket settings.
+    """
+    options: Dict[str, Any] = {
+        "ws": ChatWebSocketProtocol,
+        "ws_max_size": WS_MAX_FRAME_BYTES,
+        "ws_per_message_deflate": WS_PER_MESSAGE_DEFLATE,
+    }
+    if WS_HEARTBEAT_INTERVAL > 0:
+        options.update(ws_ping_interval=None, ws_ping_timeout=None)
+    return options
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m app.server", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--reload", action="store_true")
+    args = parser.parse_args(argv)
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        reload=args.reload,
+        **websocket_options(),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+# backend/benchmarks/chat_bench.py
+
+"""
+Load-test and benchmark harness for the chat backend.
+
+Starts the app in-process with uvicorn against SQLite (a fresh temporary
+file by default) or any DATABASE_URL, then drives it over real sockets:
+
+    1. register + login  (M REST clients + N WebSocket users)
+    2. connect           (N WebSocket clients)
+    3. send              (each WebSocket client sends K messages to a peer)
+    4. history           (M REST clients page through history R times each)
+
+and prints a JSON report: throughput, p50/p99 latencies, DB statements per
+operation (counted on the app's engine) and traced memory per WebSocket
+connection. Running in one process keeps query counts exact and the setup
+reproducible; memory per connection therefore includes the client side.
+
+Usage (from the backend directory; requires httpx):
+    python -m benchmarks.chat_bench --ws-clients 50 --messages 100 -o bench.json
+    python -m benchmarks.chat_bench --baseline bench.json --max-regression 0.2
+    python -m benchmarks.chat_bench --protocol msgpack --batch
+
+With --baseline the run exits with status 1 if message throughput drops, or
+delivery / history p99 latency grows, by more than --max-regression.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional benchmark dependency
+    httpx = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional benchmark dependency
+    msgpack = None
+
+PASSWORD = "bench-password"
+
+
+def _percentile(samples: List[float], pct: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def _latency_report(samples: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(samples),
+        "p50_ms": _ms(_percentile(samples, 50)),
+        "p99_ms": _ms(_percentile(samples, 99)),
+        "mean_ms": _ms(statistics.fmean(samples)) if samples else None,
+    }
+
+
+class QueryCounter:
+    """
+    Counts statements executed on the app's engine.
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.results: Dict[str, Any] = {}
+
+    async def run(self) -> Dict[str, Any]:
+        import uvicorn
+        from app.main import app
+        from app.db.session import engine
+        from app.server import websocket_options
+
+        engine.echo = False
+        self.queries = QueryCounter(engine)
+
+        config = uvicorn.Config(
+            app, host="127.0.0.1", port=0, log_level="warning", lifespan="on", **websocket_options()
+        )
+        server = uvicorn.Server(config)
+        serve_task = asyncio.create_task(server.serve())
+        while not server.started:
+            if serve_task.done():
+                serve_task.result()
+            await asyncio.sleep(0.05)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.ws_url = f"ws://127.0.0.1:{port}/api/v1/chat/ws"
+
+        try:
+            async with httpx.AsyncClient(base_url=self.base_url, timeout=60) as client:
+                self.client = client
+                users = await self.phase_auth()
+                sockets = await self.phase_connect(users["ws"])
+                try:
+                    await self.phase_send(users["ws"], sockets)
+                finally:
+                    await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+                await self.phase_history(users)
+        finally:
+            server.should_exit = True
+            await serve_task
+
+        return {
+            "config": {
+                "database_url": os.environ["DATABASE_URL"],
+                "ws_clients": self.args.ws_clients,
+                "rest_clients": self.args.rest_clients,
+                "messages_per_client": self.args.messages,
+                "history_requests_per_client": self.args.history_requests,
+                "bcrypt_rounds": int(os.environ["BCRYPT_ROUNDS"]),
+                "protocol": self.args.protocol,
+                "batch": self.args.batch,
+            },
+            "results": self.results,
+        }
+
+    def encode(self, message: Dict[str, Any]):
+        if self.args.protocol == "msgpack":
+            return msgpack.packb(message)
+        return json.dumps(message)
+
+    def decode(self, raw) -> Any:
+        if self.args.protocol == "msgpack":
+            return msgpack.unpackb(raw)
+        return json.loads(raw)
+
+    async def _timed(self, samples: List[float], coro):
+        start = time.perf_counter()
+        result = await coro
+        samples.append(time.perf_counter() - start)
+        return result
+
+    async def phase_auth(self) -> Dict[str, List[Dict[str, Any]]]:
+        run_id = int(time.time() * 1000)
+        names = [f"bench{run_id}_{i}" for i in range(self.args.ws_clients + self.args.rest_clients)]
+        register_lat: List[float] = []
+        login_lat: List[float] = []
+
+        async def register(name):
+            r = await self._timed(register_lat, self.client.post(
+                "/api/v1/users/register",
+                json={"username": name, "email": f"{name}@bench.example.com", "password": PASSWORD},
+            ))
+            r.raise_for_status()
+            return r.json()
+
+        async def login(user):
+            r = await self._timed(login_lat, self.client.post(
+                "/api/v1/users/login",
+                data={"username": user["username"], "password": PASSWORD},
+            ))
+            r.raise_for_status()
+            user["token"] = r.json()["access_token"]
+            return user
+
+        before = self.queries.count
+        users = await asyncio.gather(*(register(n) for n in names))
+        self.results["register"] = {
+            **_latency_report(register_lat),
+            "queries_per_op": (self.queries.count - before) / len(names),
+        }
+        before = self.queries.count
+        users = await asyncio.gather(*(login(u) for u in users))
+        self.results["login"] = {
+            **_latency_report(login_lat),
+            "queries_per_op": (self.queries.count - before) / len(names),
+        }
+        return {"ws": users[:self.args.ws_clients], "rest": users[self.args.ws_clients:]}
+
+    async def phase_connect(self, users: List[Dict[str, Any]]):
+        import websockets
+
+        connect_lat: List[float] = []
+
+        query = "&batch=1" if self.args.batch else ""
+        subprotocols = [f"nextext.{self.args.protocol}"]
+
+        def connect(user):
+            return self._timed(connect_lat, websockets.connect(
+                f"{self.ws_url}?token={user['token']}{query}", subprotocols=subprotocols
+            ))
+
+        # The first connection warms lazy imports and statement caches and is
+        # left out of the per-connection figures.
+        sockets = [await connect(users[0])]
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        before = self.queries.count
+        sockets += await asyncio.gather(*(connect(u) for u in users[1:]))
+        await asyncio.sleep(0.2)
+        used = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        measured = max(len(users) - 1, 1)
+        self.results["connect"] = {
+            **_latency_report(connect_lat),
+            "queries_per_op": (self.queries.count - before) / measured,
+            "bytes_per_connection": round(used / measured),
+        }
+        return sockets
+
+    async def phase_send(self, users: List[Dict[str, Any]], sockets):
+        n = len(users)
+        k = self.args.messages
+        delivery_lat: List[float] = []
+        ack_lat: List[float] = []
+        expected = n * k
+        delivered = 0
+        all_delivered = asyncio.Event()
+        sent_at: Dict[str, float] = {}
+        acks: Dict[str, asyncio.Future] = {}
+
+        async def reader(index, ws):
+            nonlocal delivered
+            me = users[index]["id"]
+            async for raw in ws:
+                frames = self.decode(raw)
+                if isinstance(frames, dict) and frames.get("type") == "batch":
+                    frames = frames["frames"]
+                for frame in frames if isinstance(frames, list) else [frames]:
+                    tag = str(frame.get("content", ""))
+                    if not tag.startswith("bench:"):
+                        continue
+                    now = time.perf_counter()
+                    if frame.get("sender_id") == me:
+                        future = acks.pop(tag, None)
+                        if future is not None and not future.done():
+                            future.set_result(now)
+                    else:
+                        delivery_lat.append(now - sent_at[tag])
+                        delivered += 1
+                        if delivered >= expected:
+                            all_delivered.set()
+
+        async def sender(index, ws):
+            peer = users[(index + 1) % n]["id"]
+            for j in range(k):
+                tag = f"bench:{index}:{j}"
+                acks[tag] = asyncio.get_running_loop().create_future()
+                sent_at[tag] = time.perf_counter()
+                await ws.send(self.encode({"to": peer, "content": tag}))
+                ack_lat.append(await acks[tag] - sent_at[tag])
+
+        readers = [asyncio.create_task(reader(i, ws)) for i, ws in enumerate(sockets)]
+        before = self.queries.count
+        start = time.perf_counter()
+        await asyncio.gather(*(sender(i, ws) for i, ws in enumerate(sockets)))
+        try:
+            await asyncio.wait_for(all_delivered.wait(), timeout=30)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - start
+        for task in readers:
+            task.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+
+        self.results["send"] = {
+            "messages": expected,
+            "delivered": delivered,
+            "elapsed_s": round(elapsed, 3),
+            "messages_per_sec": round(delivered / elapsed, 1) if elapsed else None,
+            "delivery": _latency_report(delivery_lat),
+            "ack": _latency_report(ack_lat),
+            "queries_per_message": (self.queries.count - before) / max(expected, 1),
+        }
+
+    async def phase_history(self, users: Dict[str, List[Dict[str, Any]]]):
+        peers = users["ws"] or users["rest"]
+        history_lat: List[float] = []
+
+        async def browse(index, user):
+            headers = {"Authorization": f"Bearer {user['token']}"}
+            for j in range(self.args.history_requests):
+                peer = peers[(index + j) % len(peers)]["id"]
+                r = await self._timed(history_lat, self.client.get(
+                    f"/api/v1/chat/history/{peer}", params={"limit": 50}, headers=headers
+                ))
+                r.raise_for_status()
+
+        clients = users["rest"] or users["ws"]
+        before = self.queries.count
+        start = time.perf_counter()
+        await asyncio.gather(*(browse(i, u) for i, u in enumerate(clients)))
+        elapsed = time.perf_counter() - start
+        total = len(clients) * self.args.history_requests
+        self.results["history"] = {
+            **_latency_report(history_lat),
+            "requests_per_sec": round(total / elapsed, 1) if elapsed else None,
+            "queries_per_op": (self.queries.count - before) / max(total, 1),
+        }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Return the list of metrics that regressed beyond `tolerance` (a fraction).
+    """
+    regressions = []
+    checks = [
+        (("send", "messages_per_sec"), True),
+        (("send", "delivery", "p99_ms"), False),
+        (("history", "p99_ms"), False),
+    ]
+    for path, higher_is_better in checks:
+        current, previous = report["results"], baseline["results"]
+        for key in path:
+            current, previous = (current or {}).get(key), (previous or {}).get(key)
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{'.'.join(path)}: {previous} -> {current} ({change:+.1%})")
+    return regressions
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.chat_bench")
+    parser.add_argument("--database-url", help="Default: a fresh temporary SQLite file")
+    parser.add_argument("--ws-clients", type=int, default=20)
+    parser.add_argument("--rest-clients", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=50, help="Messages per WebSocket client")
+    parser.add_argument("--history-requests", type=int, default=20, help="History calls per REST client")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4,
+                        help="Cost factor for benchmark users (keeps setup fast)")
+    parser.add_argument("--protocol", choices=("json", "msgpack"), default="json",
+                        help="WebSocket wire codec (msgpack needs the msgpack package)")
+    parser.add_argument("--batch", action="store_true", help="Accept batched frames (?batch=1)")
+    parser.add_argument("-o", "--output", help="Write the JSON report here as well as stdout")
+    parser.add_argument("--baseline", help="Previous JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    args = build_parser().parse_args(argv)
+    if httpx is None:
+        sys.exit("The benchmark needs httpx: pip install httpx")
+    if args.protocol == "msgpack" and msgpack is None:
+        sys.exit("--protocol msgpack needs msgpack: pip install msgpack")
+
+    # Configure the app before it is imported
+    os.environ["DATABASE_URL"] = args.database_url or (
+        f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='nextext-bench-')}/bench.db"
+    )
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    # Every simulated client shares one IP and sends flat out; measure the
+    # server, not the rate limiter (unless limits are set explicitly)
+    for name in ("LOGIN", "LOGIN_USER", "REGISTER", "WS_CONNECT", "WS_FRAMES", "WS_MESSAGES"):
+        os.environ.setdefault(f"RATE_LIMIT_{name}", "1000000/1")
+
+    report = asyncio.run(Benchmark(args).run())
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
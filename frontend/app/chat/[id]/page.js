@@ -1,12 +1,15 @@
 "use client";
 
-import { useState, useEffect, useRef } from "react";
+import { useState, useEffect, useLayoutEffect, useRef } from "react";
 import { useParams, useRouter } from "next/navigation";
 import api from "@/utils/api";
 import { useAuth } from "@/context/AuthContext";
 import { FiSend, FiChevronLeft } from "react-icons/fi";
 import { motion } from "framer-motion";
 
+// Messages per history request; a shorter page means there is nothing older
+const PAGE_SIZE = 50;
+
 export default function ChatPage() {
   const { id } = useParams();
   const router = useRouter();
@@ -15,8 +18,14 @@ export default function ChatPage() {
   const [partner, setPartner] = useState(null);
   const [messages, setMessages] = useState([]);
   const [newMessage, setNewMessage] = useState("");
+  const [hasOlder, setHasOlder] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const wsRef = useRef(null);
   const scrollRef = useRef(null);
+  const listRef = useRef(null);
+  const lastIdRef = useRef(null);
+  // Scroll height before older messages were prepended, to keep the view in place
+  const prependedFromRef = useRef(null);
 
   useEffect(() => {
     if (!currentUser) router.replace("/login");
@@ -29,8 +38,9 @@ export default function ChatPage() {
         const { data: userData } = await api.get(`/users?skip=0&limit=1&q=${id}`);
         setPartner(userData[0] || { username: `User ${id}` });
 
-        const { data } = await api.get(`/chat/history/${id}`);
+        const { data } = await api.get(`/chat/history/${id}?limit=${PAGE_SIZE}`);
         setMessages(data);
+        setHasOlder(data.length === PAGE_SIZE);
       } catch {
         logout();
       }
@@ -47,6 +57,10 @@ export default function ChatPage() {
 
     socket.onmessage = (e) => {
       const msg = JSON.parse(e.data);
+      if (msg.type === "ping") {
+        socket.send(JSON.stringify({ type: "pong" }));
+        return;
+      }
       const isToThisUser =
         (msg.sender_id === currentUser.id && msg.recipient_id === +id) ||
         (msg.sender_id === +id && msg.recipient_id === currentUser.id);
@@ -58,10 +72,37 @@ export default function ChatPage() {
     return () => socket.close();
   }, [token, currentUser, id]);
 
-  useEffect(() => {
-    scrollRef.current?.scrollIntoView({ behavior: "smooth" });
+  useLayoutEffect(() => {
+    if (prependedFromRef.current !== null) {
+      const list = listRef.current;
+      list.scrollTop += list.scrollHeight - prependedFromRef.current;
+      prependedFromRef.current = null;
+    }
+    // Only a new latest message scrolls to the bottom
+    const lastId = messages[messages.length - 1]?.id ?? null;
+    if (lastId !== lastIdRef.current) {
+      lastIdRef.current = lastId;
+      scrollRef.current?.scrollIntoView({ behavior: "smooth" });
+    }
   }, [messages]);
 
+  const loadOlder = async () => {
+    if (loadingOlder || !messages.length) return;
+    setLoadingOlder(true);
+    try {
+      const { data } = await api.get(
+        `/chat/history/${id}?before_id=${messages[0].id}&limit=${PAGE_SIZE}`
+      );
+      prependedFromRef.current = listRef.current.scrollHeight;
+      setMessages((prev) => [...data, ...prev]);
+      setHasOlder(data.length === PAGE_SIZE);
+    } catch {
+      logout();
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const handleSend = () => {
     const text = newMessage.trim();
     if (!text) return;
@@ -90,7 +131,16 @@ export default function ChatPage() {
       </header>
 
       {/* Messages */}
-      <main className="flex-1 overflow-y-auto px-5 py-6 space-y-4">
+      <main ref={listRef} className="flex-1 overflow-y-auto px-5 py-6 space-y-4">
+        {hasOlder && (
+          <button
+            onClick={loadOlder}
+            disabled={loadingOlder}
+            className="block mx-auto px-4 py-1 text-xs text-gray-300 bg-gray-800 rounded-full hover:bg-gray-700 disabled:opacity-50"
+          >
+            {loadingOlder ? "Loading..." : "Load older messages"}
+          </button>
+        )}
         {messages.map((m) => {
           const isMe = m.sender_id === currentUser.id;
           return (